@@ -0,0 +1,224 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+
+Benchmark of extraction of data from Last.fm and YouTube pages scraped when the APIs are unavailable.
+Compares parse time and peak memory of bot.fetching.extract with BeautifulSoup
+and with parsing of the whole ytInitialData block.
+
+Run it from the root of the repository:
+    python -m benchmarks.extraction
+Pages saved from last.fm can be used instead of the generated ones:
+    curl -L https://www.last.fm/music/Nirvana/+tracks?date_preset=ALL -o tracks.html
+    curl -L https://www.last.fm/music/Nirvana/+wiki -o wiki.html
+    curl -L "https://www.youtube.com/results?search_query=Nirvana+-+Lithium" -o results.html
+    python -m benchmarks.extraction --tracks tracks.html --wiki wiki.html --results results.html
+"""
+
+
+import argparse
+import json
+import re
+import time
+import tracemalloc
+from typing import Any, Callable, List, Tuple
+
+import bs4
+
+from bot.fetching.extract import extract_bio, extract_toptracks, extract_video_id
+
+
+def generate_tracks_page(artist: str = "Artist", rows: int = 50) -> bytes:
+    """Generate a page with the markup of a Last.fm tracks chart of a typical size."""
+    nav = "".join(
+        f'<li><a class="navlist-item" href="/nav/{i}" title="Section {i}">Section {i}</a></li>'
+        for i in range(200)
+    )
+    chart = "".join(
+        f'<tr class="chartlist-row" data-index="{i}">'
+        f'<td class="chartlist-index">{i + 1}</td>'
+        f'<td class="chartlist-play"><a class="chartlist-play-button" href="/play/{i}">'
+        f'<span class="chartlist-play-image"></span></a></td>'
+        f'<td class="chartlist-image"><img src="/img/{i}.jpg" alt="Track {i}"></td>'
+        f'<td class="chartlist-name"><a href="/music/Artist/_/Track+{i}" title="Track {i}">Track {i}</a></td>'
+        f'<td class="chartlist-bar"><span class="chartlist-count-bar">'
+        f'<span class="chartlist-count-bar-value">{1000000 - i} listeners</span></span></td>'
+        f"</tr>"
+        for i in range(rows)
+    )
+    script = "<script>window.data = {%s};</script>" % ",".join(
+        f'"key{i}": "{"x" * 64}"' for i in range(2000)
+    )
+    return (
+        f"<!DOCTYPE html><html><head><title>{artist}</title>{script}</head><body>"
+        f'<nav><ul class="navlist">{nav}</ul></nav>'
+        f'<header><h1 class="header-new-title" itemprop="name">{artist}</h1></header>'
+        f'<table class="chartlist"><tbody>{chart}</tbody></table>'
+        f'<footer><ul class="footer-links">{nav}</ul></footer>'
+        f"</body></html>"
+    ).encode()
+
+
+def generate_wiki_page(artist: str = "Artist") -> bytes:
+    """Generate a page with the markup of a Last.fm wiki page of a typical size."""
+    nav = "".join(
+        f'<li><a class="navlist-item" href="/nav/{i}" title="Section {i}">Section {i}</a></li>'
+        for i in range(200)
+    )
+    wiki = "".join(f"<p>{'Paragraph of the artist bio. ' * 20}</p>" for _ in range(30))
+    similar = "".join(
+        f'<li><a class="link-block-target" href="/music/Similar+{i}">Similar {i}</a></li>'
+        for i in range(8)
+    )
+    return (
+        f"<!DOCTYPE html><html><head><title>{artist}</title></head><body>"
+        f'<nav><ul class="navlist">{nav}</ul></nav>'
+        f'<header><h1 class="header-new-title" itemprop="name">{artist}</h1></header>'
+        f'<div class="wiki-content">{wiki}</div>'
+        f'<section class="buffer-standard hidden-xs"><ol>{similar}</ol></section>'
+        f'<footer><ul class="footer-links">{nav}</ul></footer>'
+        f"</body></html>"
+    ).encode()
+
+
+def generate_results_page(video_id: str = "video", videos: int = 20) -> bytes:
+    """Generate a page with the markup of YouTube search results of a typical size."""
+    renderers = [
+        {
+            "videoRenderer": {
+                "videoId": f"{video_id}{i:06d}"[-11:],
+                "thumbnail": {
+                    "thumbnails": [
+                        {"url": f"https://i.ytimg.com/vi/{i}/{size}.jpg", "width": size}
+                        for size in (120, 240, 360, 480)
+                    ]
+                },
+                "title": {"runs": [{"text": f"Artist - Track {i} (Official Video)"}]},
+                "descriptionSnippet": {"runs": [{"text": "Description. " * 30}]},
+                "navigationEndpoint": {
+                    "watchEndpoint": {"videoId": f"{video_id}{i:06d}"[-11:]}
+                },
+            }
+        }
+        for i in range(videos)
+    ]
+    data = {
+        "responseContext": {"serviceTrackingParams": [{"key": "x" * 64}] * 200},
+        "contents": {
+            "twoColumnSearchResultsRenderer": {
+                "primaryContents": {
+                    "sectionListRenderer": {
+                        "contents": [{"itemSectionRenderer": {"contents": renderers}}]
+                    }
+                }
+            }
+        },
+        "frameworkUpdates": {"entityBatchUpdate": [{"payload": "y" * 512}] * 400},
+    }
+    data_json = json.dumps(data, separators=(",", ":"))
+    scripts = "".join(
+        f"<script>var chunk{i} = '{'z' * 4096}';</script>" for i in range(50)
+    )
+    return (
+        f"<!DOCTYPE html><html><head>{scripts}</head><body>"
+        f"<script>var ytInitialData = {data_json};</script>"
+        f"</body></html>"
+    ).encode()
+
+
+def bs4_toptracks(content: bytes, number: int = 3) -> Tuple[str, List[str]]:
+    """Extraction of top tracks as it was done with BeautifulSoup."""
+    soup = bs4.BeautifulSoup(content, "lxml")
+    artist = soup.find("h1", attrs={"class": "header-new-title"}).text.strip()
+    tracks = soup.find_all("a", attrs={"class": "", "title": re.compile(r".*?")})
+    return artist, [tracks[i].get("title") for i in range(min(number, len(tracks)))]
+
+
+def bs4_bio(content: bytes, name_only: bool = False) -> Tuple[str, str, List[str]]:
+    """Extraction of a bio as it was done with BeautifulSoup."""
+    soup = bs4.BeautifulSoup(content, "lxml")
+    name = soup.find("h1", attrs={"class": "header-new-title"}).text.strip()
+    summary = soup.find("div", attrs={"class": "wiki-content"}).text.strip()[:600]
+    similar_block = soup.find("section", attrs={"class": "buffer-standard hidden-xs"})
+    similar = similar_block.find_all("a", attrs={"class": "link-block-target"})
+    return name, summary, [item.text for item in similar]
+
+
+def json_video_id(content: bytes) -> str:
+    """Extraction of a video ID as it was done by parsing the whole ytInitialData block."""
+    match = re.search("var ytInitialData = (?P<json>{.+});<", content.decode())
+    data = json.loads(match.group("json"))  # type: ignore
+    # fmt:off
+    slr = data["contents"]["twoColumnSearchResultsRenderer"]["primaryContents"]["sectionListRenderer"]
+    return slr["contents"][0]["itemSectionRenderer"]["contents"][0]["videoRenderer"]["videoId"]
+    # fmt:on
+
+
+def measure(
+    func: Callable[[bytes], Any], page: bytes, repeat: int
+) -> Tuple[float, float]:
+    """
+    Measure extraction of data from a page. Memory is measured with tracemalloc,
+    so nodes of the tree kept by libxml2 while it is pruned are not counted.
+    :param func: Extraction function.
+    :param page: HTML page.
+    :param repeat: Number of calls.
+    :return: Median time of a call in milliseconds and peak memory in KiB.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(page)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sorted(times)[len(times) // 2] * 1000, peak / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--tracks", help="saved page of top tracks of an artist")
+    parser.add_argument("--wiki", help="saved wiki page of an artist")
+    parser.add_argument("--results", help="saved page of YouTube search results")
+    parser.add_argument("--repeat", type=int, default=50, help="number of runs")
+    args = parser.parse_args()
+    if args.tracks:
+        with open(args.tracks, "rb") as f:
+            tracks_page = f.read()
+    else:
+        tracks_page = generate_tracks_page()
+    if args.wiki:
+        with open(args.wiki, "rb") as f:
+            wiki_page = f.read()
+    else:
+        wiki_page = generate_wiki_page()
+    if args.results:
+        with open(args.results, "rb") as f:
+            results_page = f.read()
+    else:
+        results_page = generate_results_page()
+
+    cases = [
+        ("toptracks", tracks_page, bs4_toptracks, extract_toptracks),
+        ("bio", wiki_page, bs4_bio, extract_bio),
+        ("video_id", results_page, json_video_id, extract_video_id),
+    ]
+    print(f"{'case':<12}{'parser':<10}{'median, ms':>12}{'peak, KiB':>12}")
+    for name, page, reference, extractor in cases:
+        if reference(page) != extractor(page):
+            raise AssertionError(f"Results of {name} extraction differ")
+        for parser_name, func in (("before", reference), ("extract", extractor)):
+            median, peak = measure(func, page, args.repeat)
+            print(f"{name:<12}{parser_name:<10}{median:>12.2f}{peak:>12.0f}")
+    print(
+        f"page sizes: tracks {len(tracks_page)} bytes, wiki {len(wiki_page)} bytes, "
+        f"results {len(results_page)} bytes"
+    )
+
+
+if __name__ == "__main__":
+    main()
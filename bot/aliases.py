@@ -0,0 +1,72 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from bot.cache import TTLCache
+from bot.config import ALIAS_MISS_TTL, ALIAS_VALID_FOR_DAYS, CACHE_MAX_ENTRIES
+from bot.db import acquire
+
+
+# in-memory index of the alias table
+alias_cache = TTLCache("alias", CACHE_MAX_ENTRIES)
+# cached for keyphrases without a valid alias to not query the table for them again
+NO_ALIAS = object()
+
+logger = logging.getLogger("aliases")
+logger.setLevel(logging.DEBUG)
+
+
+def _expiration(day: date) -> float:
+    return datetime.combine(
+        day + timedelta(days=ALIAS_VALID_FOR_DAYS), time.min
+    ).timestamp()
+
+
+async def get_alias(keyphrase: str) -> Optional[str]:
+    """
+    Get an artist name previously learned for the given keyphrase.
+    :param keyphrase: Normalized keyphrase.
+    :return: Artist name or None if there is no valid alias.
+    """
+    artist = alias_cache.get(keyphrase)
+    if artist is NO_ALIAS:
+        return None
+    if artist is not None:
+        return artist
+    async with acquire() as conn:
+        record = await conn.fetchrow(
+            "SELECT artist, date FROM alias WHERE keyphrase = $1", keyphrase
+        )
+    now = datetime.now().timestamp()
+    expires = None if record is None else _expiration(record["date"])
+    if expires is None or expires <= now:
+        if ALIAS_MISS_TTL:
+            alias_cache.set(keyphrase, NO_ALIAS, now + ALIAS_MISS_TTL)
+        return None
+    alias_cache.set(keyphrase, record["artist"], expires)
+    return record["artist"]
+
+
+async def save_alias(keyphrase: str, artist: str) -> None:
+    """
+    Remember the artist name the given keyphrase was corrected to.
+    :param keyphrase: Normalized keyphrase.
+    :param artist: Artist name.
+    """
+    today = datetime.now().date()
+    query = """INSERT INTO alias (keyphrase, artist, date)
+               VALUES($1, $2, $3)
+               ON CONFLICT (keyphrase)
+               DO UPDATE SET artist = $2, date = $3"""
+    async with acquire() as conn:
+        await conn.execute(query, keyphrase, artist, today)
+    alias_cache.set(keyphrase, artist, _expiration(today))
+    logger.debug(f"Saved alias '{keyphrase}' for '{artist}'")
@@ -0,0 +1,100 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+from bot.metrics import Counter, Gauge
+
+
+HITS = Counter("ttbot_cache_hits_total", "Lookups served from cache", ("cache",))
+MISSES = Counter("ttbot_cache_misses_total", "Lookups not found in cache", ("cache",))
+EVICTIONS = Counter(
+    "ttbot_cache_evictions_total",
+    "Entries evicted from cache to stay within its size",
+    ("cache",),
+)
+EXPIRATIONS = Counter(
+    "ttbot_cache_expirations_total", "Entries dropped from cache as expired", ("cache",)
+)
+ENTRIES = Gauge("ttbot_cache_entries", "Number of entries in cache", ("cache",))
+
+
+class TTLCache:
+    """
+    In-memory mapping with per-entry expiration time
+    and least recently used eviction once max_entries is reached.
+    """
+
+    def __init__(self, name: str, max_entries: int):
+        """
+        :param name: Name of the cache used as a label of its metrics.
+        :param max_entries: Max number of entries to keep.
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > time.time()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a value and mark it as recently used.
+        :param key: Key of the entry.
+        :return: Cached value or None if there is no valid entry for the key.
+        """
+        item = self._data.get(key)
+        if item is None:
+            MISSES.inc(cache=self.name)
+            return None
+        expires, value = item
+        if expires <= time.time():
+            self.pop(key)
+            EXPIRATIONS.inc(cache=self.name)
+            MISSES.inc(cache=self.name)
+            return None
+        self._data.move_to_end(key)
+        HITS.inc(cache=self.name)
+        return value
+
+    def set(self, key: Hashable, value: Any, expires: float) -> None:
+        """
+        Put a value into the cache evicting least recently used entries if needed.
+        :param key: Key of the entry.
+        :param value: Value to cache.
+        :param expires: Unix timestamp after which the entry is no longer valid.
+        """
+        if expires <= time.time():
+            return
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            EVICTIONS.inc(cache=self.name)
+        ENTRIES.set(len(self._data), cache=self.name)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """
+        Remove an entry from the cache.
+        :param key: Key of the entry.
+        :return: Removed value or None if there was no entry for the key.
+        """
+        item = self._data.pop(key, None)
+        ENTRIES.set(len(self._data), cache=self.name)
+        return item[1] if item is not None else None
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        self._data.clear()
+        ENTRIES.set(0, cache=self.name)
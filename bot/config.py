@@ -9,7 +9,75 @@ DATABASE_URI = os.getenv(
 )
 DBCONN_RETRIES = int(os.getenv("TTBOT_DBCONN_RETRIES", 5))
 DBCONN_TIMEOUT = int(os.getenv("TTBOT_DBCONN_TIMEOUT", 5))
+DB_POOL_MIN_SIZE = int(os.getenv("TTBOT_DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("TTBOT_DB_POOL_MAX_SIZE", 10))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("TTBOT_DB_ACQUIRE_TIMEOUT", 5))
+TOP_TRACKS = int(os.getenv("TTBOT_TOP_TRACKS", 3))
+TOP_MAX_TRACKS = int(os.getenv("TTBOT_TOP_MAX_TRACKS", 10))
 VALID_FOR_DAYS = int(os.getenv("TTBOT_VALID_FOR_DAYS", 30))
+MAX_STALE_DAYS = int(os.getenv("TTBOT_MAX_STALE_DAYS", 0))
+REQUESTS_FLUSH_INTERVAL = float(os.getenv("TTBOT_REQUESTS_FLUSH_INTERVAL", 10))
+CACHE_MAX_ENTRIES = int(os.getenv("TTBOT_CACHE_MAX_ENTRIES", 10000))
+CACHE_SYNC = bool(int(os.getenv("TTBOT_CACHE_SYNC", 1)))
+CACHE_SYNC_INTERVAL = float(os.getenv("TTBOT_CACHE_SYNC_INTERVAL", 5))
+ALIAS_VALID_FOR_DAYS = int(os.getenv("TTBOT_ALIAS_VALID_FOR_DAYS", 90))
+ALIAS_MISS_TTL = float(os.getenv("TTBOT_ALIAS_MISS_TTL", 300))
+VIDEO_VALID_FOR_DAYS = int(os.getenv("TTBOT_VIDEO_VALID_FOR_DAYS", 180))
 BOT_MODE = os.getenv("TTBOT_MODE", "dev")
+MAX_INFLIGHT_UPDATES = int(os.getenv("TTBOT_MAX_INFLIGHT_UPDATES", 64))
 WEBHOOK_PORT = int(os.getenv("TTBOT_WEBHOOK_PORT", "8443"))
+METRICS_PORT = int(os.getenv("TTBOT_METRICS_PORT", 0))
 HEROKU_APP = os.getenv("TTBOT_HEROKU_APP", "")
+REPLY_MODE = os.getenv("TTBOT_REPLY_MODE", "sequential")
+TELEGRAM_RATE = float(os.getenv("TTBOT_TELEGRAM_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.getenv("TTBOT_TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_CHAT_BURST = int(os.getenv("TTBOT_TELEGRAM_CHAT_BURST", 3))
+TELEGRAM_RETRIES = int(os.getenv("TTBOT_TELEGRAM_RETRIES", 3))
+TELEGRAM_API_URL = os.getenv("TTBOT_TELEGRAM_API_URL", "https://api.telegram.org/bot")
+LASTFM_API_URL = os.getenv("TTBOT_LASTFM_API_URL", "https://ws.audioscrobbler.com/2.0/")
+LASTFM_URL = os.getenv("TTBOT_LASTFM_URL", "https://www.last.fm")
+YOUTUBE_API_URL = os.getenv(
+    "TTBOT_YOUTUBE_API_URL", "https://www.googleapis.com/youtube/v3"
+)
+YOUTUBE_URL = os.getenv("TTBOT_YOUTUBE_URL", "https://www.youtube.com")
+YOUTUBE_REGION = os.getenv("TTBOT_YOUTUBE_REGION", "")
+HTTP_MAX_CONNECTIONS = int(os.getenv("TTBOT_HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("TTBOT_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("TTBOT_HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_TIMEOUT = float(os.getenv("TTBOT_HTTP_TIMEOUT", 5))
+HTTP2 = bool(int(os.getenv("TTBOT_HTTP2", 0)))
+LASTFM_API_RATE = float(os.getenv("TTBOT_LASTFM_API_RATE", 5))
+LASTFM_RATE = float(os.getenv("TTBOT_LASTFM_RATE", 0))
+YOUTUBE_API_RATE = float(os.getenv("TTBOT_YOUTUBE_API_RATE", 10))
+YOUTUBE_RATE = float(os.getenv("TTBOT_YOUTUBE_RATE", 0))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("TTBOT_RATE_LIMIT_MAX_WAIT", 2))
+RATE_LIMIT_BACKGROUND_MAX_WAIT = float(
+    os.getenv("TTBOT_RATE_LIMIT_BACKGROUND_MAX_WAIT", 60)
+)
+PARSE_WORKERS = int(os.getenv("TTBOT_PARSE_WORKERS", 0))
+PARSE_MAX_QUEUE = int(os.getenv("TTBOT_PARSE_MAX_QUEUE", 32))
+PARSE_INLINE_BYTES = int(os.getenv("TTBOT_PARSE_INLINE_BYTES", 65536))
+FALLBACK_MODE = os.getenv("TTBOT_FALLBACK_MODE", "sequential")
+HEDGE_DELAY = float(os.getenv("TTBOT_HEDGE_DELAY", 1))
+HEDGE_QUANTILE = float(os.getenv("TTBOT_HEDGE_QUANTILE", 0.95))
+HEDGE_MIN_SAMPLES = int(os.getenv("TTBOT_HEDGE_MIN_SAMPLES", 20))
+BREAKER_WINDOW = float(os.getenv("TTBOT_BREAKER_WINDOW", 60))
+BREAKER_ERROR_RATE = float(os.getenv("TTBOT_BREAKER_ERROR_RATE", 0.5))
+BREAKER_MIN_CALLS = int(os.getenv("TTBOT_BREAKER_MIN_CALLS", 10))
+BREAKER_RESET_TIMEOUT = float(os.getenv("TTBOT_BREAKER_RESET_TIMEOUT", 30))
+REVALIDATE_INTERVAL = float(os.getenv("TTBOT_REVALIDATE_INTERVAL", 24))
+PREWARM_INTERVAL = float(os.getenv("TTBOT_PREWARM_INTERVAL", 6))
+PREWARM_ARTISTS = int(os.getenv("TTBOT_PREWARM_ARTISTS", 100))
+PREWARM_AHEAD_DAYS = int(os.getenv("TTBOT_PREWARM_AHEAD_DAYS", 3))
+PREWARM_CONCURRENCY = int(os.getenv("TTBOT_PREWARM_CONCURRENCY", 4))
+PREWARM_YOUTUBE_UNITS = int(os.getenv("TTBOT_PREWARM_YOUTUBE_UNITS", 3000))
+PREWARM_LASTFM_RATE = float(os.getenv("TTBOT_PREWARM_LASTFM_RATE", 1))
+JOB_QUEUE = bool(int(os.getenv("TTBOT_JOB_QUEUE", 0)))
+JOB_WAIT_TIMEOUT = float(os.getenv("TTBOT_JOB_WAIT_TIMEOUT", 30))
+JOB_POLL_INTERVAL = float(os.getenv("TTBOT_JOB_POLL_INTERVAL", 5))
+JOB_TIMEOUT = float(os.getenv("TTBOT_JOB_TIMEOUT", 60))
+JOB_MAX_ATTEMPTS = int(os.getenv("TTBOT_JOB_MAX_ATTEMPTS", 3))
+JOB_RETENTION_HOURS = float(os.getenv("TTBOT_JOB_RETENTION_HOURS", 24))
+WORKER_CONCURRENCY = int(os.getenv("TTBOT_WORKER_CONCURRENCY", 8))
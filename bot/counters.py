@@ -0,0 +1,66 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import logging
+from typing import Dict
+
+from bot.db import acquire
+from bot.metrics import Counter, Gauge
+
+
+FLUSHED = Counter(
+    "ttbot_request_counts_flushed_total",
+    "Requests written to the database by batched counter updates",
+)
+PENDING = Gauge(
+    "ttbot_request_counts_pending",
+    "Requests counted in memory and not yet written to the database",
+)
+
+# requests of artists counted since the last flush,
+# written behind so that serving valid data doesn't write to the database
+_pending: Dict[str, int] = {}
+PENDING.set_function(lambda: sum(_pending.values()))
+
+logger = logging.getLogger("counters")
+logger.setLevel(logging.DEBUG)
+
+
+def count_request(artist: str) -> None:
+    """
+    Count a request of the given artist to be written to the database on the next flush.
+    :param artist: Artist name.
+    """
+    _pending[artist] = _pending.get(artist, 0) + 1
+
+
+async def flush_requests() -> None:
+    """
+    Add the requests counted in memory to the counters in the counter table
+    with a single batched upsert, the counts are kept for the next flush if it fails.
+    Counters are created for artists without one, e.g. if their top tracks
+    are requested while they are saved for the first time.
+    """
+    global _pending
+    if not _pending:
+        return
+    pending, _pending = _pending, {}
+    query = """INSERT INTO counter (artist, requests)
+               SELECT * FROM unnest($1::text[], $2::int[])
+               ON CONFLICT (artist)
+               DO UPDATE SET requests = counter.requests + EXCLUDED.requests"""
+    try:
+        async with acquire() as conn:
+            await conn.execute(query, list(pending), list(pending.values()))
+    except Exception:
+        for artist, n in pending.items():
+            _pending[artist] = _pending.get(artist, 0) + n
+        raise
+    total = sum(pending.values())
+    FLUSHED.inc(total)
+    logger.debug(f"Flushed {total} requests of {len(pending)} artists")
@@ -0,0 +1,228 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, MutableMapping, Optional
+from weakref import WeakKeyDictionary
+
+import asyncpg
+
+from bot.config import (
+    DATABASE_URI,
+    DB_ACQUIRE_TIMEOUT,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+)
+from bot.metrics import Counter, Gauge
+
+
+# asyncpg pools can't be shared between event loops,
+# so every loop gets its own pool created on first use
+_pools: MutableMapping[
+    asyncio.AbstractEventLoop, "asyncio.Task[asyncpg.Pool]"
+] = WeakKeyDictionary()
+_listeners: MutableMapping[asyncio.AbstractEventLoop, "Listener"] = WeakKeyDictionary()
+
+ACQUIRES = Counter(
+    "ttbot_db_pool_acquires_total", "Connections acquired from the database pool"
+)
+ACQUIRE_TIMEOUTS = Counter(
+    "ttbot_db_pool_acquire_timeouts_total",
+    "Attempts to acquire a database connection that timed out",
+)
+SATURATED_ACQUIRES = Counter(
+    "ttbot_db_pool_saturated_acquires_total",
+    "Attempts to acquire a database connection while all connections were in use",
+)
+IN_USE = Gauge("ttbot_db_pool_in_use", "Database connections currently in use")
+WAITING = Gauge(
+    "ttbot_db_pool_waiting", "Coroutines currently waiting for a database connection"
+)
+MAX_SIZE = Gauge("ttbot_db_pool_max_size", "Max number of connections in the pool")
+MAX_SIZE.set(DB_POOL_MAX_SIZE)
+
+logger = logging.getLogger("db")
+logger.setLevel(logging.DEBUG)
+
+
+async def _create_pool() -> asyncpg.Pool:
+    pool = await asyncpg.create_pool(
+        dsn=DATABASE_URI, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE
+    )
+    logger.debug(
+        f"Created database pool (min_size={DB_POOL_MIN_SIZE}, max_size={DB_POOL_MAX_SIZE})"
+    )
+    return pool
+
+
+async def get_pool() -> asyncpg.Pool:
+    """
+    Get a database connection pool bound to the running event loop.
+    The pool is created on first use and kept open until close_pool is called.
+    :return: Connection pool.
+    """
+    loop = asyncio.get_running_loop()
+    task = _pools.get(loop)
+    if task is None:
+        task = _pools[loop] = loop.create_task(_create_pool())
+    try:
+        return await task
+    except Exception:
+        _pools.pop(loop, None)
+        raise
+
+
+@asynccontextmanager
+async def acquire() -> AsyncIterator[asyncpg.Connection]:
+    """
+    Acquire a connection from the pool and release it on exit.
+    Queries run on pooled connections are prepared once per connection
+    and then reused from asyncpg statement cache.
+    :return: Database connection.
+    :raise asyncio.TimeoutError: if no connection is freed in DB_ACQUIRE_TIMEOUT seconds.
+    """
+    pool = await get_pool()
+    if IN_USE.value() >= DB_POOL_MAX_SIZE:
+        SATURATED_ACQUIRES.inc()
+    WAITING.inc()
+    try:
+        conn = await pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        ACQUIRE_TIMEOUTS.inc()
+        raise
+    finally:
+        WAITING.dec()
+    ACQUIRES.inc()
+    IN_USE.inc()
+    try:
+        yield conn
+    finally:
+        IN_USE.dec()
+        await pool.release(conn)
+
+
+async def close_pool() -> None:
+    """Close the connection pool bound to the running event loop."""
+    task = _pools.pop(asyncio.get_running_loop(), None)
+    if task is not None:
+        try:
+            pool = await task
+        except Exception:
+            return
+        await pool.close()
+        logger.debug("Closed database pool")
+
+
+class Listener:
+    """
+    Dedicated connection receiving notifications sent to database channels.
+    Pooled connections can't be used, as their listeners are removed on release.
+    A lost connection is reopened with its channels on the next call of ensure.
+    """
+
+    def __init__(self):
+        self._conn: Optional[asyncpg.Connection] = None
+        self._callbacks: Dict[str, List[Callable[[str], None]]] = {}
+        self._reopen_callbacks: List[Callable[[], None]] = []
+        self._lock = asyncio.Lock()
+
+    def _notify(
+        self, conn: asyncpg.Connection, pid: int, channel: str, payload: str
+    ) -> None:
+        for callback in list(self._callbacks.get(channel, ())):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Listener of '{channel}' failed: {repr(e)}")
+
+    async def ensure(self) -> bool:
+        """
+        Open the connection if it isn't open and listen to the subscribed channels.
+        Notifications sent while it was lost are not received,
+        functions passed to on_reopen are called instead.
+        :return: True if the connection was opened, False if it was already open.
+        """
+        async with self._lock:
+            if self._conn is not None and not self._conn.is_closed():
+                return False
+            reopened = self._conn is not None
+            conn = await asyncpg.connect(dsn=DATABASE_URI)
+            for channel in self._callbacks:
+                await conn.add_listener(channel, self._notify)
+            self._conn = conn
+            logger.debug(f"Listening to {list(self._callbacks)}")
+        if reopened:
+            logger.warning("Reopened lost database listener")
+            for callback in list(self._reopen_callbacks):
+                callback()
+        return True
+
+    def on_reopen(self, callback: Callable[[], None]) -> None:
+        """
+        Call a function every time the lost connection is reopened,
+        e.g. to drop data whose notifications could have been missed.
+        :param callback: Function without arguments.
+        """
+        self._reopen_callbacks.append(callback)
+
+    async def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        """
+        Call a function with the payload of every notification sent to a channel.
+        The function is called on the event loop of the listener and must not block.
+        :param channel: Name of the channel.
+        :param callback: Function taking the payload.
+        """
+        await self.ensure()
+        async with self._lock:
+            if channel not in self._callbacks:
+                await self._conn.add_listener(channel, self._notify)
+                self._callbacks[channel] = []
+        self._callbacks[channel].append(callback)
+
+    def unsubscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        """
+        Stop calling a function subscribed to a channel,
+        the channel itself is still listened to.
+        :param channel: Name of the channel.
+        :param callback: Subscribed function.
+        """
+        callbacks = self._callbacks.get(channel, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    async def close(self) -> None:
+        """Close the connection and forget the subscriptions."""
+        async with self._lock:
+            self._callbacks.clear()
+            self._reopen_callbacks.clear()
+            if self._conn is not None and not self._conn.is_closed():
+                await self._conn.close()
+                logger.debug("Closed database listener")
+            self._conn = None
+
+
+def get_listener() -> Listener:
+    """
+    Get the database listener bound to the running event loop.
+    Its connection is opened on the first subscription and kept open until close_listener is called.
+    :return: Listener.
+    """
+    loop = asyncio.get_running_loop()
+    listener = _listeners.get(loop)
+    if listener is None:
+        listener = _listeners[loop] = Listener()
+    return listener
+
+
+async def close_listener() -> None:
+    """Close the database listener bound to the running event loop."""
+    listener = _listeners.pop(asyncio.get_running_loop(), None)
+    if listener is not None:
+        await listener.close()
@@ -0,0 +1,152 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import asyncio
+import logging
+import time
+from functools import partial
+from typing import Any, Callable, List, Optional
+
+from telegram import Bot, Message
+from telegram.error import RetryAfter
+
+from bot.cache import TTLCache
+from bot.config import (
+    CACHE_MAX_ENTRIES,
+    REPLY_MODE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_RATE,
+    TELEGRAM_RETRIES,
+)
+from bot.metrics import Counter, Histogram, stage
+from bot.ratelimit import TokenBucket
+
+
+SEQUENTIAL = "sequential"
+CONCURRENT = "concurrent"
+COALESCED = "coalesced"
+MODES = (SEQUENTIAL, CONCURRENT, COALESCED)
+
+WAITED = Histogram(
+    "ttbot_telegram_rate_limit_wait_seconds",
+    "Time messages waited for the rate limits of Telegram",
+    ("limit",),
+)
+FLOOD_WAITS = Counter(
+    "ttbot_telegram_flood_waits_total",
+    "Messages rejected by Telegram with a request to retry later",
+)
+
+# buckets of chats are dropped once they would be full again,
+# a new bucket of the same chat starts full so the limit is kept
+_global_bucket = TokenBucket(TELEGRAM_RATE, max(TELEGRAM_RATE, 1))
+_chat_buckets = TTLCache("chat_buckets", CACHE_MAX_ENTRIES)
+
+logger = logging.getLogger("delivery")
+logger.setLevel(logging.DEBUG)
+
+
+async def call(func: Callable[..., Any], **kwargs: Any) -> Any:
+    """
+    Call a blocking Bot API method in a thread without blocking the event loop.
+    :param func: Bot method.
+    :param kwargs: Arguments of the method.
+    :return: Result of the call.
+    """
+    loop = asyncio.get_running_loop()
+    with stage(f"telegram_{func.__name__}"):
+        return await loop.run_in_executor(None, partial(func, **kwargs))
+
+
+def _chat_bucket(chat_id: int) -> TokenBucket:
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        bucket = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+    return bucket
+
+
+def _keep(chat_id: int, bucket: TokenBucket) -> None:
+    refilled_in = (bucket.capacity - bucket.tokens()) / bucket.rate
+    _chat_buckets.set(chat_id, bucket, time.time() + refilled_in + 1)
+
+
+async def wait_turn(chat_id: int) -> None:
+    """
+    Wait until a message can be sent to the given chat within the per chat
+    and the global rate limits. The chat limit is waited for first,
+    so that messages to busy chats don't hold tokens of the global one.
+    :param chat_id: Telegram chat ID.
+    """
+    if TELEGRAM_CHAT_RATE:
+        bucket = _chat_bucket(chat_id)
+        delay = bucket.reserve()
+        _keep(chat_id, bucket)
+        WAITED.observe(delay, limit="chat")
+        if delay:
+            await asyncio.sleep(delay)
+    if TELEGRAM_RATE:
+        WAITED.observe(await _global_bucket.acquire(), limit="global")
+
+
+async def send_message(bot: Bot, chat_id: int, text: str, **kwargs: Any) -> Message:
+    """
+    Send a message within the rate limits of Telegram.
+    If Telegram asks to retry later, the chat is paused for the requested time
+    and the message is sent again up to TELEGRAM_RETRIES times.
+    :param bot: Telegram bot.
+    :param chat_id: Telegram chat ID.
+    :param text: Text of the message.
+    :param kwargs: Other arguments of the send_message method.
+    :return: Sent message.
+    :raise RetryAfter: if Telegram still asks to retry later after all retries.
+    """
+    retries = 0
+    while True:
+        await wait_turn(chat_id)
+        try:
+            return await call(bot.send_message, chat_id=chat_id, text=text, **kwargs)
+        except RetryAfter as e:
+            FLOOD_WAITS.inc()
+            if retries >= TELEGRAM_RETRIES:
+                raise
+            retries += 1
+            logger.warning(
+                f"Telegram asked to retry sending to {chat_id} in {e.retry_after}s"
+            )
+            if TELEGRAM_CHAT_RATE:
+                bucket = _chat_bucket(chat_id)
+                bucket.pause(e.retry_after)
+                _keep(chat_id, bucket)
+            else:
+                await asyncio.sleep(e.retry_after)
+
+
+async def send_messages(
+    bot: Bot, chat_id: int, texts: List[str], mode: Optional[str] = None
+) -> None:
+    """
+    Send several messages to a chat.
+    In sequential mode each message is sent after the previous one is delivered,
+    in concurrent mode all of them are sent at once and may arrive in any order,
+    in coalesced mode they are joined into a single message.
+    :param bot: Telegram bot.
+    :param chat_id: Telegram chat ID.
+    :param texts: Texts of the messages.
+    :param mode: Either SEQUENTIAL, CONCURRENT or COALESCED, REPLY_MODE by default.
+    """
+    mode = mode or REPLY_MODE
+    if mode not in MODES:
+        raise ValueError(f"Unknown reply mode '{mode}', expected one of {MODES}")
+    if mode == COALESCED:
+        await send_message(bot, chat_id, "\n".join(texts))
+    elif mode == CONCURRENT:
+        await asyncio.gather(*(send_message(bot, chat_id, text) for text in texts))
+    else:
+        for text in texts:
+            await send_message(bot, chat_id, text)
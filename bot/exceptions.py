@@ -9,3 +9,28 @@ class PlaylistRetrievalError(Exception):
 class VideoIDsRetrievalError(Exception):
     def __init__(self, playlist: List[str]):
         super().__init__(f"Unable to get video IDs for {playlist} from YouTube")
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, backend: str):
+        super().__init__(f"Circuit breaker for {backend} is open")
+
+
+class RateLimitError(Exception):
+    def __init__(self, host: str):
+        super().__init__(f"Rate limit of requests to {host} is exhausted")
+
+
+class QuotaBudgetError(Exception):
+    def __init__(self, units: float):
+        super().__init__(f"Budget of {units:.0f} YouTube API quota units is spent")
+
+
+class JobFailedError(Exception):
+    def __init__(self, job_id: int, error: str):
+        super().__init__(f"Job {job_id} failed: {error}")
+
+
+class JobTimeoutError(Exception):
+    def __init__(self, job_id: int):
+        super().__init__(f"Job {job_id} is not finished yet")
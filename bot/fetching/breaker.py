@@ -0,0 +1,221 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from datetime import time as dt_time
+from functools import wraps
+from typing import Any, Awaitable, Callable, Deque, Optional, Tuple, TypeVar
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import httpx
+
+from bot.config import (
+    BREAKER_ERROR_RATE,
+    BREAKER_MIN_CALLS,
+    BREAKER_RESET_TIMEOUT,
+    BREAKER_WINDOW,
+)
+from bot.exceptions import CircuitOpenError, QuotaBudgetError, RateLimitError
+from bot.metrics import Counter, Gauge
+
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+STATE = Gauge(
+    "ttbot_circuit_state",
+    "Circuit breaker state: 0 - closed, 1 - open, 2 - half open",
+    ("backend",),
+)
+TRIPS = Counter(
+    "ttbot_circuit_trips_total", "Times a circuit breaker was opened", ("backend",)
+)
+REJECTED = Counter(
+    "ttbot_circuit_rejected_total",
+    "Calls skipped because a circuit breaker was open",
+    ("backend",),
+)
+
+logger = logging.getLogger("breaker")
+logger.setLevel(logging.DEBUG)
+
+
+def next_pacific_midnight() -> float:
+    """
+    Get the moment when YouTube API quota is reset.
+    :return: Unix timestamp of the next midnight in Pacific Time.
+    """
+    try:
+        tz = ZoneInfo("America/Los_Angeles")
+    except ZoneInfoNotFoundError:
+        tz = timezone(timedelta(hours=-8))
+    tomorrow = datetime.now(tz).date() + timedelta(days=1)
+    return datetime.combine(tomorrow, dt_time.min, tzinfo=tz).timestamp()
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """
+    Check if an exception means that the backend is unhealthy
+    rather than that the requested data doesn't exist.
+    :param exc: Exception raised by a fetcher.
+    :return: True for network errors, timeouts, rate limiting, quota and server errors.
+    """
+    if isinstance(exc, (httpx.TransportError, ResourceWarning)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status >= 500 or status == 429
+    return False
+
+
+class CircuitBreaker:
+    """
+    Tracks the error rate of a backend within a rolling time window
+    and stops calling it once the rate is too high. After reset_timeout
+    a single probe call is let through to check if the backend has recovered.
+    """
+
+    def __init__(
+        self,
+        backend: str,
+        window: float = BREAKER_WINDOW,
+        error_rate: float = BREAKER_ERROR_RATE,
+        min_calls: int = BREAKER_MIN_CALLS,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+    ):
+        """
+        :param backend: Name of the backend.
+        :param window: Length of the rolling window in seconds.
+        :param error_rate: Share of failed calls within the window that opens the circuit.
+        :param min_calls: Min number of calls within the window to evaluate the error rate.
+        :param reset_timeout: Number of seconds the circuit stays open before a probe.
+        """
+        self.backend = backend
+        self.window = window
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._open_until = 0.0
+        self._probing = False
+        STATE.set(0, backend=backend)
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.info(f"Circuit breaker for {self.backend} is {state}")
+        self.state = state
+        STATE.set(STATES.index(state), backend=self.backend)
+
+    def allow(self) -> bool:
+        """
+        Check if a call to the backend should be made.
+        :return: True if the circuit is closed or a probe call is due.
+        """
+        if self.state == OPEN and time.time() >= self._open_until:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return self.state == CLOSED
+
+    def release(self) -> None:
+        """Let another probe through if the current one ended without a verdict."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        """Register a successful call."""
+        if self.state == HALF_OPEN:
+            self._calls.clear()
+            self._probing = False
+            self._set_state(CLOSED)
+        self._record(True)
+
+    def record_failure(self) -> None:
+        """Register a failed call and open the circuit if the error rate is too high."""
+        if self.state == HALF_OPEN:
+            self.trip()
+            return
+        self._record(False)
+        failures = sum(1 for _, ok in self._calls if not ok)
+        if (
+            self.state == CLOSED
+            and len(self._calls) >= self.min_calls
+            and failures / len(self._calls) >= self.error_rate
+        ):
+            self.trip()
+
+    def trip(self, until: Optional[float] = None) -> None:
+        """
+        Open the circuit.
+        :param until: Unix timestamp to keep it open until, reset_timeout from now by default.
+        """
+        self._open_until = until or time.time() + self.reset_timeout
+        self._probing = False
+        self._calls.clear()
+        TRIPS.inc(backend=self.backend)
+        self._set_state(OPEN)
+
+    def _record(self, ok: bool) -> None:
+        now = time.time()
+        self._calls.append((now, ok))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+
+def guarded(
+    breaker: CircuitBreaker,
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """
+    Decorate a fetcher so that it's skipped while the breaker is open
+    and its outcome is reported to the breaker.
+    YouTube quota errors keep the breaker open until the quota is reset.
+    :param breaker: Circuit breaker of the backend the fetcher calls.
+    :return: Decorator.
+    """
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            if not breaker.allow():
+                REJECTED.inc(backend=breaker.backend)
+                raise CircuitOpenError(breaker.backend)
+            try:
+                result = await func(*args, **kwargs)
+            except (asyncio.CancelledError, QuotaBudgetError, RateLimitError):
+                # cancelled and throttled calls say nothing about the backend
+                breaker.release()
+                raise
+            except ResourceWarning:
+                breaker.trip(until=next_pacific_midnight())
+                raise
+            except Exception as e:
+                if is_backend_failure(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+            breaker.record_success()
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+LASTFM_API = CircuitBreaker("lastfm_api")
+LASTFM_NOAPI = CircuitBreaker("lastfm_noapi")
+YOUTUBE_API = CircuitBreaker("youtube_api")
+YOUTUBE_NOAPI = CircuitBreaker("youtube_noapi")
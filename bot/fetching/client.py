@@ -0,0 +1,250 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from importlib.util import find_spec
+from typing import Dict, MutableMapping, Optional
+from weakref import WeakKeyDictionary
+
+import httpx
+
+from bot.config import (
+    HTTP2,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_TIMEOUT,
+    LASTFM_API_RATE,
+    LASTFM_API_URL,
+    LASTFM_RATE,
+    LASTFM_URL,
+    RATE_LIMIT_BACKGROUND_MAX_WAIT,
+    RATE_LIMIT_MAX_WAIT,
+    YOUTUBE_API_RATE,
+    YOUTUBE_API_URL,
+    YOUTUBE_RATE,
+    YOUTUBE_URL,
+)
+from bot.exceptions import RateLimitError
+from bot.metrics import Counter, Gauge, Histogram
+from bot.ratelimit import TokenBucket
+
+
+LASTFM = "lastfm"
+YOUTUBE = "youtube"
+
+# priority class of the work upstream requests are made for,
+# background jobs set it so that their usage can be told apart
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+priority: ContextVar[str] = ContextVar("priority", default=INTERACTIVE)
+
+QUEUED = Gauge(
+    "ttbot_rate_limit_queue_depth",
+    "Upstream requests waiting for the rate limit of their host",
+    ("host", "priority"),
+)
+WAITED = Histogram(
+    "ttbot_rate_limit_wait_seconds",
+    "Time upstream requests waited for the rate limit of their host",
+    ("host", "priority"),
+)
+THROTTLED = Counter(
+    "ttbot_rate_limit_rejected_total",
+    "Upstream requests not made as the rate limit of their host wouldn't allow them in time",
+    ("host", "priority"),
+)
+
+# httpx clients can't be shared between event loops,
+# so every loop gets its own set of pooled clients
+_clients: MutableMapping[
+    asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]
+] = WeakKeyDictionary()
+
+logger = logging.getLogger("client")
+logger.setLevel(logging.DEBUG)
+
+
+def host_of(url: httpx.URL) -> str:
+    """
+    Get the host rate limits are applied to.
+    :param url: URL of a request.
+    :return: Host name with the port if it isn't the default one.
+    """
+    return url.host if url.port is None else f"{url.host}:{url.port}"
+
+
+class HostLimiter:
+    """
+    Limits the rate of requests to a host, shared by all event loops.
+    Interactive requests reserve tokens in order of arrival and wait for them,
+    background ones only take tokens left over by the interactive ones.
+    Requests that wouldn't get a token before their max wait fail at once.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        rate: float,
+        max_wait: float = RATE_LIMIT_MAX_WAIT,
+        background_max_wait: float = RATE_LIMIT_BACKGROUND_MAX_WAIT,
+    ):
+        """
+        :param host: Host name used as a label of the metrics.
+        :param rate: Max number of requests per second, one second of them can be made at once.
+        :param max_wait: Max number of seconds an interactive request waits.
+        :param background_max_wait: Max number of seconds a background request waits.
+        """
+        self.host = host
+        self.max_wait = max_wait
+        self.background_max_wait = background_max_wait
+        self.bucket = TokenBucket(rate, max(rate, 1))
+
+    async def acquire(self, priority_class: str) -> float:
+        """
+        Wait until a request of the given priority class can be made.
+        :param priority_class: Either INTERACTIVE or BACKGROUND.
+        :return: Number of seconds waited.
+        :raise RateLimitError: if the request can't be made within its max wait.
+        """
+        start = time.monotonic()
+        QUEUED.inc(host=self.host, priority=priority_class)
+        try:
+            if priority_class == BACKGROUND:
+                await self._acquire_leftover(start + self.background_max_wait)
+            else:
+                await self._acquire_next()
+        except RateLimitError:
+            THROTTLED.inc(host=self.host, priority=priority_class)
+            raise
+        finally:
+            QUEUED.dec(host=self.host, priority=priority_class)
+        waited = time.monotonic() - start
+        WAITED.observe(waited, host=self.host, priority=priority_class)
+        return waited
+
+    async def _acquire_next(self) -> None:
+        delay = self.bucket.reserve()
+        if delay > self.max_wait:
+            self.bucket.refund()
+            raise RateLimitError(self.host)
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def _acquire_leftover(self, deadline: float) -> None:
+        # tokens reserved by waiting interactive requests are already taken,
+        # so a whole token is left over only when none of them wait
+        while True:
+            shortage = 1 - self.bucket.tokens()
+            if shortage <= 0:
+                self.bucket.reserve()
+                return
+            delay = shortage / self.bucket.rate
+            if time.monotonic() + delay > deadline:
+                raise RateLimitError(self.host)
+            await asyncio.sleep(delay)
+
+
+def _create_limiters() -> Dict[str, HostLimiter]:
+    rates = {
+        LASTFM_API_URL: LASTFM_API_RATE,
+        LASTFM_URL: LASTFM_RATE,
+        YOUTUBE_API_URL: YOUTUBE_API_RATE,
+        YOUTUBE_URL: YOUTUBE_RATE,
+    }
+    limiters = {}
+    for url, rate in rates.items():
+        host = host_of(httpx.URL(url))
+        if rate:
+            limiters[host] = HostLimiter(host, rate)
+    return limiters
+
+
+# limits of hosts of the upstreams, requests to other hosts aren't limited
+limiters = _create_limiters()
+
+
+class ThrottledTransport(httpx.AsyncBaseTransport):
+    """Transport making requests within the rate limits of their hosts."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        """
+        :param transport: Transport making the requests.
+        """
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        limiter: Optional[HostLimiter] = limiters.get(host_of(request.url))
+        if limiter is not None:
+            await limiter.acquire(priority.get())
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def _http2_available() -> bool:
+    """Check if HTTP/2 is enabled and its optional dependency is installed."""
+    if HTTP2 and find_spec("h2") is None:
+        logger.warning(
+            "HTTP/2 is enabled but 'h2' package is not installed, falling back to HTTP/1.1. "
+            "Install it with 'pip install httpx[http2]'."
+        )
+        return False
+    return HTTP2
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    """
+    Create a pooled HTTP client for the given upstream
+    making requests within the rate limits of their hosts.
+    :param name: Name of the upstream, either LASTFM or YOUTUBE.
+    :return: HTTP client.
+    """
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    transport = httpx.AsyncHTTPTransport(http2=_http2_available(), limits=limits)
+    return httpx.AsyncClient(
+        follow_redirects=name == LASTFM,
+        transport=ThrottledTransport(transport),
+        timeout=httpx.Timeout(HTTP_TIMEOUT),
+    )
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+    Get a shared HTTP client for the given upstream bound to the running event loop.
+    The client is created on first use and kept open until close_clients is called.
+    :param name: Name of the upstream, either LASTFM or YOUTUBE.
+    :return: HTTP client with keep-alive connection pool.
+    """
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(name)
+    if client is None or client.is_closed:
+        client = clients[name] = _create_client(name)
+        logger.debug(f"Created HTTP client for {name}")
+    return client
+
+
+async def open_clients() -> None:
+    """Create HTTP clients for all upstreams in advance."""
+    for name in (LASTFM, YOUTUBE):
+        get_client(name)
+
+
+async def close_clients() -> None:
+    """Close HTTP clients bound to the running event loop and release their connections."""
+    clients = _clients.pop(asyncio.get_running_loop(), {})
+    for name, client in clients.items():
+        await client.aclose()
+        logger.debug(f"Closed HTTP client for {name}")
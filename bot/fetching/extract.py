@@ -0,0 +1,174 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import re
+from typing import Iterator, List, Optional, Tuple
+
+from lxml import etree
+
+
+# pages are fed to the parser in chunks, so that parsing stops
+# soon after the needed elements are found instead of at the end of the page
+CHUNK_SIZE = 16384
+
+YT_DATA_MARKER = b"var ytInitialData = "
+YT_VIDEO_RENDERER = re.compile(rb'"videoRenderer":\s*{')
+YT_VIDEO_ID = re.compile(rb'"videoId":\s*"(?P<id>[\w-]+)"')
+
+
+def _iterparse(content: bytes) -> Iterator[Tuple[str, etree._Element]]:
+    """
+    Parse an HTML page incrementally.
+    :param content: HTML page.
+    :return: Iterator over ('start' | 'end', element) events.
+    """
+    parser = etree.HTMLPullParser(events=("start", "end"))
+    for i in range(0, len(content), CHUNK_SIZE):
+        parser.feed(content[i : i + CHUNK_SIZE])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def _release(element: etree._Element) -> None:
+    """Drop an already processed element and its preceding siblings from the tree."""
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def _classes(element: etree._Element) -> List[str]:
+    return element.get("class", "").split()
+
+
+def _text(element: etree._Element) -> str:
+    return element.xpath("string()")
+
+
+def _is_title(element: etree._Element) -> bool:
+    return element.tag == "h1" and "header-new-title" in _classes(element)
+
+
+def _is_track(element: etree._Element) -> bool:
+    return (
+        element.tag == "a"
+        and not element.get("class")
+        and element.get("title") is not None
+    )
+
+
+def _is_summary(element: etree._Element) -> bool:
+    return element.tag == "div" and "wiki-content" in _classes(element)
+
+
+def _is_similar(element: etree._Element) -> bool:
+    return (
+        element.tag == "section" and element.get("class") == "buffer-standard hidden-xs"
+    )
+
+
+def extract_toptracks(content: bytes, number: int = 3) -> Tuple[str, List[str]]:
+    """
+    Extract an artist name and titles of their top tracks from a Last.fm tracks page.
+    :param content: HTML of https://www.last.fm/music/<artist>/+tracks page.
+    :param number: Number of top tracks to collect.
+    :return: Artist name and list of track titles.
+    :raise ValueError: if there is no artist name on the page.
+    """
+    artist: Optional[str] = None
+    titles: List[str] = []
+    depth = 0
+    for event, element in _iterparse(content):
+        if event == "start":
+            if _is_title(element):
+                depth += 1
+            continue
+        if _is_title(element):
+            depth -= 1
+            if artist is None:
+                artist = _text(element).strip()
+        elif _is_track(element) and len(titles) < number:
+            titles.append(element.get("title"))
+        if artist is not None and len(titles) >= number:
+            break
+        # the text of the title is read when it ends, so its children are kept until then
+        if not depth:
+            _release(element)
+    if artist is None:
+        raise ValueError("Unable to find an artist name on the page")
+    return artist, titles
+
+
+def extract_bio(
+    content: bytes, name_only: bool = False
+) -> Tuple[str, Optional[str], List[str]]:
+    """
+    Extract an artist name, a short bio and similar artists from a Last.fm wiki page.
+    :param content: HTML of https://www.last.fm/music/<artist>/+wiki page.
+    :param name_only: If True stop parsing once the name is found.
+    :return: Artist name, first 600 characters of the bio and names of similar artists,
+    the bio is None and the list is empty if name_only is True.
+    :raise ValueError: if any of them is not on the page.
+    """
+    name: Optional[str] = None
+    summary: Optional[str] = None
+    similar: Optional[List[str]] = None
+    depth = 0
+    for event, element in _iterparse(content):
+        wanted = _is_title(element) or _is_summary(element) or _is_similar(element)
+        if event == "start":
+            if wanted:
+                depth += 1
+            continue
+        if wanted:
+            depth -= 1
+            if _is_title(element) and name is None:
+                name = _text(element).strip()
+            elif _is_summary(element) and summary is None:
+                summary = _text(element).strip()[:600]
+            elif _is_similar(element) and similar is None:
+                similar = [
+                    _text(item)
+                    for item in element.iter("a")
+                    if "link-block-target" in _classes(item)
+                ]
+        if name is not None and name_only:
+            return name, None, []
+        if name is not None and summary is not None and similar is not None:
+            break
+        if not depth:
+            _release(element)
+    if name is None:
+        raise ValueError("Unable to find an artist name on the page")
+    if summary is None or similar is None:
+        raise ValueError("Unable to find an artist bio on the page")
+    return name, summary, similar
+
+
+def extract_video_id(content: bytes) -> str:
+    """
+    Extract ID of the first video from a YouTube search results page.
+    The ytInitialData block is scanned up to the first video renderer
+    without decoding the page and parsing the whole block.
+    :param content: HTML of https://www.youtube.com/results page.
+    :return: YouTube video ID.
+    :raise ValueError: if there are no videos on the page.
+    """
+    start = content.find(YT_DATA_MARKER)
+    if start == -1:
+        raise ValueError("Unable to find ytInitialData on the page")
+    renderer = YT_VIDEO_RENDERER.search(content, start)
+    # the block ends with its script element, the JSON itself can't contain '</script>'
+    if renderer is None or content.find(b"</script>", start, renderer.start()) != -1:
+        raise ValueError("Unable to find videos in ytInitialData")
+    match = YT_VIDEO_ID.search(content, renderer.end())
+    if match is None:
+        raise ValueError("Unable to find ID of the video")
+    return match.group("id").decode()
@@ -0,0 +1,147 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple, TypeVar
+
+from bot.config import (
+    FALLBACK_MODE,
+    HEDGE_DELAY,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_QUANTILE,
+)
+from bot.exceptions import CircuitOpenError
+from bot.metrics import Counter, Histogram
+
+
+T = TypeVar("T")
+Path = Tuple[str, Callable[[], Awaitable[T]]]
+
+SEQUENTIAL = "sequential"
+HEDGED = "hedged"
+RACE = "race"
+MODES = (SEQUENTIAL, HEDGED, RACE)
+
+LATENCY = Histogram(
+    "ttbot_upstream_latency_seconds",
+    "Latency of upstream fetch paths",
+    ("operation", "path", "outcome"),
+)
+FALLBACKS = Counter(
+    "ttbot_fallbacks_total",
+    "Results produced by a path other than the primary one",
+    ("operation", "path"),
+)
+
+logger = logging.getLogger("fallback")
+logger.setLevel(logging.DEBUG)
+
+
+def hedge_delay(operation: str, path: str) -> float:
+    """
+    Get the time to wait for a path before starting the next one in hedged mode.
+    :param operation: Name of the operation.
+    :param path: Name of the path.
+    :return: Delay in seconds, HEDGE_DELAY until enough latency samples are collected.
+    """
+    if LATENCY.count(operation=operation, path=path, outcome="ok") < HEDGE_MIN_SAMPLES:
+        return HEDGE_DELAY
+    delay = LATENCY.quantile(
+        HEDGE_QUANTILE, operation=operation, path=path, outcome="ok"
+    )
+    return delay if delay is not None else HEDGE_DELAY
+
+
+async def _timed(operation: str, path: str, func: Callable[[], Awaitable[T]]) -> T:
+    start = time.perf_counter()
+    try:
+        result = await func()
+    except (asyncio.CancelledError, CircuitOpenError):
+        raise
+    except Exception:
+        LATENCY.observe(
+            time.perf_counter() - start, operation=operation, path=path, outcome="error"
+        )
+        raise
+    LATENCY.observe(
+        time.perf_counter() - start, operation=operation, path=path, outcome="ok"
+    )
+    return result
+
+
+async def first_valid(
+    operation: str,
+    paths: Sequence[Path],
+    subject: Any,
+    mode: Optional[str] = None,
+) -> T:
+    """
+    Get a result from the first path that succeeds.
+    In sequential mode each path is started only after the previous one fails,
+    in hedged mode the next path is also started if the previous one
+    is slower than its usual latency, in race mode all paths are started at once.
+    Paths still running when a result is obtained are cancelled.
+    :param operation: Name of the operation used in logs and metrics.
+    :param paths: Pairs of path name and function returning an awaitable, in order of preference.
+    :param subject: Subject of the operation used in logs.
+    :param mode: Either SEQUENTIAL, HEDGED or RACE, FALLBACK_MODE by default.
+    :return: Result of the first successful path.
+    :raise Exception: exception of the last path if all of them fail.
+    """
+    mode = mode or FALLBACK_MODE
+    if mode not in MODES:
+        raise ValueError(f"Unknown fallback mode '{mode}', expected one of {MODES}")
+    tasks: Dict["asyncio.Task[T]", str] = {}
+    started = 0
+    error: Optional[BaseException] = None
+
+    def start_next() -> None:
+        nonlocal started
+        name, func = paths[started]
+        tasks[asyncio.ensure_future(_timed(operation, name, func))] = name
+        started += 1
+
+    start_next()
+    while mode == RACE and started < len(paths):
+        start_next()
+    try:
+        while tasks:
+            timeout = None
+            if mode == HEDGED and started < len(paths):
+                timeout = hedge_delay(operation, paths[started - 1][0])
+            done, _ = await asyncio.wait(
+                tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                logger.debug(
+                    f"{operation} for '{subject}' via {paths[started - 1][0]} "
+                    f"takes more than {timeout:.2f}s, hedging with {paths[started][0]}"
+                )
+                start_next()
+                continue
+            for task in done:
+                name = tasks.pop(task)
+                if task.exception() is None:
+                    if name != paths[0][0]:
+                        FALLBACKS.inc(operation=operation, path=name)
+                    return task.result()
+                error = task.exception()
+                if isinstance(error, CircuitOpenError):
+                    logger.debug(f"{operation} for '{subject}' skipped {name}: {error}")
+                else:
+                    logger.warning(
+                        f"{operation} failed for '{subject}' via {name}: {repr(error)}"
+                    )
+            if not tasks and started < len(paths):
+                start_next()
+    finally:
+        for task in tasks:
+            task.cancel()
+    logger.error(f"{operation} failed for '{subject}' via all paths: {repr(error)}")
+    raise error  # type: ignore
@@ -6,13 +6,15 @@ GitHub: https://github.com/pltnk/toptracksbot
 """
 
 import logging
-import re
-from typing import List
-
-import bs4
-import httpx
-
-from bot.config import LASTFM_API_KEY
+from functools import partial
+from typing import List, Tuple
+
+from bot.config import LASTFM_API_KEY, LASTFM_API_URL, LASTFM_URL
+from bot.fetching.breaker import LASTFM_API, LASTFM_NOAPI, guarded
+from bot.fetching.client import LASTFM, get_client
+from bot.fetching.extract import extract_bio, extract_toptracks
+from bot.fetching.fallback import first_valid
+from bot.fetching.offload import parse
 from bot.fetching.util import _quote
 
 
@@ -20,19 +22,20 @@ logger = logging.getLogger("lastfm")
 logger.setLevel(logging.DEBUG)
 
 
-async def get_playlist_api(keyphrase: str, number: int = 3) -> List[str]:
+@guarded(LASTFM_API)
+async def get_toptracks_api(keyphrase: str, number: int = 3) -> Tuple[str, List[str]]:
     """
-    Create a list of top tracks by the given artist using Last.fm API.
+    Get a corrected artist name and a list of their top tracks using Last.fm API.
     :param keyphrase: Name of an artist or a band.
     :param number: Number of top tracks to collect.
-    :return: List of top tracks formatted as '<artist> - <track>'.
-    """
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        res = await client.get(
-            f"https://ws.audioscrobbler.com/2.0/"
-            f"?method=artist.gettoptracks&artist={_quote(keyphrase)}&limit={number}"
-            f"&autocorrect[1]&api_key={LASTFM_API_KEY}&format=json"
-        )
+    :return: Artist name and list of top tracks formatted as '<artist> - <track>'.
+    """
+    client = get_client(LASTFM)
+    res = await client.get(
+        f"{LASTFM_API_URL}"
+        f"?method=artist.gettoptracks&artist={_quote(keyphrase)}&limit={number}"
+        f"&autocorrect[1]&api_key={LASTFM_API_KEY}&format=json"
+    )
     res.raise_for_status()
     parsed = res.json()
     artist = parsed["toptracks"]["@attr"]["artist"]
@@ -40,6 +43,53 @@ async def get_playlist_api(keyphrase: str, number: int = 3) -> List[str]:
     playlist = [
         f'{artist} - {tracks[i]["name"]}' for i in range(min(number, len(tracks)))
     ]
+    return artist, playlist
+
+
+@guarded(LASTFM_NOAPI)
+async def get_toptracks_noapi(keyphrase: str, number: int = 3) -> Tuple[str, List[str]]:
+    """
+    Get a corrected artist name and a list of their top tracks **without** using Last.fm API.
+    :param keyphrase: Name of an artist or a band.
+    :param number: Number of top tracks to collect.
+    :return: Artist name and list of top tracks formatted as '<artist> - <track>'.
+    """
+    client = get_client(LASTFM)
+    res = await client.get(
+        f"{LASTFM_URL}/music/{_quote(keyphrase)}/+tracks?date_preset=ALL"
+    )
+    res.raise_for_status()
+    artist, titles = await parse(extract_toptracks, res.content, number)
+    playlist = [f"{artist} - {title}" for title in titles]
+    return artist, playlist
+
+
+async def get_toptracks(keyphrase: str, number: int = 3) -> Tuple[str, List[str]]:
+    """
+    Get a corrected artist name and a list of their top tracks in a single request.
+    :param keyphrase: Name of an artist or a band.
+    :param number: Number of top tracks to collect.
+    :return: Artist name and list of top tracks formatted as '<artist> - <track>'.
+    :raise Exception: if unable to get playlist neither via API nor without it.
+    """
+    return await first_valid(
+        "get_toptracks",
+        [
+            ("api", partial(get_toptracks_api, keyphrase, number)),
+            ("noapi", partial(get_toptracks_noapi, keyphrase, number)),
+        ],
+        subject=keyphrase,
+    )
+
+
+async def get_playlist_api(keyphrase: str, number: int = 3) -> List[str]:
+    """
+    Create a list of top tracks by the given artist using Last.fm API.
+    :param keyphrase: Name of an artist or a band.
+    :param number: Number of top tracks to collect.
+    :return: List of top tracks formatted as '<artist> - <track>'.
+    """
+    _, playlist = await get_toptracks_api(keyphrase, number)
     return playlist
 
 
@@ -50,17 +100,7 @@ async def get_playlist_noapi(keyphrase: str, number: int = 3) -> List[str]:
     :param number: Number of top tracks to collect.
     :return: List of top tracks formatted as '<artist> - <track>'.
     """
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        res = await client.get(
-            f"https://www.last.fm/music/{_quote(keyphrase)}/+tracks?date_preset=ALL"
-        )
-    res.raise_for_status()
-    soup = bs4.BeautifulSoup(res.content, "lxml")
-    artist = soup.find("h1", attrs={"class": "header-new-title"}).text.strip()
-    tracks = soup.find_all("a", attrs={"class": "", "title": re.compile(r".*?")})
-    playlist = [
-        f'{artist} - {tracks[i].get("title")}' for i in range(min(number, len(tracks)))
-    ]
+    _, playlist = await get_toptracks_noapi(keyphrase, number)
     return playlist
 
 
@@ -72,22 +112,11 @@ async def get_playlist(keyphrase: str, number: int = 3) -> List[str]:
     :return: List of top tracks formatted as '<artist> - <track>'.
     :raise Exception: if unable to get playlist neither via API nor without it.
     """
-    try:
-        playlist = await get_playlist_api(keyphrase, number)
-    except Exception as e:
-        logger.warning(
-            f"Unable to get playlist for '{keyphrase}' via Last.fm API: {repr(e)}. Proceeding without API."
-        )
-        try:
-            playlist = await get_playlist_noapi(keyphrase, number)
-        except Exception as e:
-            logger.error(
-                f"Unable to get playlist for '{keyphrase}' *without* Last.fm  API: {repr(e)}"
-            )
-            raise
+    _, playlist = await get_toptracks(keyphrase, number)
     return playlist
 
 
+@guarded(LASTFM_API)
 async def get_bio_api(keyphrase: str, name_only: bool = False) -> str:
     """
     Collect a correct name and a short bio of the given artist using Last.fm API.
@@ -95,12 +124,12 @@ async def get_bio_api(keyphrase: str, name_only: bool = False) -> str:
     :param name_only: If True return only artist's name.
     :return: Either just a name of an artist or their short bio.
     """
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        res = await client.get(
-            f"https://ws.audioscrobbler.com/2.0/"
-            f"?method=artist.getinfo&artist={_quote(keyphrase)}&autocorrect[1]"
-            f"&api_key={LASTFM_API_KEY}&format=json"
-        )
+    client = get_client(LASTFM)
+    res = await client.get(
+        f"{LASTFM_API_URL}"
+        f"?method=artist.getinfo&artist={_quote(keyphrase)}&autocorrect[1]"
+        f"&api_key={LASTFM_API_KEY}&format=json"
+    )
     res.raise_for_status()
     parsed = res.json()
     name = parsed["artist"]["name"]
@@ -118,6 +147,7 @@ async def get_bio_api(keyphrase: str, name_only: bool = False) -> str:
         return bio
 
 
+@guarded(LASTFM_NOAPI)
 async def get_bio_noapi(keyphrase: str, name_only: bool = False) -> str:
     """
     Collect a correct name and a short bio of the given artist **without** using Last.fm API.
@@ -125,21 +155,15 @@ async def get_bio_noapi(keyphrase: str, name_only: bool = False) -> str:
     :param name_only: If True return only artist's name.
     :return: Either just a name of an artist or their short bio.
     """
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        res = await client.get(f"https://www.last.fm/music/{_quote(keyphrase)}/+wiki")
+    client = get_client(LASTFM)
+    res = await client.get(f"{LASTFM_URL}/music/{_quote(keyphrase)}/+wiki")
     res.raise_for_status()
-    soup = bs4.BeautifulSoup(res.content, "lxml")
-    name = soup.find("h1", attrs={"class": "header-new-title"}).text.strip()
+    name, summary, similar = await parse(extract_bio, res.content, name_only)
     if name_only:
         return name
     else:
         logger.info(f"Collecting short bio for {name} without Last.fm API.")
-        summary = soup.find("div", attrs={"class": "wiki-content"}).text.strip()[:600]
-        similar_block = soup.find(
-            "section", attrs={"class": "buffer-standard hidden-xs"}
-        )
-        similar = similar_block.find_all("a", attrs={"class": "link-block-target"})
-        similar_str = ", ".join([item.text for item in similar])
+        similar_str = ", ".join(similar)
         link = f"https://www.last.fm/music/{name}"
         bio = f"{summary}...\n\nSimilar: {similar_str}\n\nRead more: {link}"
         return bio
@@ -151,22 +175,17 @@ async def get_info(keyphrase: str) -> str:
     :param keyphrase: Name of an artist or a band.
     :return: Information about the artist.
     """
-    try:
-        info = await get_bio_api(keyphrase)
-    except Exception as e:
-        logger.warning(
-            f"Unable to get artist bio for '{keyphrase}' via Last.fm API: {repr(e)}. Proceeding without API."
-        )
-        try:
-            info = await get_bio_noapi(keyphrase)
-        except Exception as e:
-            logger.error(
-                f"Unable to get artist bio for '{keyphrase}' *without* Last.fm  API: {repr(e)}"
-            )
-            raise
-    return info
+    return await first_valid(
+        "get_info",
+        [
+            ("api", partial(get_bio_api, keyphrase)),
+            ("noapi", partial(get_bio_noapi, keyphrase)),
+        ],
+        subject=keyphrase,
+    )
 
 
+@guarded(LASTFM_API)
 async def get_corrected_name_api(keyphrase: str) -> str:
     """
     Get corrected artist name via Last.fm API method
@@ -174,12 +193,12 @@ async def get_corrected_name_api(keyphrase: str) -> str:
     :param keyphrase: Name of an artist or a band.
     :return: Corrected artist name.
     """
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        res = await client.get(
-            f"https://ws.audioscrobbler.com/2.0/"
-            f"?method=artist.getcorrection&artist={_quote(keyphrase)}"
-            f"&api_key={LASTFM_API_KEY}&format=json"
-        )
+    client = get_client(LASTFM)
+    res = await client.get(
+        f"{LASTFM_API_URL}"
+        f"?method=artist.getcorrection&artist={_quote(keyphrase)}"
+        f"&api_key={LASTFM_API_KEY}&format=json"
+    )
     res.raise_for_status()
     parsed = res.json()
     name = parsed["corrections"]["correction"]["artist"]["name"]
@@ -192,24 +211,15 @@ async def get_name(keyphrase: str) -> str:
     :param keyphrase: Name of an artist or a band.
     :return: Corrected artist name.
     """
-    try:
-        name = await get_corrected_name_api(keyphrase)
-    except Exception as e:
-        logger.debug(
-            f"Unable to get artist name for '{keyphrase}' via Last.fm API method artist.getCorrection: {repr(e)}. "
-            f"Proceeding without API."
-        )
-        try:
-            name = await get_bio_noapi(keyphrase, name_only=True)
-        except Exception as e:
-            logger.debug(
-                f"Unable to get artist name for '{keyphrase}' *without* Last.fm API: {repr(e)}. "
-                f"Proceeding using artist.getInfo API method which may work incorrectly."
-            )
-            try:
-                name = await get_bio_api(keyphrase, name_only=True)
-            except Exception as e:
-                logger.error(f"Unable to get artist name for '{keyphrase}': {repr(e)}")
-                raise
+    # artist.getInfo API method may return incorrect name so it goes last
+    name = await first_valid(
+        "get_name",
+        [
+            ("api", partial(get_corrected_name_api, keyphrase)),
+            ("noapi", partial(get_bio_noapi, keyphrase, name_only=True)),
+            ("api_getinfo", partial(get_bio_api, keyphrase, name_only=True)),
+        ],
+        subject=keyphrase,
+    )
     logger.debug(f"Got corrected name '{name}' for keyphrase '{keyphrase}'")
     return name
@@ -0,0 +1,95 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+
+from bot.config import PARSE_INLINE_BYTES, PARSE_MAX_QUEUE
+from bot.metrics import Counter, Gauge
+
+
+T = TypeVar("T")
+
+PARSES = Counter(
+    "ttbot_parses_total",
+    "Scraped pages parsed successfully by where they were parsed",
+    ("where",),
+)
+QUEUED = Gauge(
+    "ttbot_parse_queue_depth",
+    "Scraped pages sent to worker processes and not parsed yet",
+)
+
+# worker processes parsing scraped pages, shared by all event loops
+_pool: Optional[ProcessPoolExecutor] = None
+_queued = 0
+
+logger = logging.getLogger("offload")
+logger.setLevel(logging.DEBUG)
+
+
+def _ready() -> None:
+    """Do nothing, used to start worker processes in advance."""
+
+
+async def start_pool(workers: int) -> None:
+    """
+    Start worker processes for parsing scraped pages.
+    :param workers: Number of worker processes.
+    """
+    global _pool
+    if _pool is not None:
+        return
+    # workers are spawned rather than forked as the bot runs several threads
+    _pool = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(_pool, _ready) for _ in range(workers)))
+    logger.info(f"Started {workers} worker processes for parsing")
+
+
+async def stop_pool() -> None:
+    """Stop worker processes after they finish parsing pages sent to them."""
+    global _pool
+    if _pool is None:
+        return
+    pool, _pool = _pool, None
+    await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+    logger.info("Stopped worker processes for parsing")
+
+
+async def parse(func: Callable[..., T], content: bytes, *args: Any) -> T:
+    """
+    Parse a scraped page in a worker process without blocking the event loop.
+    The page is parsed inline if the pool isn't started, the page is smaller
+    than PARSE_INLINE_BYTES or PARSE_MAX_QUEUE pages already wait for the workers.
+    :param func: Picklable function taking the page as the first argument.
+    :param content: Page to parse.
+    :param args: Other arguments of the function.
+    :return: Result of the function.
+    """
+    global _queued
+    if _pool is None or len(content) < PARSE_INLINE_BYTES or _queued >= PARSE_MAX_QUEUE:
+        result = func(content, *args)
+        PARSES.inc(where="inline")
+        return result
+    _queued += 1
+    QUEUED.set(_queued)
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(_pool, partial(func, content, *args))
+    finally:
+        _queued -= 1
+        QUEUED.set(_queued)
+    PARSES.inc(where="process")
+    return result
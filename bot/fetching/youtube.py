@@ -7,37 +7,109 @@ GitHub: https://github.com/pltnk/toptracksbot
 
 
 import asyncio
-import json
 import logging
-import re
-from typing import List
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Dict, Iterator, List, Optional, Set
 
-import httpx
-
-from bot.config import YOUTUBE_API_KEY
+from bot.config import YOUTUBE_API_KEY, YOUTUBE_API_URL, YOUTUBE_REGION, YOUTUBE_URL
+from bot.exceptions import QuotaBudgetError, RateLimitError
+from bot.fetching.breaker import YOUTUBE_API, YOUTUBE_NOAPI, guarded
+from bot.fetching.client import YOUTUBE, get_client, priority
+from bot.fetching.extract import extract_video_id
+from bot.fetching.fallback import first_valid
 from bot.fetching.util import _quote
+from bot.metrics import Counter
+
+
+# max number of IDs accepted by a single videos.list request
+VIDEOS_BATCH_SIZE = 50
+
+# see: https://developers.google.com/youtube/v3/determine_quota_cost
+API_UNITS = Counter(
+    "ttbot_youtube_api_units_total",
+    "YouTube API quota units spent",
+    ("method", "priority"),
+)
+QUOTA_ERRORS = Counter(
+    "ttbot_youtube_quota_errors_total",
+    "YouTube API requests rejected as quota is exhausted",
+    ("method",),
+)
+
 
+class QuotaBudget:
+    """YouTube API quota units a single piece of work, e.g. a prewarm run, may spend."""
 
-YOUTUBE_REGEXP = re.compile("var ytInitialData = (?P<json>{.+});<")
+    def __init__(self, units: float):
+        """
+        :param units: Max number of quota units.
+        """
+        self.units = units
+        self.spent = 0.0
+
+    def remaining(self) -> float:
+        """
+        Get the number of quota units left.
+        :return: Number of units.
+        """
+        return self.units - self.spent
+
+
+# budget of the work running in the context, requests are charged
+# before they are made, so concurrent requests don't overshoot it
+budget: ContextVar[Optional[QuotaBudget]] = ContextVar("budget", default=None)
 
 logger = logging.getLogger("youtube")
 logger.setLevel(logging.DEBUG)
 
 
+@contextmanager
+def charge(units: float, method: str) -> Iterator[None]:
+    """
+    Count quota units of a YouTube API request made within the context.
+    Units are taken from the budget before the request is made and returned to it
+    if the request isn't sent as the rate limit of the host rejected it.
+    :param units: Number of quota units the request costs.
+    :param method: API method.
+    :raise QuotaBudgetError: if the budget of the running work doesn't allow them.
+    """
+    current = budget.get()
+    if current is not None:
+        if units > current.remaining():
+            raise QuotaBudgetError(current.units)
+        current.spent += units
+    try:
+        yield
+    except RateLimitError:
+        if current is not None:
+            current.spent -= units
+        raise
+    except BaseException:
+        API_UNITS.inc(units, method=method, priority=priority.get())
+        raise
+    API_UNITS.inc(units, method=method, priority=priority.get())
+
+
+@guarded(YOUTUBE_API)
 async def get_yt_id_api(track: str) -> str:
     """
     Get YouTube video ID for a track using YouTube API.
     :param track: Track title formatted as '<artist> - <track>'.
     :return: Corresponding YouTube video ID.
     :raise ResourceWarning: if API quota hit the limit.
+    :raise QuotaBudgetError: if the quota budget of the running work is spent.
     :raise Exception: if unable to get ID via API.
     """
-    async with httpx.AsyncClient() as client:
+    client = get_client(YOUTUBE)
+    with charge(100, "search"):
         res = await client.get(
-            f"https://www.googleapis.com/youtube/v3/search"
+            f"{YOUTUBE_API_URL}/search"
             f"?part=snippet&maxResults=1&q={_quote(track)}&key={YOUTUBE_API_KEY}"
         )
     if res.status_code == 403:
+        QUOTA_ERRORS.inc(method="search")
         raise ResourceWarning("YouTube API quota has reached the limit")
     res.raise_for_status()
     parsed = res.json()
@@ -45,6 +117,53 @@ async def get_yt_id_api(track: str) -> str:
     return video_id
 
 
+def _is_available(video: Dict[str, Any]) -> bool:
+    """
+    Check a video resource returned by videos.list.
+    :param video: Video resource with status and contentDetails parts.
+    :return: True if the video is processed, not private and not blocked
+    in YOUTUBE_REGION or, if it isn't set, in any region.
+    """
+    status = video["status"]
+    if status["uploadStatus"] != "processed" or status["privacyStatus"] == "private":
+        return False
+    restriction = video.get("contentDetails", {}).get("regionRestriction", {})
+    if YOUTUBE_REGION:
+        return YOUTUBE_REGION not in restriction.get("blocked", []) and (
+            "allowed" not in restriction or YOUTUBE_REGION in restriction["allowed"]
+        )
+    return not restriction.get("blocked") and "allowed" not in restriction
+
+
+@guarded(YOUTUBE_API)
+async def get_available_ids_api(video_ids: List[str]) -> Set[str]:
+    """
+    Check which of the given YouTube videos are still available using YouTube API.
+    Costs a single quota unit instead of a hundred spent by a search.
+    :param video_ids: Up to VIDEOS_BATCH_SIZE YouTube video IDs.
+    :return: IDs of videos that exist, are processed and neither private nor blocked
+    in YOUTUBE_REGION. Deleted, rejected and failed uploads as well as removed videos
+    missing from the response are unavailable.
+    :raise ResourceWarning: if API quota hit the limit.
+    :raise QuotaBudgetError: if the quota budget of the running work is spent.
+    :raise Exception: if unable to check IDs via API.
+    """
+    client = get_client(YOUTUBE)
+    with charge(1, "videos"):
+        res = await client.get(
+            f"{YOUTUBE_API_URL}/videos"
+            f"?part=status,contentDetails"
+            f"&id={_quote(','.join(video_ids))}&key={YOUTUBE_API_KEY}"
+        )
+    if res.status_code == 403:
+        QUOTA_ERRORS.inc(method="videos")
+        raise ResourceWarning("YouTube API quota has reached the limit")
+    res.raise_for_status()
+    parsed = res.json()
+    return {item["id"] for item in parsed["items"] if _is_available(item)}
+
+
+@guarded(YOUTUBE_NOAPI)
 async def get_yt_id_noapi(track: str) -> str:
     """
     Get YouTube video ID for a track *without* using YouTube API.
@@ -52,18 +171,10 @@ async def get_yt_id_noapi(track: str) -> str:
     :return: Corresponding YouTube video ID.
     :raise Exception: if unable to get ID without API.
     """
-    async with httpx.AsyncClient() as client:
-        res = await client.get(
-            f"https://www.youtube.com/results?search_query={_quote(track)}"
-        )
+    client = get_client(YOUTUBE)
+    res = await client.get(f"{YOUTUBE_URL}/results?search_query={_quote(track)}")
     res.raise_for_status()
-    match = YOUTUBE_REGEXP.search(res.text)
-    data = json.loads(match.group("json"))  # type: ignore
-    # fmt:off
-    slr = data["contents"]["twoColumnSearchResultsRenderer"]["primaryContents"]["sectionListRenderer"]
-    video_id = slr["contents"][0]["itemSectionRenderer"]["contents"][0]["videoRenderer"]["videoId"]
-    # fmt:on
-    return video_id
+    return extract_video_id(res.content)
 
 
 async def get_yt_id(track: str) -> str:
@@ -73,20 +184,14 @@ async def get_yt_id(track: str) -> str:
     :return: Corresponding YouTube video ID.
     :raise Exception: if unable to get ID neither via API nor without it.
     """
-    try:
-        yt_id = await get_yt_id_api(track)
-    except Exception as e:
-        logger.warning(
-            f"Unable to get YouTube ID for '{track}' via API: {repr(e)}. Proceeding without API."
-        )
-        try:
-            yt_id = await get_yt_id_noapi(track)
-        except Exception as e:
-            logger.error(
-                f"Unable to get YouTube ID for '{track}' *without* API: {repr(e)}"
-            )
-            raise
-    return yt_id
+    return await first_valid(
+        "get_yt_id",
+        [
+            ("api", partial(get_yt_id_api, track)),
+            ("noapi", partial(get_yt_id_noapi, track)),
+        ],
+        subject=track,
+    )
 
 
 async def get_yt_ids(playlist: List[str]) -> List[str]:
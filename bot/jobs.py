@@ -0,0 +1,227 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import asyncio
+import logging
+from typing import List, Optional
+
+import asyncpg
+
+from bot.config import JOB_POLL_INTERVAL, JOB_TIMEOUT, JOB_WAIT_TIMEOUT
+from bot.db import acquire, get_listener
+from bot.exceptions import (
+    JobFailedError,
+    JobTimeoutError,
+    PlaylistRetrievalError,
+    VideoIDsRetrievalError,
+)
+from bot.metrics import Counter, Histogram
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# workers are woken up by ids of queued jobs, waiters by ids of finished ones
+QUEUED_CHANNEL = "ttbot_job_queued"
+FINISHED_CHANNEL = "ttbot_job_finished"
+
+ENQUEUED = Counter(
+    "ttbot_jobs_enqueued_total", "Fetches of top tracks queued for workers"
+)
+FINISHED = Counter(
+    "ttbot_jobs_finished_total", "Jobs finished by workers by status", ("status",)
+)
+WAITED = Histogram(
+    "ttbot_job_wait_seconds", "Time the bot waited for queued jobs to finish"
+)
+
+logger = logging.getLogger("jobs")
+logger.setLevel(logging.DEBUG)
+
+
+async def enqueue(
+    artist: str, number: int, playlist: Optional[List[str]] = None
+) -> int:
+    """
+    Queue a fetch of top tracks by the given artist for workers.
+    If the same fetch is already queued or running, its job is reused.
+    :param artist: Artist name.
+    :param number: Number of top tracks.
+    :param playlist: Already fetched list of top tracks, if any.
+    :return: Job ID.
+    """
+    async with acquire() as conn:
+        async with conn.transaction():
+            job_id = await conn.fetchval(
+                """INSERT INTO job (artist, "number", playlist)
+                   VALUES ($1, $2, $3)
+                   ON CONFLICT (artist, "number") WHERE status IN ('queued', 'running')
+                   DO UPDATE SET playlist = coalesce(job.playlist, EXCLUDED.playlist)
+                   RETURNING id""",
+                artist,
+                number,
+                playlist,
+            )
+            await conn.execute("SELECT pg_notify($1, $2)", QUEUED_CHANNEL, str(job_id))
+    ENQUEUED.inc()
+    logger.debug(f"Queued job {job_id} fetching {number} tracks of '{artist}'")
+    return job_id
+
+
+async def claim(conn: asyncpg.Connection) -> Optional[asyncpg.Record]:
+    """
+    Take the oldest queued job, skipping jobs taken by other workers at the moment.
+    Jobs running longer than JOB_TIMEOUT are considered abandoned and taken again.
+    :param conn: Database connection.
+    :return: Job or None if there are no jobs to run.
+    """
+    return await conn.fetchrow(
+        """UPDATE job SET status = 'running', attempts = attempts + 1, started_at = now()
+           WHERE id = (
+               SELECT id FROM job
+               WHERE status = 'queued'
+                  OR status = 'running' AND started_at < now() - make_interval(secs => $1)
+               ORDER BY id
+               LIMIT 1
+               FOR UPDATE SKIP LOCKED
+           )
+           RETURNING id, artist, "number", playlist, attempts""",
+        JOB_TIMEOUT,
+    )
+
+
+async def finish(
+    job_id: int,
+    tracks: Optional[List[Optional[str]]] = None,
+    error: Optional[BaseException] = None,
+) -> None:
+    """
+    Save the result of a job and notify the waiters.
+    :param job_id: Job ID.
+    :param tracks: YouTube IDs per chart position if the job succeeded.
+    :param error: Exception if the job failed.
+    """
+    status = DONE if error is None else FAILED
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """UPDATE job SET status = $2, tracks = $3, error_type = $4, error = $5,
+                                  finished_at = now()
+                   WHERE id = $1""",
+                job_id,
+                status,
+                tracks,
+                type(error).__name__ if error is not None else None,
+                str(error) if error is not None else None,
+            )
+            await conn.execute(
+                "SELECT pg_notify($1, $2)", FINISHED_CHANNEL, str(job_id)
+            )
+    FINISHED.inc(status=status)
+
+
+def result(job_id: int, record: asyncpg.Record) -> List[Optional[str]]:
+    """
+    Get the result of a finished job, errors of the fetch are raised as they were.
+    :param job_id: Job ID.
+    :param record: Job.
+    :return: YouTube IDs per chart position.
+    :raise PlaylistRetrievalError: if the worker was unable to get playlist from Last.fm.
+    :raise VideoIDsRetrievalError: if the worker was unable to get video ids from YouTube.
+    :raise JobFailedError: if the job failed for another reason.
+    """
+    if record["status"] == DONE:
+        return record["tracks"]
+    if record["error_type"] == PlaylistRetrievalError.__name__:
+        raise PlaylistRetrievalError(record["artist"])
+    if record["error_type"] == VideoIDsRetrievalError.__name__:
+        raise VideoIDsRetrievalError(record["playlist"] or [record["artist"]])
+    raise JobFailedError(job_id, f"{record['error_type']}: {record['error']}")
+
+
+async def wait_job(
+    job_id: int, timeout: float = JOB_WAIT_TIMEOUT
+) -> List[Optional[str]]:
+    """
+    Wait for a job to finish. Waiters are woken up by notifications of workers
+    and check the job every JOB_POLL_INTERVAL seconds in case a notification is lost.
+    :param job_id: Job ID.
+    :param timeout: Max number of seconds to wait.
+    :return: YouTube IDs per chart position.
+    :raise JobTimeoutError: if the job isn't finished in time, it is still run.
+    :raise JobFailedError: if the job failed or was purged.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    finished = asyncio.Event()
+    key = str(job_id)
+
+    def on_finished(payload: str) -> None:
+        if payload == key:
+            finished.set()
+
+    listener = get_listener()
+    await listener.subscribe(FINISHED_CHANNEL, on_finished)
+    try:
+        while True:
+            finished.clear()
+            async with acquire() as conn:
+                record = await conn.fetchrow(
+                    """SELECT status, artist, playlist, tracks, error_type, error
+                       FROM job WHERE id = $1""",
+                    job_id,
+                )
+            if record is None:
+                raise JobFailedError(job_id, "job not found")
+            if record["status"] in (DONE, FAILED):
+                WAITED.observe(loop.time() - start)
+                return result(job_id, record)
+            remaining = start + timeout - loop.time()
+            if remaining <= 0:
+                WAITED.observe(loop.time() - start)
+                raise JobTimeoutError(job_id)
+            try:
+                await asyncio.wait_for(
+                    finished.wait(), min(remaining, JOB_POLL_INTERVAL)
+                )
+            except asyncio.TimeoutError:
+                await listener.ensure()
+    finally:
+        listener.unsubscribe(FINISHED_CHANNEL, on_finished)
+
+
+async def run_job(
+    artist: str, number: int, playlist: Optional[List[str]] = None
+) -> List[Optional[str]]:
+    """
+    Fetch top tracks by the given artist by a worker and wait for the result.
+    Workers save the result to the database as update_top does.
+    :param artist: Artist name.
+    :param number: Number of top tracks.
+    :param playlist: Already fetched list of top tracks, if any.
+    :return: YouTube IDs per chart position.
+    """
+    return await wait_job(await enqueue(artist, number, playlist))
+
+
+async def purge_jobs(hours: float) -> int:
+    """
+    Delete jobs finished more than the given number of hours ago.
+    :param hours: Number of hours.
+    :return: Number of deleted jobs.
+    """
+    async with acquire() as conn:
+        status = await conn.execute(
+            "DELETE FROM job WHERE finished_at < now() - make_interval(secs => $1)",
+            hours * 3600,
+        )
+    deleted = int(status.split()[-1])
+    logger.debug(f"Purged {deleted} finished jobs")
+    return deleted
@@ -0,0 +1,305 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+
+T = TypeVar("T")
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+REGISTRY: List["Metric"] = []
+
+
+class Metric:
+    """Base class of a named metric with optional labels."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Labels = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels: str) -> float:
+        """Get current value of the metric with the given labels."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def remove(self, **labels: str) -> None:
+        """Stop reporting the metric with the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values.pop(key, None)
+
+    def samples(self) -> Iterator[Sample]:
+        """Iterate over (name, labels, value) samples of the metric."""
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Counter(Metric):
+    """Monotonically increasing value."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the counter with the given labels by amount."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down or be computed on collection."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Labels = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge with the given labels to value."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the gauge with the given labels by amount."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """Decrease the gauge with the given labels by amount."""
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Compute value of an unlabelled gauge by calling function on collection."""
+        self._function = function
+
+    def value(self, **labels: str) -> float:
+        if self._function is not None:
+            return self._function()
+        return super().value(**labels)
+
+    def samples(self) -> Iterator[Sample]:
+        if self._function is not None:
+            yield self.name, {}, self._function()
+        else:
+            yield from super().samples()
+
+
+class Histogram(Metric):
+    """Distribution of observed values counted in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Labels = (),
+        buckets: Tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._histograms: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observed value with the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._histograms.setdefault(
+                key, ([0] * len(self.buckets), [0.0])
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        """Get the number of observed values with the given labels."""
+        with self._lock:
+            item = self._histograms.get(self._key(labels))
+            return item[0][-1] if item else 0
+
+    def quantile(self, q: float, **labels: str) -> Optional[float]:
+        """
+        Estimate a quantile of observed values interpolating within buckets.
+        :param q: Quantile between 0 and 1.
+        :return: Estimated value or None if nothing was observed yet.
+        """
+        with self._lock:
+            item = self._histograms.get(self._key(labels))
+            counts = list(item[0]) if item else []
+        if not counts or counts[-1] == 0:
+            return None
+        rank = q * counts[-1]
+        lower_bound, lower_count = 0.0, 0
+        for bound, count in zip(self.buckets, counts):
+            if count >= rank:
+                if bound == float("inf"):
+                    return lower_bound
+                if count == lower_count:
+                    return bound
+                return lower_bound + (bound - lower_bound) * (rank - lower_count) / (
+                    count - lower_count
+                )
+            lower_bound, lower_count = bound, count
+        return lower_bound
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = [
+                (key, list(counts), total[0])
+                for key, (counts, total) in self._histograms.items()
+            ]
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket", {**labels, "le": le}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, counts[-1]
+
+
+STAGE_SECONDS = Histogram(
+    "ttbot_stage_seconds", "Time spent in stages of processing of requests", ("stage",)
+)
+EXCEPTIONS = Counter(
+    "ttbot_exceptions_total",
+    "Exceptions raised in stages of processing of requests by type",
+    ("stage", "type"),
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Measure time spent in a stage of processing and count exceptions raised in it.
+    :param name: Name of the stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        EXCEPTIONS.inc(stage=name, type=type(e).__name__)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+def staged(
+    name: str,
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """
+    Measure calls of a coroutine function as a stage of processing.
+    :param name: Name of the stage.
+    :return: Decorator.
+    """
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            with stage(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def render() -> str:
+    """
+    Render all registered metrics in Prometheus text exposition format.
+    :return: Metrics as text.
+    """
+    lines = []
+    for metric in REGISTRY:
+        documentation = metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {metric.name} {documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+def start_http_server(port: int, addr: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve metrics at /metrics in a background thread.
+    :param port: Port to listen on, 0 picks a free one.
+    :param addr: Address to listen on.
+    :return: Running server, call its shutdown method to stop it.
+    """
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    return server
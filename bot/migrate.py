@@ -0,0 +1,87 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import logging
+import os
+import re
+from typing import List, Tuple
+
+import asyncpg
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+MIGRATION_NAME = re.compile(r"^(?P<version>\d+)_(?P<name>\w+)\.sql$")
+# key of the advisory lock held while migrations are applied,
+# so that instances started at once don't apply them concurrently
+LOCK_KEY = 1_869_379_954
+
+logger = logging.getLogger("migrate")
+logger.setLevel(logging.DEBUG)
+
+
+def load_migrations(path: str = MIGRATIONS_DIR) -> List[Tuple[int, str, str]]:
+    """
+    Load migrations from SQL files named '<version>_<name>.sql'.
+    :param path: Directory with migrations.
+    :return: List of versions, names and queries of migrations ordered by version.
+    :raise ValueError: if two migrations have the same version.
+    """
+    migrations = []
+    for filename in os.listdir(path):
+        match = MIGRATION_NAME.match(filename)
+        if match is None:
+            continue
+        with open(os.path.join(path, filename)) as f:
+            query = f.read()
+        migrations.append((int(match.group("version")), match.group("name"), query))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {path}")
+    return migrations
+
+
+async def migrate(conn: asyncpg.Connection, path: str = MIGRATIONS_DIR) -> List[int]:
+    """
+    Apply migrations that haven't been applied to the database yet.
+    Every migration is applied in its own transaction and recorded in schema_migrations.
+    :param conn: Database connection.
+    :param path: Directory with migrations.
+    :return: Versions of applied migrations.
+    """
+    applied = []
+    await conn.execute("SELECT pg_advisory_lock($1)", LOCK_KEY)
+    try:
+        await conn.execute(
+            """CREATE TABLE IF NOT EXISTS schema_migrations
+               (
+                   version integer NOT NULL,
+                   name text NOT NULL,
+                   applied_at timestamp with time zone NOT NULL DEFAULT now(),
+                   CONSTRAINT schema_migrations_pkey PRIMARY KEY (version)
+               )"""
+        )
+        done = {
+            record["version"]
+            for record in await conn.fetch("SELECT version FROM schema_migrations")
+        }
+        for version, name, query in load_migrations(path):
+            if version in done:
+                continue
+            async with conn.transaction():
+                await conn.execute(query)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                    version,
+                    name,
+                )
+            applied.append(version)
+            logger.info(f"Applied migration {version} {name}")
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+    return applied
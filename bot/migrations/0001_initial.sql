@@ -0,0 +1,29 @@
+-- top is created as it was by db/init.sql before migrations were introduced,
+-- existing databases already have it, alias and video are new tables
+
+CREATE TABLE IF NOT EXISTS top
+(
+    id SERIAL,
+    artist text NOT NULL,
+    tracks json NOT NULL,
+    date date NOT NULL,
+    requests integer NOT NULL,
+    CONSTRAINT top_pkey PRIMARY KEY (id),
+    CONSTRAINT unique_artist UNIQUE (artist)
+);
+
+CREATE TABLE IF NOT EXISTS alias
+(
+    keyphrase text NOT NULL,
+    artist text NOT NULL,
+    date date NOT NULL,
+    CONSTRAINT alias_pkey PRIMARY KEY (keyphrase)
+);
+
+CREATE TABLE IF NOT EXISTS video
+(
+    track text NOT NULL,
+    video_id text NOT NULL,
+    date date NOT NULL,
+    CONSTRAINT video_pkey PRIMARY KEY (track)
+);
@@ -0,0 +1,12 @@
+-- YouTube IDs are stored as a native array decoded by the driver
+-- instead of JSON text parsed on every lookup, null where no video was found
+
+ALTER TABLE top ADD COLUMN track_ids text[];
+
+UPDATE top SET track_ids = ARRAY(SELECT json_array_elements_text(tracks));
+
+ALTER TABLE top DROP COLUMN tracks;
+
+ALTER TABLE top RENAME COLUMN track_ids TO tracks;
+
+ALTER TABLE top ALTER COLUMN tracks SET NOT NULL;
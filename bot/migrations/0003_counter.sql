@@ -0,0 +1,18 @@
+-- request counters are updated far more often than top tracks,
+-- so they are kept out of the rows read on every lookup
+
+CREATE TABLE counter
+(
+    artist text NOT NULL,
+    requests integer NOT NULL,
+    CONSTRAINT counter_pkey PRIMARY KEY (artist)
+);
+
+INSERT INTO counter (artist, requests) SELECT artist, requests FROM top;
+
+ALTER TABLE top DROP COLUMN requests;
+
+-- rows expiring soon are found by a range scan and then ordered by popularity
+CREATE INDEX top_date_idx ON top (date);
+
+CREATE INDEX counter_requests_idx ON counter (requests DESC);
@@ -0,0 +1,25 @@
+-- fetches of missing top tracks queued by the bot and executed by workers,
+-- finished jobs keep their result until they are purged
+
+CREATE TABLE job
+(
+    id bigserial NOT NULL,
+    artist text NOT NULL,
+    "number" integer NOT NULL,
+    playlist text[],
+    status text NOT NULL DEFAULT 'queued',
+    attempts integer NOT NULL DEFAULT 0,
+    tracks text[],
+    error_type text,
+    error text,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    started_at timestamp with time zone,
+    finished_at timestamp with time zone,
+    CONSTRAINT job_pkey PRIMARY KEY (id)
+);
+
+-- a fetch requested by several replicas at once is queued only once
+CREATE UNIQUE INDEX job_pending_idx ON job (artist, "number")
+    WHERE status IN ('queued', 'running');
+
+CREATE INDEX job_finished_at_idx ON job (finished_at);
@@ -0,0 +1,119 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import List, Tuple
+
+from bot.config import (
+    MAX_STALE_DAYS,
+    PREWARM_AHEAD_DAYS,
+    PREWARM_ARTISTS,
+    PREWARM_CONCURRENCY,
+    PREWARM_LASTFM_RATE,
+    PREWARM_YOUTUBE_UNITS,
+    VALID_FOR_DAYS,
+)
+from bot.db import acquire
+from bot.fetching.client import BACKGROUND, priority
+from bot.fetching.youtube import QuotaBudget, budget
+from bot.metrics import Counter
+from bot.processing import mark_prewarmed, refresh_top
+
+
+REFRESHES = Counter(
+    "ttbot_prewarm_refreshes_total",
+    "Top tracks refreshed ahead of expiration by result",
+    ("result",),
+)
+UNITS = Counter(
+    "ttbot_prewarm_youtube_units_total", "YouTube API quota units spent by prewarming"
+)
+
+logger = logging.getLogger("prewarm")
+logger.setLevel(logging.DEBUG)
+
+
+async def select_artists(limit: int, ahead_days: int) -> List[Tuple[str, date]]:
+    """
+    Select the most requested artists whose data expires within the given number of days.
+    Data that can no longer be served even as stale is left to be fetched on request,
+    so that artists nobody asks for anymore aren't refreshed for their past popularity.
+    :param limit: Max number of artists to select.
+    :param ahead_days: Number of days before expiration when the data is refreshed.
+    :return: List of artist names and dates when their data was collected.
+    """
+    today = datetime.now().date()
+    async with acquire() as conn:
+        records = await conn.fetch(
+            """SELECT artist, date FROM top JOIN counter USING (artist)
+               WHERE date <= $1 AND date > $2
+               ORDER BY requests DESC LIMIT $3""",
+            today - timedelta(days=VALID_FOR_DAYS - ahead_days),
+            today - timedelta(days=VALID_FOR_DAYS + MAX_STALE_DAYS),
+            limit,
+        )
+    return [(record["artist"], record["date"]) for record in records]
+
+
+async def prewarm() -> None:
+    """
+    Refresh top tracks of the most requested artists before they expire,
+    so that users requesting them don't wait for Last.fm and YouTube.
+    Refreshes run concurrently up to PREWARM_CONCURRENCY, start no faster
+    than PREWARM_LASTFM_RATE per second (not paced if it is 0) and stop
+    once PREWARM_YOUTUBE_UNITS of YouTube API quota are spent by the run.
+    Requests of refreshes in flight when the budget is spent fall back
+    to YouTube pages.
+    """
+    run_budget = QuotaBudget(PREWARM_YOUTUBE_UNITS)
+    priority_token = priority.set(BACKGROUND)
+    budget_token = budget.set(run_budget)
+    try:
+        await _prewarm(run_budget)
+    finally:
+        budget.reset(budget_token)
+        priority.reset(priority_token)
+
+
+async def _prewarm(run_budget: QuotaBudget) -> None:
+    artists = await select_artists(PREWARM_ARTISTS, PREWARM_AHEAD_DAYS)
+    logger.info(f"Prewarming top tracks of {len(artists)} artists")
+    semaphore = asyncio.Semaphore(PREWARM_CONCURRENCY)
+    tasks = []
+
+    async def refresh(artist: str, day: date) -> None:
+        try:
+            if run_budget.remaining() <= 0:
+                REFRESHES.inc(result="skipped")
+                return
+            await refresh_top(artist)
+        except Exception as e:
+            logger.warning(f"Unable to prewarm '{artist}': {repr(e)}")
+            REFRESHES.inc(result="failed")
+        else:
+            mark_prewarmed(artist, day)
+            REFRESHES.inc(result="refreshed")
+        finally:
+            semaphore.release()
+
+    for artist, day in artists:
+        await semaphore.acquire()
+        if run_budget.remaining() <= 0:
+            semaphore.release()
+            logger.info("YouTube API budget of prewarming is spent, stopping")
+            break
+        tasks.append(asyncio.create_task(refresh(artist, day)))
+        if PREWARM_LASTFM_RATE:
+            await asyncio.sleep(1 / PREWARM_LASTFM_RATE)
+    await asyncio.gather(*tasks)
+    UNITS.inc(run_budget.spent)
+    logger.info(
+        f"Prewarmed {len(tasks)} artists spending {run_budget.spent:.0f} YouTube API units"
+    )
@@ -8,85 +8,511 @@ GitHub: https://github.com/pltnk/toptracksbot
 
 import json
 import logging
-from datetime import datetime
-from typing import List
+import uuid
+from datetime import date, datetime, time, timedelta
+from functools import partial
+from typing import List, Optional, Tuple
 
 import asyncpg
 
-from bot.config import DATABASE_URI, VALID_FOR_DAYS
+from bot.aliases import get_alias, save_alias
+from bot.cache import TTLCache
+from bot.config import (
+    CACHE_MAX_ENTRIES,
+    JOB_QUEUE,
+    MAX_STALE_DAYS,
+    TOP_TRACKS,
+    VALID_FOR_DAYS,
+)
+from bot.counters import count_request
+from bot.db import acquire, get_listener
 from bot.exceptions import PlaylistRetrievalError, VideoIDsRetrievalError
-from bot.fetching.lastfm import get_name, get_playlist
-from bot.fetching.youtube import get_yt_ids
+from bot.fetching.client import BACKGROUND, priority
+from bot.fetching.lastfm import get_name, get_playlist, get_toptracks
+from bot.jobs import run_job
+from bot.metrics import Counter, Histogram, stage, staged
+from bot.runner import spawn
+from bot.singleflight import SingleFlight
+from bot.videos import get_video_ids_by_position
 
 
+STALE = Counter(
+    "ttbot_stale_served_total", "Requests served with expired data while it is updated"
+)
+MISSES_AVOIDED = Counter(
+    "ttbot_prewarm_misses_avoided_total",
+    "Requests that found valid data only because it was refreshed in advance",
+)
+SYNCED = Counter(
+    "ttbot_cache_sync_events_total",
+    "Changes of top tracks made by other instances by action taken on the cache",
+    ("action",),
+)
+SYNC_LAG = Histogram(
+    "ttbot_cache_sync_lag_seconds",
+    "Time between a change of top tracks and its arrival to other instances",
+)
+
+# changes of top tracks are published to other instances of the bot
+# sharing the database, so that their caches don't serve replaced data
+TOP_CHANNEL = "ttbot_top"
+INSTANCE_ID = uuid.uuid4().hex
+
 logger = logging.getLogger("processing")
 logger.setLevel(logging.DEBUG)
 
+# L1 cache of YouTube IDs in front of the database, artist entries hold
+# the IDs per chart position and keyphrase entries point to the artist
+# they were resolved to
+top_cache = TTLCache("top", CACHE_MAX_ENTRIES)
+keyphrase_flight = SingleFlight("keyphrase")
+artist_flight = SingleFlight("artist")
+# artists refreshed in advance mapped to the moment their replaced data
+# would have stopped being served, kept while the refreshed data is valid
+prewarmed = TTLCache("prewarmed", CACHE_MAX_ENTRIES)
+
+
+def normalize(keyphrase: str) -> str:
+    """
+    Normalize keyphrase so that different spellings of the same input match.
+    :param keyphrase: Alleged artist name.
+    :return: Lowercase keyphrase with collapsed whitespace.
+    """
+    return " ".join(keyphrase.lower().split())
+
+
+def expiration(day: date) -> float:
+    """
+    Get the moment when the data collected at the given date becomes invalid.
+    :param day: Date when the data was collected.
+    :return: Unix timestamp.
+    """
+    return datetime.combine(day + timedelta(days=VALID_FOR_DAYS), time.min).timestamp()
+
 
 async def get_artist(keyphrase: str) -> str:
     """
     Get a proper artist name using keyphrase.
+    Known aliases are resolved locally, others are corrected via Last.fm.
     :param keyphrase: Alleged artist name.
     :return: Artist name.
     """
+    normalized = normalize(keyphrase)
+    artist = await get_alias(normalized)
+    if artist is not None:
+        return artist
     try:
         artist = await get_name(keyphrase)
         artist = artist.lower()
     except Exception as e:
         logger.error(f"Unable to fetch artist name from Last.fm: {repr(e)}.")
         artist = keyphrase.lower()
+    else:
+        spawn(save_alias(normalized, artist))
     return artist
 
 
-async def create_top(keyphrase: str, number: int = 3) -> List[str]:
+async def get_artist_and_playlist(
+    keyphrase: str, number: int = 3
+) -> Tuple[str, Optional[List[str]]]:
     """
-    Create list of str containing YouTube IDs of the top tracks
-    by the given artist according to Last.fm overall charts.
-    :param keyphrase: Name of an artist or a band.
+    Get a proper artist name using keyphrase. If the keyphrase is not a known alias
+    fetch the name together with the playlist in a single Last.fm request.
+    :param keyphrase: Alleged artist name.
     :param number: Number of top tracks to collect.
+    :return: Artist name and list of top tracks or None if the playlist wasn't fetched.
+    """
+    normalized = normalize(keyphrase)
+    artist = await get_alias(normalized)
+    if artist is not None:
+        return artist, None
+    try:
+        name, playlist = await get_toptracks(keyphrase, number)
+    except Exception as e:
+        logger.warning(
+            f"Unable to fetch artist name and playlist from Last.fm: {repr(e)}. Proceeding with name correction."
+        )
+        return await get_artist(keyphrase), None
+    artist = name.lower()
+    spawn(save_alias(normalized, artist))
+    return artist, playlist
+
+
+def select(tracks: List[Optional[str]], number: int) -> List[str]:
+    """
+    Get YouTube IDs of the given number of top tracks from the stored ones.
+    :param tracks: YouTube IDs stored per chart position, None where no video was found.
+    :param number: Number of top tracks.
     :return: List of YouTube IDs.
+    """
+    return [video_id for video_id in tracks[:number] if video_id is not None]
+
+
+async def fetch_top(
+    keyphrase: str,
+    number: int = TOP_TRACKS,
+    playlist: Optional[List[str]] = None,
+    start: int = 0,
+) -> List[Optional[str]]:
+    """
+    Fetch YouTube IDs of the top tracks by the given artist at the chart positions
+    from start to number. Positions beyond the end of the artist's chart are filled
+    with None, so that the result always covers all requested positions.
+    :param keyphrase: Name of an artist or a band.
+    :param number: Number of top tracks to collect.
+    :param playlist: Already fetched list of top tracks, if any.
+    :param start: Chart position to start from.
+    :return: List of YouTube IDs per position, None where no video was found.
     :raise PlaylistError: if unable to get playlist from Last.fm.
     :raise VideoIDSError: if unable to get video ids from YouTube.
     """
+    if playlist is None:
+        try:
+            with stage("get_playlist"):
+                playlist = await get_playlist(keyphrase, number)
+        except Exception as e:
+            raise PlaylistRetrievalError(keyphrase) from e
     try:
-        playlist = await get_playlist(keyphrase, number)
-    except Exception as e:
-        raise PlaylistRetrievalError(keyphrase) from e
-    try:
-        yt_ids = await get_yt_ids(playlist)
+        with stage("get_yt_ids"):
+            yt_ids = await get_video_ids_by_position(playlist[start:number])
     except Exception as e:
         raise VideoIDsRetrievalError(playlist) from e
-    return yt_ids
+    return yt_ids + [None] * (number - start - len(yt_ids))
 
 
-async def get_top(keyphrase: str) -> List[str]:
+async def create_top(
+    keyphrase: str, number: int = 3, playlist: Optional[List[str]] = None
+) -> List[str]:
+    """
+    Create list of str containing YouTube IDs of the top tracks
+    by the given artist according to Last.fm overall charts.
+    :param keyphrase: Name of an artist or a band.
+    :param number: Number of top tracks to collect.
+    :param playlist: Already fetched list of top tracks, if any.
+    :return: List of YouTube IDs.
+    :raise PlaylistError: if unable to get playlist from Last.fm.
+    :raise VideoIDSError: if unable to get video ids from YouTube.
+    """
+    return select(await fetch_top(keyphrase, number, playlist), number)
+
+
+@staged("get_top")
+async def get_top(keyphrase: str, number: int = TOP_TRACKS) -> List[str]:
     """
     Get YouTube ids of top tracks by the given artist
-    from the database if there is valid data for this artist.
+    from the cache or the database if there is valid data for this artist.
     Otherwise find valid data and update the database.
     :param keyphrase: Name of an artist or a band.
+    :param number: Number of top tracks.
     :return: List of YouTube IDs.
     """
-    artist = await get_artist(keyphrase)
-    today = datetime.now().date()
-    conn = await asyncpg.connect(dsn=DATABASE_URI)
-    record = await conn.fetchrow(
-        "UPDATE top SET requests = requests + 1 WHERE artist = $1 RETURNING tracks, date",
-        artist,
+    normalized = normalize(keyphrase)
+    artist = top_cache.get(("keyphrase", normalized))
+    cached = top_cache.get(("artist", artist)) if artist is not None else None
+    if cached is not None and len(cached[1]) >= number:
+        _, tracks = cached
+        logger.info(f"Found valid data for '{artist}' in the cache")
+        count_avoided_miss(artist)
+        count_request(artist)
+        return select(tracks, number)
+    # concurrent requests with the same keyphrase share a single lookup
+    (artist, tracks), coalesced = await keyphrase_flight.do(
+        (normalized, number), partial(find_top, keyphrase, number)
     )
-    if record and (today - record["date"]).days < VALID_FOR_DAYS:
-        logger.info(f"Found valid data for '{artist}' in the database")
-        tracks = json.loads(record["tracks"])
+    if coalesced and any(tracks):
+        count_request(artist)
+    return select(tracks, number)
+
+
+async def find_top(
+    keyphrase: str, number: int = TOP_TRACKS
+) -> Tuple[str, List[Optional[str]]]:
+    """
+    Find YouTube ids of top tracks by the artist matching the keyphrase
+    in the cache or the database, fetch them if there is no valid data.
+    Stored data covering fewer tracks than requested is extended with the missing ones.
+    :param keyphrase: Name of an artist or a band.
+    :param number: Number of top tracks.
+    :return: Artist name and list of YouTube IDs per chart position, at least number long.
+    """
+    normalized = normalize(keyphrase)
+    # the playlist is fetched speculatively along with the name correction
+    # and is only used if there is no valid data for the artist
+    with stage("get_artist"):
+        artist, playlist = await get_artist_and_playlist(keyphrase, number)
+    cached = top_cache.get(("artist", artist))
+    if cached is not None and len(cached[1]) >= number:
+        expires, tracks = cached
+        logger.info(f"Found valid data for '{artist}' in the cache")
+        cache_top(artist, tracks, expires, keyphrase=normalized)
+        count_avoided_miss(artist)
+        count_request(artist)
+        return artist, tracks
+    today = datetime.now().date()
+    with stage("db_select"):
+        async with acquire() as conn:
+            record = await conn.fetchrow(
+                "SELECT tracks, date FROM top WHERE artist = $1", artist
+            )
+    if record:
+        count_request(artist)
+    age = (today - record["date"]).days if record else None
+    stored = record["tracks"] if record else []
+    if age is not None and age < VALID_FOR_DAYS:
+        if len(stored) >= number:
+            logger.info(f"Found valid data for '{artist}' in the database")
+            tracks = stored
+            count_avoided_miss(artist)
+        else:
+            logger.info(f"Extending valid data for '{artist}' to {number} tracks")
+            tracks, _ = await artist_flight.do(
+                (artist, number),
+                partial(extend_top, artist, stored, number, playlist),
+            )
+        cache_top(artist, tracks, expiration(record["date"]), keyphrase=normalized)
+    elif (
+        age is not None
+        and age < VALID_FOR_DAYS + MAX_STALE_DAYS
+        and len(stored) >= number
+    ):
+        logger.info(f"Serving stale data for '{artist}' while it is updated")
+        STALE.inc()
+        tracks = stored
+        width = len(stored)
+        # the refresh task copies the context, so its upstream requests
+        # don't take rate limit tokens of requests users wait for
+        token = priority.set(BACKGROUND)
+        try:
+            spawn(refresh_top(artist, playlist if width == number else None, width))
+        finally:
+            priority.reset(token)
     else:
         logger.info(f"No valid data for '{artist}' in the database")
-        tracks = await create_top(artist)
-        if tracks:
-            tracks_json = json.dumps(tracks)
-            query = """INSERT INTO top (artist, tracks, date, requests)
-                       VALUES($1, $2, $3, 1)
-                       ON CONFLICT (artist)
-                       DO UPDATE SET tracks = $2, date = $3"""
-            await conn.execute(query, artist, tracks_json, today)
+        # the data is updated as wide as it was stored, so that requests
+        # of more tracks than this one are still served from the database
+        width = max(number, len(stored))
+        if width > number:
+            playlist = None
+        # concurrent lookups of the same artist share a single fetch,
+        # with the job queue enabled it is run by a worker
+        if JOB_QUEUE:
+            fetch = partial(run_job, artist, width, playlist)
+        else:
+            fetch = partial(update_top, artist, playlist, width)
+        tracks, _ = await artist_flight.do((artist, width), fetch)
+        if any(tracks):
+            cache_top(artist, tracks, expiration(today), keyphrase=normalized)
+    return artist, tracks
+
+
+async def update_top(
+    artist: str, playlist: Optional[List[str]] = None, number: int = TOP_TRACKS
+) -> List[Optional[str]]:
+    """
+    Fetch YouTube ids of top tracks by the given artist and save them to the database.
+    Data collected on the same day for more tracks, e.g. by a concurrent request
+    of a wider top, is kept, so that stored rows never shrink.
+    :param artist: Artist name.
+    :param playlist: Already fetched list of top tracks, if any.
+    :param number: Number of top tracks.
+    :return: List of YouTube IDs per chart position.
+    """
+    today = datetime.now().date()
+    tracks = await fetch_top(artist, number, playlist)
+    if any(tracks):
+        query = """WITH counted AS (
+                       INSERT INTO counter (artist, requests)
+                       VALUES($1, 1)
+                       ON CONFLICT (artist) DO NOTHING
+                   )
+                   INSERT INTO top (artist, tracks, date)
+                   VALUES($1, $2, $3)
+                   ON CONFLICT (artist)
+                   DO UPDATE SET tracks = $2, date = $3
+                   WHERE top.date < $3
+                      OR cardinality(top.tracks) <= cardinality($2::text[])"""
+        with stage("db_update"):
+            async with acquire() as conn:
+                async with conn.transaction():
+                    status = await conn.execute(query, artist, tracks, today)
+                    updated = status == "INSERT 0 1"
+                    if updated:
+                        await publish_top(conn, artist, tracks, today)
+        if updated:
             logger.info(f"Database is updated with new data for '{artist}'")
-    await conn.close()
+        else:
+            logger.info(f"Database already has wider data for '{artist}'")
+    return tracks
+
+
+async def extend_top(
+    artist: str,
+    tracks: List[Optional[str]],
+    number: int,
+    playlist: Optional[List[str]] = None,
+) -> List[Optional[str]]:
+    """
+    Fetch YouTube ids of the top tracks by the given artist missing from the stored
+    ones and append them in the database, the stored ones are kept as they are valid.
+    The row isn't updated if it was meanwhile extended to at least as many tracks.
+    :param artist: Artist name.
+    :param tracks: Stored YouTube IDs per chart position.
+    :param number: Number of top tracks.
+    :param playlist: Already fetched list of top tracks, if any.
+    :return: List of YouTube IDs per chart position.
+    """
+    tail = await fetch_top(artist, number, playlist, start=len(tracks))
+    tracks = tracks + tail
+    with stage("db_update"):
+        async with acquire() as conn:
+            async with conn.transaction():
+                status = await conn.execute(
+                    """UPDATE top SET tracks = $2
+                       WHERE artist = $1 AND cardinality(tracks) < $3""",
+                    artist,
+                    tracks,
+                    len(tracks),
+                )
+                updated = status == "UPDATE 1"
+                if updated:
+                    await publish_top(conn, artist)
+    if updated:
+        logger.info(f"Database is updated with {len(tail)} more tracks for '{artist}'")
+    else:
+        logger.info(f"Database already has {number} or more tracks for '{artist}'")
     return tracks
+
+
+async def refresh_top(
+    artist: str, playlist: Optional[List[str]] = None, number: Optional[int] = None
+) -> None:
+    """
+    Update YouTube ids of top tracks by the given artist in the database and the cache.
+    Concurrent refreshes and lookups of the same artist share a single fetch.
+    :param artist: Artist name.
+    :param playlist: Already fetched list of top tracks, if any.
+    :param number: Number of top tracks, by default as many as are stored.
+    """
+    if number is None:
+        async with acquire() as conn:
+            stored = await conn.fetchval(
+                "SELECT cardinality(tracks) FROM top WHERE artist = $1", artist
+            )
+        number = max(stored or 0, TOP_TRACKS)
+    tracks, _ = await artist_flight.do(
+        (artist, number), partial(update_top, artist, playlist, number)
+    )
+    if any(tracks):
+        cache_top(artist, tracks, expiration(datetime.now().date()))
+
+
+def cache_top(
+    artist: str,
+    tracks: List[Optional[str]],
+    expires: float,
+    keyphrase: Optional[str] = None,
+) -> None:
+    """
+    Put YouTube IDs of top tracks by the given artist into the cache.
+    :param artist: Artist name.
+    :param tracks: List of YouTube IDs per chart position.
+    :param expires: Unix timestamp after which the data is no longer valid.
+    :param keyphrase: Normalized keyphrase the artist was requested by.
+    """
+    top_cache.set(("artist", artist), (expires, tracks), expires)
+    if keyphrase is not None:
+        top_cache.set(("keyphrase", keyphrase), artist, expires)
+
+
+def invalidate_top(artist: str) -> None:
+    """
+    Remove cached YouTube IDs of the given artist
+    so that they are read from the database on the next request.
+    :param artist: Artist name.
+    """
+    top_cache.pop(("artist", artist))
+
+
+async def publish_top(
+    conn: asyncpg.Connection,
+    artist: str,
+    tracks: Optional[List[Optional[str]]] = None,
+    day: Optional[date] = None,
+) -> None:
+    """
+    Notify other instances that top tracks by the given artist were changed.
+    Instances having the artist in their cache replace the entry with the given
+    tracks or drop it if they are not given. Called in the transaction changing
+    the tracks, the notification is only delivered if it is committed.
+    :param conn: Database connection.
+    :param artist: Artist name.
+    :param tracks: New list of YouTube IDs per chart position, if known.
+    :param day: Date when the new tracks were collected.
+    """
+    replaced = tracks is not None and day is not None
+    payload = {
+        "origin": INSTANCE_ID,
+        "artist": artist,
+        "tracks": tracks if replaced else None,
+        "date": day.isoformat() if replaced else None,
+        "sent": datetime.now().timestamp(),
+    }
+    await conn.execute("SELECT pg_notify($1, $2)", TOP_CHANNEL, json.dumps(payload))
+
+
+def apply_published(payload: str) -> None:
+    """
+    Apply a change of top tracks published by another instance to the cache.
+    Artists missing from the cache are not added, so that every instance
+    only keeps the artists it is asked about.
+    :param payload: Notification sent by publish_top.
+    """
+    change = json.loads(payload)
+    if change["origin"] == INSTANCE_ID:
+        return
+    # instances are expected to keep their clocks in sync
+    SYNC_LAG.observe(max(0.0, datetime.now().timestamp() - change["sent"]))
+    artist = change["artist"]
+    if ("artist", artist) not in top_cache:
+        SYNCED.inc(action="skipped")
+    elif change["date"] is not None:
+        day = date.fromisoformat(change["date"])
+        cache_top(artist, change["tracks"], expiration(day))
+        SYNCED.inc(action="updated")
+    else:
+        invalidate_top(artist)
+        SYNCED.inc(action="evicted")
+
+
+async def start_cache_sync() -> None:
+    """
+    Keep the cache of the running event loop in sync with changes of top tracks
+    made by other instances. Changes published while the connection receiving them
+    was lost are unknown, so the whole cache is cleared when it is reopened.
+    """
+    listener = get_listener()
+    listener.on_reopen(top_cache.clear)
+    await listener.subscribe(TOP_CHANNEL, apply_published)
+
+
+def mark_prewarmed(artist: str, day: date) -> None:
+    """
+    Remember that data of the given artist was refreshed before it had to be.
+    :param artist: Artist name.
+    :param day: Date when the replaced data was collected.
+    """
+    replaced_until = expiration(day + timedelta(days=MAX_STALE_DAYS))
+    prewarmed.set(artist, replaced_until, expiration(datetime.now().date()))
+
+
+def count_avoided_miss(artist: str) -> None:
+    """
+    Count a request served with valid data if without refreshing it in advance
+    the user would have waited for the data to be fetched.
+    :param artist: Artist name.
+    """
+    if artist not in prewarmed:
+        return
+    if prewarmed.get(artist) <= datetime.now().timestamp():
+        prewarmed.pop(artist)
+        MISSES_AVOIDED.inc()
@@ -0,0 +1,76 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Rate limiter allowing bursts of up to capacity calls
+    and rate calls per second on average.
+    Tokens are reserved rather than waited for under a lock, so the bucket
+    is not bound to an event loop and waiting callers are served in order.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        """
+        :param rate: Number of tokens added per second.
+        :param capacity: Max number of tokens kept for bursts.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def tokens(self) -> float:
+        """
+        Get the number of available tokens, negative if they are reserved in advance.
+        :return: Number of tokens.
+        """
+        self._refill()
+        return self._tokens
+
+    def reserve(self) -> float:
+        """
+        Take a token, reserving a future one if there are none available.
+        :return: Number of seconds to wait before the token can be used.
+        """
+        self._refill()
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.rate)
+
+    def refund(self) -> None:
+        """Give back a token taken by reserve that won't be used."""
+        self._tokens = min(self.capacity, self._tokens + 1)
+
+    async def acquire(self) -> float:
+        """
+        Wait for a token.
+        :return: Number of seconds waited.
+        """
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    def pause(self, seconds: float) -> None:
+        """
+        Make no tokens available for the given number of seconds,
+        e.g. when the server asks to retry after that time.
+        :param seconds: Number of seconds.
+        """
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
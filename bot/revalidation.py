@@ -0,0 +1,159 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Set, Tuple
+
+from bot.config import MAX_STALE_DAYS, VALID_FOR_DAYS
+from bot.db import acquire
+from bot.fetching.client import BACKGROUND, priority
+from bot.fetching.youtube import VIDEOS_BATCH_SIZE, get_available_ids_api, get_yt_id
+from bot.metrics import Counter
+from bot.processing import invalidate_top, publish_top
+from bot.videos import save_video_ids, video_cache
+
+
+REVALIDATED = Counter(
+    "ttbot_revalidated_videos_total",
+    "YouTube IDs checked by revalidation by result",
+    ("result",),
+)
+
+logger = logging.getLogger("revalidation")
+logger.setLevel(logging.DEBUG)
+
+
+async def check_ids(video_ids: List[str]) -> Tuple[Set[str], Set[str]]:
+    """
+    Check availability of YouTube videos in batches.
+    Stops at the first failed batch, e.g. when API quota is exhausted.
+    :param video_ids: YouTube video IDs.
+    :return: IDs that were found available and unavailable.
+    """
+    available_ids: Set[str] = set()
+    unavailable: Set[str] = set()
+    for i in range(0, len(video_ids), VIDEOS_BATCH_SIZE):
+        batch = video_ids[i : i + VIDEOS_BATCH_SIZE]
+        try:
+            available = await get_available_ids_api(batch)
+        except Exception as e:
+            logger.warning(f"Unable to check YouTube IDs, stopping: {repr(e)}")
+            break
+        available_ids.update(available)
+        unavailable.update(set(batch) - available)
+        REVALIDATED.inc(len(available), result="available")
+    return available_ids, unavailable
+
+
+async def find_replacements(video_ids: Set[str]) -> Dict[str, str]:
+    """
+    Search YouTube again for tracks whose videos are no longer available.
+    :param video_ids: Unavailable YouTube video IDs.
+    :return: Mapping of unavailable IDs to new ones.
+    """
+    async with acquire() as conn:
+        records = await conn.fetch(
+            "SELECT track, video_id FROM video WHERE video_id = ANY($1::text[])",
+            list(video_ids),
+        )
+    replacements = {}
+    new_ids = {}
+    for record in records:
+        try:
+            new_id = await get_yt_id(record["track"])
+        except Exception as e:
+            logger.warning(
+                f"Unable to find a new video for '{record['track']}': {repr(e)}"
+            )
+            continue
+        replacements[record["video_id"]] = new_id
+        new_ids[record["track"]] = new_id
+    await save_video_ids(new_ids)
+    return replacements
+
+
+async def revalidate_videos() -> None:
+    """
+    Check YouTube IDs of valid rows of the top table in bulk
+    using cheap videos.list requests instead of searching for every track again.
+    Stored IDs that are still available stay valid for another period,
+    removed, private, region blocked and rejected or failed uploads
+    are searched for again and replaced.
+    Rows with videos that can't be replaced are expired to be rebuilt on the next request
+    rather than served as stale.
+    """
+    token = priority.set(BACKGROUND)
+    try:
+        await _revalidate_videos()
+    finally:
+        priority.reset(token)
+
+
+async def _revalidate_videos() -> None:
+    today = datetime.now().date()
+    async with acquire() as conn:
+        records = await conn.fetch(
+            "SELECT artist, tracks FROM top WHERE date > $1",
+            today - timedelta(days=VALID_FOR_DAYS),
+        )
+    tops = {record["artist"]: record["tracks"] for record in records}
+    video_ids = sorted(
+        {video_id for tracks in tops.values() for video_id in tracks if video_id}
+    )
+    logger.info(f"Revalidating {len(video_ids)} YouTube IDs of {len(tops)} artists")
+    available, unavailable = await check_ids(video_ids)
+    async with acquire() as conn:
+        await conn.execute(
+            "UPDATE video SET date = $1 WHERE video_id = ANY($2::text[])",
+            today,
+            list(available),
+        )
+    if not unavailable:
+        return
+    replacements = await find_replacements(unavailable)
+    removed = unavailable - set(replacements)
+    REVALIDATED.inc(len(replacements), result="replaced")
+    REVALIDATED.inc(len(removed), result="removed")
+    async with acquire() as conn:
+        tracks = await conn.fetch(
+            "DELETE FROM video WHERE video_id = ANY($1::text[]) RETURNING track",
+            list(removed),
+        )
+        for record in tracks:
+            video_cache.pop(record["track"])
+        for artist, ids in tops.items():
+            if not unavailable.intersection(ids):
+                continue
+            # rows are changed only if they weren't rewritten since they were read,
+            # otherwise a fresher row would be replaced with the old tracks
+            if removed.intersection(ids):
+                # expired beyond the stale window, so that removed videos
+                # aren't served while the row is rebuilt
+                status = await conn.execute(
+                    "UPDATE top SET date = $2 WHERE artist = $1 AND tracks = $3",
+                    artist,
+                    today - timedelta(days=VALID_FOR_DAYS + MAX_STALE_DAYS),
+                    ids,
+                )
+            else:
+                new_ids = [replacements.get(video_id, video_id) for video_id in ids]
+                status = await conn.execute(
+                    "UPDATE top SET tracks = $2 WHERE artist = $1 AND tracks = $3",
+                    artist,
+                    new_ids,
+                    ids,
+                )
+            if status != "UPDATE 1":
+                logger.debug(f"Skipped '{artist}' as it was updated meanwhile")
+                continue
+            await publish_top(conn, artist)
+            invalidate_top(artist)
+    logger.info(
+        f"Replaced {len(replacements)} and removed {len(removed)} unavailable YouTube IDs"
+    )
@@ -8,15 +8,52 @@ GitHub: https://github.com/pltnk/toptracksbot
 
 import asyncio
 import logging
+from functools import wraps
+from typing import Awaitable, Callable
 
 from telegram import ChatAction, Update
 from telegram.ext import CallbackContext, CommandHandler, MessageHandler, Updater
 from telegram.ext.filters import Filters
 
-from bot.config import BOT_TOKEN, BOT_MODE, WEBHOOK_PORT, HEROKU_APP
-from bot.exceptions import PlaylistRetrievalError, VideoIDsRetrievalError
+from bot.config import (
+    BOT_TOKEN,
+    BOT_MODE,
+    CACHE_SYNC,
+    CACHE_SYNC_INTERVAL,
+    HEROKU_APP,
+    MAX_INFLIGHT_UPDATES,
+    METRICS_PORT,
+    PARSE_WORKERS,
+    PREWARM_INTERVAL,
+    REQUESTS_FLUSH_INTERVAL,
+    REVALIDATE_INTERVAL,
+    TELEGRAM_API_URL,
+    TOP_MAX_TRACKS,
+    TOP_TRACKS,
+    WEBHOOK_PORT,
+)
+from bot.counters import flush_requests
+from bot.db import close_listener, close_pool, get_listener
+from bot.delivery import call, send_message, send_messages
+from bot.exceptions import (
+    JobTimeoutError,
+    PlaylistRetrievalError,
+    VideoIDsRetrievalError,
+)
+from bot.fetching.client import close_clients, open_clients
 from bot.fetching.lastfm import get_info
-from bot.processing import get_top
+from bot.fetching.offload import start_pool, stop_pool
+from bot.metrics import stage, start_http_server
+from bot.prewarm import prewarm
+from bot.processing import get_top, start_cache_sync
+from bot.revalidation import revalidate_videos
+from bot.runner import (
+    LoopRunner,
+    cancel_scheduled,
+    schedule,
+    spawn,
+    wait_background,
+)
 
 
 logging.basicConfig(
@@ -26,124 +63,212 @@ logging.basicConfig(
 logger = logging.getLogger("bot")
 logger.setLevel(logging.DEBUG)
 
+runner = LoopRunner(MAX_INFLIGHT_UPDATES)
+
+
+async def startup() -> None:
+    """Acquire resources shared by the handlers of the running event loop."""
+    await open_clients()
+    if PARSE_WORKERS:
+        await start_pool(PARSE_WORKERS)
+    if CACHE_SYNC:
+        await start_cache_sync()
+        schedule(CACHE_SYNC_INTERVAL, get_listener().ensure, "check_cache_sync")
+    if REQUESTS_FLUSH_INTERVAL:
+        schedule(REQUESTS_FLUSH_INTERVAL, flush_requests, "flush_requests")
+    if REVALIDATE_INTERVAL:
+        schedule(REVALIDATE_INTERVAL * 3600, revalidate_videos, "revalidate_videos")
+    if PREWARM_INTERVAL:
+        schedule(PREWARM_INTERVAL * 3600, prewarm, "prewarm")
+
+
+async def shutdown() -> None:
+    """Release resources acquired by the startup hook."""
+    await cancel_scheduled()
+    await wait_background()
+    await flush_requests()
+    await close_clients()
+    await stop_pool()
+    await close_listener()
+    await close_pool()
+
+
+def submit(
+    handler: Callable[[Update, CallbackContext], Awaitable[None]]
+) -> Callable[[Update, CallbackContext], None]:
+    """
+    Wrap a coroutine handler into a dispatcher callback
+    that schedules it on the shared event loop and returns.
+    :param handler: Coroutine function processing an update.
+    :return: Callback for the dispatcher.
+    """
 
-def send_top(update: Update, context: CallbackContext) -> None:
+    @wraps(handler)
+    def callback(update: Update, context: CallbackContext) -> None:
+        runner.submit(handler(update, context))
+
+    return callback
+
+
+async def send_top(update: Update, context: CallbackContext) -> None:
     """Process incoming message, send top tracks by the given artist or send an error message."""
     logger.info(
         f'(send_top) Incoming message: args={context.args}, text="{update.message.text}"'
     )
-    keyphrase = update.message.text
-    context.bot.send_chat_action(
-        chat_id=update.message.chat_id, action=ChatAction.TYPING
+    await deliver_top(update, context, update.message.text, TOP_TRACKS)
+
+
+async def send_top_command(update: Update, context: CallbackContext) -> None:
+    """Process /top command with an optional number of tracks before the artist name."""
+    logger.info(
+        f'(send_top_command) Incoming message: args={context.args}, text="{update.message.text}"'
+    )
+    args = list(context.args)
+    number = TOP_TRACKS
+    if args and args[0].isdigit():
+        number = int(args.pop(0))
+    if not args or not 1 <= number <= TOP_MAX_TRACKS:
+        await send_message(
+            context.bot,
+            update.message.chat_id,
+            f"Command must be followed by artist name, optionally preceded "
+            f"by a number of tracks up to {TOP_MAX_TRACKS}.\nExample: /top 10 Nirvana",
+        )
+        return
+    await deliver_top(update, context, " ".join(args), number)
+
+
+async def deliver_top(
+    update: Update, context: CallbackContext, keyphrase: str, number: int
+) -> None:
+    """Send top tracks by the given artist or send an error message."""
+    # the chat action is sent while the top is looked up
+    # and only has to be delivered before the reply
+    typing = spawn(
+        call(
+            context.bot.send_chat_action,
+            chat_id=update.message.chat_id,
+            action=ChatAction.TYPING,
+        )
     )
     try:
-        top = asyncio.run(get_top(keyphrase))
+        top = await get_top(keyphrase, number)
     except PlaylistRetrievalError as e:
         logger.error(e)
-        context.bot.send_message(
-            chat_id=update.message.chat_id,
-            text=f"An error occurred, most likely I couldn't find this artist on Last.fm."
-            f"\nMake sure this name is correct.",
-        )
+        texts = [
+            f"An error occurred, most likely I couldn't find this artist on Last.fm."
+            f"\nMake sure this name is correct."
+        ]
     except VideoIDsRetrievalError as e:
         logger.error(e)
-        context.bot.send_message(
-            chat_id=update.message.chat_id, text=f"Unable to get videos from YouTube."
-        )
+        texts = [f"Unable to get videos from YouTube."]
+    except JobTimeoutError as e:
+        # the queued fetch is still running and its result will be stored
+        logger.warning(e)
+        texts = [
+            f"It takes longer than usual to find top tracks of {keyphrase}, "
+            f"try again in a minute."
+        ]
     except Exception as e:
         logger.exception(e)
-        context.bot.send_message(
-            chat_id=update.message.chat_id,
-            text=f"Unexpected error, feel free to open an issue on GitHub: "
-            f"github.com/pltnk/toptracksbot/issues/new",
-        )
+        texts = [
+            f"Unexpected error, feel free to open an issue on GitHub: "
+            f"github.com/pltnk/toptracksbot/issues/new"
+        ]
     else:
         if top:
-            for youtube_id in top:
-                context.bot.send_message(
-                    chat_id=update.message.chat_id,
-                    text=f"youtube.com/watch?v={youtube_id}",
-                )
+            texts = [f"youtube.com/watch?v={youtube_id}" for youtube_id in top]
         else:
-            context.bot.send_message(
-                chat_id=update.message.chat_id,
-                text=f"I couldn't find videos of {keyphrase} on YouTube.",
-            )
+            texts = [f"I couldn't find videos of {keyphrase} on YouTube."]
+    await asyncio.wait([typing])
+    await send_messages(context.bot, update.message.chat_id, texts)
 
 
-def send_info(update: Update, context: CallbackContext) -> None:
+async def send_info(update: Update, context: CallbackContext) -> None:
     """Process /info command."""
     logger.info(
         f'(send_info) Incoming message: args={context.args}, text="{update.message.text}"'
     )
     if len(context.args) == 0:
-        context.bot.send_message(
-            chat_id=update.message.chat_id,
-            text=f"Command must be followed by artist name.\nExample: /info Nirvana",
+        await send_message(
+            context.bot,
+            update.message.chat_id,
+            f"Command must be followed by artist name.\nExample: /info Nirvana",
         )
     else:
         keyphrase = " ".join(context.args)
-        context.bot.send_chat_action(
-            chat_id=update.message.chat_id, action=ChatAction.TYPING
+        typing = spawn(
+            call(
+                context.bot.send_chat_action,
+                chat_id=update.message.chat_id,
+                action=ChatAction.TYPING,
+            )
         )
         try:
-            info = asyncio.run(get_info(keyphrase))
+            with stage("get_info"):
+                info = await get_info(keyphrase)
         except Exception as e:
             logger.exception(e)
-            context.bot.send_message(
-                chat_id=update.message.chat_id,
-                text=f"Unexpected error, feel free to open an issue on GitHub: "
-                f"github.com/pltnk/toptracksbot/issues/new",
+            info = (
+                f"Unexpected error, feel free to open an issue on GitHub: "
+                f"github.com/pltnk/toptracksbot/issues/new"
             )
-        else:
-            context.bot.send_message(chat_id=update.message.chat_id, text=info)
+        await asyncio.wait([typing])
+        await send_message(context.bot, update.message.chat_id, info)
 
 
-def send_help(update: Update, context: CallbackContext) -> None:
+async def send_help(update: Update, context: CallbackContext) -> None:
     """Process /help and /start commands."""
     logger.info(
         f'(send_help) Incoming message: args={context.args}, text="{update.message.text}"'
     )
     message = (
-        "Enter an artist or a band name to get their top three tracks of all time "
+        f"Enter an artist or a band name to get their top {TOP_TRACKS} tracks of all time "
         "according to Last.fm charts.\n"
+        f"/top <number> <artist> or /t <number> <artist> - get up to {TOP_MAX_TRACKS} top tracks\n"
         "/info <artist> or /i <artist> - get a short bio of an artist\n"
         "/help or /h - show this message.\n\n"
         "This bot is an open source project, check it on GitHub: github.com/pltnk/toptracksbot"
     )
-    context.bot.send_message(chat_id=update.message.chat_id, text=message)
+    await send_message(context.bot, update.message.chat_id, message)
 
 
-def unknown(update: Update, context: CallbackContext) -> None:
+async def unknown(update: Update, context: CallbackContext) -> None:
     """Process any unknown command."""
     logger.info(
         f'(unknown) Incoming message: args={context.args}, text="{update.message.text}"'
     )
-    context.bot.send_message(
-        chat_id=update.message.chat_id, text="Unknown command, try /help."
+    await send_message(
+        context.bot, update.message.chat_id, "Unknown command, try /help."
     )
 
 
 def main() -> None:
     # initialize updater
-    updater = Updater(token=BOT_TOKEN, use_context=True)
+    updater = Updater(token=BOT_TOKEN, use_context=True, base_url=TELEGRAM_API_URL)
     dispatcher = updater.dispatcher
 
     # initialize handlers
-    top_handler = MessageHandler(
-        Filters.text & (~Filters.command), send_top, run_async=True
-    )
-    info_handler = CommandHandler(["info", "i"], send_info, run_async=True)
-    help_handler = CommandHandler(["help", "h", "start"], send_help, run_async=True)
-    unknown_handler = MessageHandler(Filters.command, unknown, run_async=True)
+    # coroutine handlers are scheduled on the shared event loop
+    # and don't occupy dispatcher worker threads while they run
+    top_handler = MessageHandler(Filters.text & (~Filters.command), submit(send_top))
+    top_command_handler = CommandHandler(["top", "t"], submit(send_top_command))
+    info_handler = CommandHandler(["info", "i"], submit(send_info))
+    help_handler = CommandHandler(["help", "h", "start"], submit(send_help))
+    unknown_handler = MessageHandler(Filters.command, submit(unknown))
 
     # add handlers to dispatcher
     dispatcher.add_handler(top_handler)
+    dispatcher.add_handler(top_command_handler)
     dispatcher.add_handler(info_handler)
     dispatcher.add_handler(help_handler)
     dispatcher.add_handler(unknown_handler)
 
     # start bot
+    if METRICS_PORT:
+        metrics_server = start_http_server(METRICS_PORT)
+        logger.info(f"Serving metrics on port {METRICS_PORT}")
+    runner.start(startup())
     try:
         if BOT_MODE == "prod":
             updater.start_webhook(
@@ -153,9 +278,13 @@ def main() -> None:
         else:
             logger.info("Starting bot")
             updater.start_polling()
-            updater.idle()
+        updater.idle()
     except Exception as e:
         logger.exception(f"Unable to start a bot. {e}")
+    finally:
+        runner.stop(shutdown())
+        if METRICS_PORT:
+            metrics_server.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Coroutine, Optional, Set
+
+from bot.metrics import Gauge
+
+
+INFLIGHT = Gauge("ttbot_inflight_updates", "Updates currently processed on the loop")
+
+# keep references to background tasks so they are not garbage collected
+_background: Set["asyncio.Task[Any]"] = set()
+_scheduled: Set["asyncio.Task[Any]"] = set()
+
+logger = logging.getLogger("runner")
+logger.setLevel(logging.DEBUG)
+
+
+def spawn(coro: Coroutine[Any, Any, Any]) -> "asyncio.Task[Any]":
+    """
+    Run a coroutine in the background of the running event loop,
+    the caller doesn't wait for it and its exceptions are logged.
+    :param coro: Coroutine to run.
+    :return: Task of the coroutine.
+    """
+    task = asyncio.get_running_loop().create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+
+def _background_done(task: "asyncio.Task[Any]") -> None:
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task failed: {repr(task.exception())}")
+
+
+async def wait_background(timeout: float = 30) -> None:
+    """
+    Wait for background tasks of the running event loop to complete.
+    :param timeout: Max number of seconds to wait.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = [task for task in _background if task.get_loop() is loop]
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+
+
+def schedule(
+    interval: float, func: Callable[[], Awaitable[Any]], name: str
+) -> "asyncio.Task[Any]":
+    """
+    Call a coroutine function periodically on the running event loop
+    until cancel_scheduled is called, failures are logged and don't stop the schedule.
+    :param interval: Number of seconds between the end of a call and the start of the next one.
+    :param func: Coroutine function to call.
+    :param name: Name of the job used in logs.
+    :return: Task running the schedule.
+    """
+
+    async def job() -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await func()
+            except Exception as e:
+                logger.exception(f"Scheduled job '{name}' failed: {repr(e)}")
+
+    task = asyncio.get_running_loop().create_task(job())
+    _scheduled.add(task)
+    task.add_done_callback(_scheduled.discard)
+    logger.info(f"Scheduled job '{name}' every {interval} seconds")
+    return task
+
+
+async def cancel_scheduled() -> None:
+    """Cancel periodic jobs of the running event loop."""
+    loop = asyncio.get_running_loop()
+    tasks = [task for task in _scheduled if task.get_loop() is loop]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class LoopRunner:
+    """
+    Persistent event loop running in a background thread.
+    Coroutines are submitted to it from the dispatcher threads, so clients,
+    pools and caches bound to the loop live for the whole process lifetime.
+    """
+
+    def __init__(self, max_inflight: int, io_workers: Optional[int] = None):
+        """
+        :param max_inflight: Max number of coroutines executed at once,
+        submit blocks the calling thread when this number is reached.
+        :param io_workers: Number of threads for blocking calls made from the loop.
+        """
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(
+            ThreadPoolExecutor(
+                max_workers=io_workers or max_inflight, thread_name_prefix="loop-io"
+            )
+        )
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="event-loop", daemon=True
+        )
+        self._inflight = threading.BoundedSemaphore(max_inflight)
+        self._futures: Set[concurrent.futures.Future] = set()
+
+    def start(self, startup: Optional[Awaitable[Any]] = None) -> None:
+        """
+        Start the loop thread and wait for the startup hook to complete.
+        :param startup: Coroutine to run before accepting submissions.
+        """
+        self._thread.start()
+        if startup is not None:
+            asyncio.run_coroutine_threadsafe(startup, self.loop).result()
+        logger.info("Event loop is running")
+
+    def submit(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """
+        Schedule a coroutine on the loop, blocking while too many are in flight.
+        :param coro: Coroutine to run.
+        :return: Future with the result of the coroutine.
+        """
+        self._inflight.acquire()
+        INFLIGHT.inc()
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)  # type: ignore
+        self._futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: concurrent.futures.Future) -> None:
+        self._futures.discard(future)
+        INFLIGHT.dec()
+        self._inflight.release()
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(
+                f"Unhandled exception in submitted coroutine: {repr(future.exception())}"
+            )
+
+    def stop(
+        self, shutdown: Optional[Awaitable[Any]] = None, timeout: float = 30
+    ) -> None:
+        """
+        Wait for submitted coroutines, run the shutdown hook and stop the loop.
+        :param shutdown: Coroutine to run after in-flight coroutines are done.
+        :param timeout: Max number of seconds to wait for in-flight coroutines.
+        """
+        concurrent.futures.wait(list(self._futures), timeout=timeout)
+        if shutdown is not None:
+            asyncio.run_coroutine_threadsafe(shutdown, self.loop).result(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        logger.info("Event loop is stopped")
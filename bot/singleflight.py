@@ -0,0 +1,109 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+from bot.fetching.client import BACKGROUND, INTERACTIVE, priority
+from bot.metrics import Counter, Gauge
+
+
+T = TypeVar("T")
+
+CALLS = Counter("ttbot_singleflight_calls_total", "Executed calls", ("flight",))
+COALESCED = Counter(
+    "ttbot_singleflight_coalesced_total",
+    "Calls that joined an identical call already in flight",
+    ("flight",),
+)
+# keys come from user input, so per key counts are only kept in memory
+WAITERS = Gauge(
+    "ttbot_singleflight_waiters", "Callers waiting for in-flight calls", ("flight",)
+)
+INFLIGHT = Gauge(
+    "ttbot_singleflight_inflight_keys",
+    "Keys with a call in flight",
+    ("flight",),
+)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single execution.
+    Calls run at the priority of the caller that starts them, so interactive
+    callers don't join background calls and start calls of their own instead.
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: Name used as a label of the metrics.
+        """
+        self.name = name
+        self._calls: Dict[Hashable, Tuple["asyncio.Task[Any]", str]] = {}
+        self._waiters: Dict[Hashable, int] = {}
+
+    def waiters(self, key: Hashable) -> int:
+        """
+        Get the number of callers waiting for the call with the given key.
+        :param key: Key of the call.
+        :return: Number of waiting callers including the one that started it.
+        """
+        return self._waiters.get(key, 0)
+
+    async def do(
+        self, key: Hashable, func: Callable[[], Awaitable[T]]
+    ) -> Tuple[T, bool]:
+        """
+        Execute func unless a call with the same key is already in flight,
+        in that case wait for it and share its result or exception.
+        An interactive caller doesn't wait for a background call, as its upstream
+        requests would wait behind interactive ones, the new call replaces it for
+        later callers instead.
+        The call is not cancelled if the caller that started it is cancelled.
+        :param key: Key identifying identical calls.
+        :param func: Function returning an awaitable to execute.
+        :return: Result of the call and whether it was shared with another caller.
+        """
+        task, task_priority = self._calls.get(key, (None, None))
+        caller_priority = priority.get()
+        if task_priority == BACKGROUND and caller_priority == INTERACTIVE:
+            task = None
+        coalesced = task is not None
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task, caller_priority
+            task.add_done_callback(self._forget(key))
+            CALLS.inc(flight=self.name)
+        else:
+            COALESCED.inc(flight=self.name)
+        if key not in self._waiters:
+            INFLIGHT.inc(flight=self.name)
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        WAITERS.inc(flight=self.name)
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            self._leave(key)
+        return result, coalesced
+
+    def _forget(self, key: Hashable) -> Callable[["asyncio.Task[Any]"], None]:
+        def forget(task: "asyncio.Task[Any]") -> None:
+            # a background call may be replaced by an interactive one with the same key
+            if self._calls.get(key, (None, None))[0] is task:
+                del self._calls[key]
+
+        return forget
+
+    def _leave(self, key: Hashable) -> None:
+        count = self._waiters[key] - 1
+        WAITERS.dec(flight=self.name)
+        if count > 0:
+            self._waiters[key] = count
+        else:
+            del self._waiters[key]
+            INFLIGHT.dec(flight=self.name)
@@ -0,0 +1,121 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+"""
+
+
+import asyncio
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+
+from bot.cache import TTLCache
+from bot.config import CACHE_MAX_ENTRIES, VIDEO_VALID_FOR_DAYS
+from bot.db import acquire
+from bot.fetching.youtube import get_yt_id
+from bot.metrics import Counter
+
+
+# in-memory front of the video table
+video_cache = TTLCache("video", CACHE_MAX_ENTRIES)
+
+LOOKUPS = Counter(
+    "ttbot_video_lookups_total",
+    "Video IDs of tracks by the source they were found in",
+    ("source",),
+)
+
+logger = logging.getLogger("videos")
+logger.setLevel(logging.DEBUG)
+
+
+def track_key(track: str) -> str:
+    """
+    Get a key identifying a track regardless of letter case and spacing.
+    :param track: Track title formatted as '<artist> - <track>'.
+    :return: Normalized track title.
+    """
+    return " ".join(track.lower().split())
+
+
+def _expiration(day: date) -> float:
+    return datetime.combine(
+        day + timedelta(days=VIDEO_VALID_FOR_DAYS), time.min
+    ).timestamp()
+
+
+async def load_video_ids(keys: List[str]) -> Dict[str, str]:
+    """
+    Get valid stored video IDs of the given tracks.
+    :param keys: Normalized track titles.
+    :return: Mapping of normalized track titles to video IDs.
+    """
+    found = {}
+    for key in keys:
+        video_id = video_cache.get(key)
+        if video_id is not None:
+            found[key] = video_id
+    LOOKUPS.inc(len(found), source="memory")
+    missing = [key for key in keys if key not in found]
+    if not missing:
+        return found
+    async with acquire() as conn:
+        records = await conn.fetch(
+            "SELECT track, video_id, date FROM video WHERE track = ANY($1::text[])",
+            missing,
+        )
+    now = datetime.now().timestamp()
+    for record in records:
+        expires = _expiration(record["date"])
+        if expires > now:
+            found[record["track"]] = record["video_id"]
+            video_cache.set(record["track"], record["video_id"], expires)
+            LOOKUPS.inc(source="database")
+    return found
+
+
+async def save_video_ids(video_ids: Dict[str, str]) -> None:
+    """
+    Store video IDs of tracks.
+    :param video_ids: Mapping of normalized track titles to video IDs.
+    """
+    if not video_ids:
+        return
+    today = datetime.now().date()
+    query = """INSERT INTO video (track, video_id, date)
+               VALUES($1, $2, $3)
+               ON CONFLICT (track)
+               DO UPDATE SET video_id = $2, date = $3"""
+    async with acquire() as conn:
+        await conn.executemany(
+            query, [(key, video_id, today) for key, video_id in video_ids.items()]
+        )
+    for key, video_id in video_ids.items():
+        video_cache.set(key, video_id, _expiration(today))
+
+
+async def get_video_ids_by_position(playlist: List[str]) -> List[Optional[str]]:
+    """
+    Create a list containing a YouTube ID for each track in the given playlist.
+    Stored IDs are reused and YouTube is searched only for the remaining tracks.
+    :param playlist: List of tracks formatted as '<artist> - <track>'.
+    :return: List of corresponding YouTube IDs, None for tracks without found IDs.
+    """
+    keys = [track_key(track) for track in playlist]
+    found = await load_video_ids(keys)
+    search = [(key, track) for key, track in zip(keys, playlist) if key not in found]
+    if search:
+        result = await asyncio.gather(
+            *(get_yt_id(track) for _, track in search), return_exceptions=True
+        )
+        fetched = {
+            key: video_id
+            for (key, _), video_id in zip(search, result)
+            if isinstance(video_id, str)
+        }
+        LOOKUPS.inc(len(fetched), source="search")
+        await save_video_ids(fetched)
+        found.update(fetched)
+    return [found.get(key) for key in keys]
@@ -3,6 +3,7 @@ import asyncio
 import asyncpg
 
 from bot.config import DATABASE_URI, DBCONN_RETRIES, DBCONN_TIMEOUT
+from bot.migrate import migrate
 
 
 async def ping_db(db_uri: str, retries: int, timeout: int) -> None:
@@ -24,8 +25,32 @@ async def ping_db(db_uri: str, retries: int, timeout: int) -> None:
             break
 
 
+async def migrate_db(db_uri: str) -> None:
+    """
+    Apply pending migrations to the database.
+    :param db_uri: URI of a database to migrate.
+    """
+    conn = await asyncpg.connect(dsn=db_uri)
+    try:
+        applied = await migrate(conn)
+    finally:
+        await conn.close()
+    print(f"Applied {len(applied)} migrations")
+
+
+async def prepare_db(db_uri: str, retries: int, timeout: int) -> None:
+    """
+    Wait for the database to become available and migrate it.
+    :param db_uri: URI of a database.
+    :param retries: Max number of retries.
+    :param timeout: Timeout between retries in seconds.
+    """
+    await ping_db(db_uri, retries, timeout)
+    await migrate_db(db_uri)
+
+
 def main() -> None:
-    asyncio.run(ping_db(DATABASE_URI, DBCONN_RETRIES, DBCONN_TIMEOUT))
+    asyncio.run(prepare_db(DATABASE_URI, DBCONN_RETRIES, DBCONN_TIMEOUT))
 
 
 if __name__ == "__main__":
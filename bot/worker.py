@@ -0,0 +1,140 @@
+"""
+This module is a part of Top Tracks Bot for Telegram
+and is licensed under the MIT License.
+Copyright (c) 2019-2021 Kirill Plotnikov
+GitHub: https://github.com/pltnk/toptracksbot
+
+Worker fetching top tracks queued by the bot when TTBOT_JOB_QUEUE is enabled,
+any number of workers can run on any number of nodes next to the bot.
+"""
+
+
+import asyncio
+import logging
+import signal
+from functools import partial
+
+from bot.config import (
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_RETENTION_HOURS,
+    JOB_TIMEOUT,
+    METRICS_PORT,
+    PARSE_WORKERS,
+    WORKER_CONCURRENCY,
+)
+from bot.db import acquire, close_listener, close_pool, get_listener
+from bot.exceptions import JobFailedError
+from bot.fetching.client import close_clients, open_clients
+from bot.fetching.offload import start_pool, stop_pool
+from bot.jobs import QUEUED_CHANNEL, claim, finish, purge_jobs
+from bot.metrics import stage, start_http_server
+from bot.processing import update_top
+from bot.runner import cancel_scheduled, schedule, wait_background
+
+
+logging.basicConfig(
+    format="%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+    level=logging.INFO,
+)
+logger = logging.getLogger("worker")
+logger.setLevel(logging.DEBUG)
+
+
+async def process_job() -> bool:
+    """
+    Run the next queued job, if there is one, and save its result.
+    :return: True if a job was run, False if there were no jobs to run.
+    """
+    async with acquire() as conn:
+        job = await claim(conn)
+    if job is None:
+        return False
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        logger.error(f"Job {job['id']} was abandoned {JOB_MAX_ATTEMPTS} times")
+        error = JobFailedError(job["id"], f"abandoned {JOB_MAX_ATTEMPTS} times")
+        await finish(job["id"], error=error)
+        return True
+    logger.info(f"Running job {job['id']} for '{job['artist']}'")
+    try:
+        with stage("job"):
+            tracks = await update_top(job["artist"], job["playlist"], job["number"])
+    except Exception as e:
+        logger.error(f"Job {job['id']} failed: {repr(e)}")
+        await finish(job["id"], error=e)
+    else:
+        await finish(job["id"], tracks=tracks)
+    return True
+
+
+async def work(queued: asyncio.Event, stopped: asyncio.Event) -> None:
+    """
+    Run queued jobs one by one, waiting for new ones when there are none.
+    :param queued: Event set when a job is queued.
+    :param stopped: Event set when the worker is stopped.
+    """
+    while not stopped.is_set():
+        queued.clear()
+        try:
+            if await process_job():
+                continue
+        except Exception as e:
+            logger.exception(f"Unable to process a job: {repr(e)}")
+        try:
+            await asyncio.wait_for(queued.wait(), JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def serve(concurrency: int) -> None:
+    """
+    Run jobs in the given number of parallel loops until the process is terminated.
+    :param concurrency: Max number of jobs run at once.
+    """
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+    await open_clients()
+    if PARSE_WORKERS:
+        await start_pool(PARSE_WORKERS)
+    queued = asyncio.Event()
+    listener = get_listener()
+    await listener.subscribe(QUEUED_CHANNEL, lambda payload: queued.set())
+    schedule(3600, partial(purge_jobs, JOB_RETENTION_HOURS), "purge_jobs")
+    schedule(JOB_POLL_INTERVAL, listener.ensure, "ensure_listener")
+    workers = [loop.create_task(work(queued, stopped)) for _ in range(concurrency)]
+    logger.info(f"Worker is running {concurrency} jobs at once")
+    try:
+        await stopped.wait()
+    finally:
+        # running jobs are finished, the ones still running after JOB_TIMEOUT
+        # are interrupted and taken again by other workers
+        stopped.set()
+        queued.set()
+        await asyncio.wait(workers, timeout=JOB_TIMEOUT)
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await cancel_scheduled()
+        await wait_background()
+        await close_clients()
+        await stop_pool()
+        await close_listener()
+        await close_pool()
+        logger.info("Worker is stopped")
+
+
+def main() -> None:
+    if METRICS_PORT:
+        metrics_server = start_http_server(METRICS_PORT)
+        logger.info(f"Serving metrics on port {METRICS_PORT}")
+    try:
+        asyncio.run(serve(WORKER_CONCURRENCY))
+    finally:
+        if METRICS_PORT:
+            metrics_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
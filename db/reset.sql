@@ -0,0 +1,14 @@
+-- tables are created by migrations in bot/migrations applied by bot/wait_for_db.py,
+-- this script drops them so that the schema is migrated from scratch
+
+DROP TABLE IF EXISTS top;
+
+DROP TABLE IF EXISTS counter;
+
+DROP TABLE IF EXISTS alias;
+
+DROP TABLE IF EXISTS video;
+
+DROP TABLE IF EXISTS job;
+
+DROP TABLE IF EXISTS schema_migrations;
@@ -1,10 +1,15 @@
+import datetime
 import os
 import uuid
-from typing import AsyncGenerator, Dict, List
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional
 
 import asyncpg
 import pytest
 
+from bot import aliases, counters, db, processing, videos
+from bot.migrate import migrate
+from bot.runner import wait_background
+
 
 @pytest.fixture
 def required_env_vars() -> List[str]:
@@ -61,18 +66,47 @@ def database_uri() -> str:
 
 
 @pytest.fixture
-def init_sql_path() -> str:
-    return "./db/init.sql"
+def reset_sql_path() -> str:
+    return "./db/reset.sql"
 
 
 @pytest.fixture
-async def db_conn(database_uri, init_sql_path) -> AsyncGenerator:
+async def db_conn(database_uri, reset_sql_path) -> AsyncGenerator:
     conn = await asyncpg.connect(dsn=database_uri)
-    with open(init_sql_path, "r") as f:
+    with open(reset_sql_path, "r") as f:
         query = f.read()
     await conn.execute(query)
+    await migrate(conn)
+    processing.top_cache.clear()
+    aliases.alias_cache.clear()
+    videos.video_cache.clear()
+    counters._pending.clear()
     yield conn
+    await wait_background()
     await conn.close()
+    await db.close_listener()
+    await db.close_pool()
+
+
+@pytest.fixture
+def insert_top(db_conn) -> Callable[..., Awaitable[None]]:
+    async def insert(
+        artist: str,
+        tracks: List[Optional[str]],
+        date: datetime.date,
+        requests: int = 1,
+    ) -> None:
+        await db_conn.execute(
+            "INSERT INTO top (artist, tracks, date) VALUES ($1, $2, $3)",
+            artist,
+            tracks,
+            date,
+        )
+        await db_conn.execute(
+            "INSERT INTO counter (artist, requests) VALUES ($1, $2)", artist, requests
+        )
+
+    return insert
 
 
 @pytest.fixture
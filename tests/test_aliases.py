@@ -0,0 +1,51 @@
+import datetime
+
+import pytest
+from asyncpg.connection import Connection
+
+from bot import aliases
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_save_alias(db_conn: Connection) -> None:
+    assert await aliases.get_alias("norvana") is None
+    await aliases.save_alias("norvana", "nirvana")
+    record = await db_conn.fetchrow(
+        "SELECT * FROM alias WHERE keyphrase = $1", "norvana"
+    )
+    assert record["artist"] == "nirvana"
+    assert record["date"] == datetime.datetime.now().date()
+    assert await aliases.get_alias("norvana") == "nirvana"
+
+
+async def test_get_alias(db_conn: Connection) -> None:
+    today = datetime.datetime.now().date()
+    old_date = today - datetime.timedelta(days=aliases.ALIAS_VALID_FOR_DAYS + 1)
+    await db_conn.executemany(
+        "INSERT INTO alias (keyphrase, artist, date) VALUES ($1, $2, $3)",
+        [("slipnot", "slipknot", today), ("norvana", "nirvana", old_date)],
+    )
+    assert await aliases.get_alias("slipnot") == "slipknot"
+    assert "slipnot" in aliases.alias_cache
+    assert await aliases.get_alias("norvana") is None
+
+
+async def test_get_alias_miss(db_conn: Connection, monkeypatch) -> None:
+    assert await aliases.get_alias("slipnot") is None
+    assert aliases.alias_cache.get("slipnot") is aliases.NO_ALIAS
+    # the miss is served from cache without querying the table again
+    await db_conn.execute(
+        "INSERT INTO alias (keyphrase, artist, date) VALUES ($1, $2, $3)",
+        "slipnot",
+        "slipknot",
+        datetime.datetime.now().date(),
+    )
+    assert await aliases.get_alias("slipnot") is None
+    await aliases.save_alias("slipnot", "slipknot")
+    assert await aliases.get_alias("slipnot") == "slipknot"
+    aliases.alias_cache.clear()
+    monkeypatch.setattr(aliases, "ALIAS_MISS_TTL", 0)
+    assert await aliases.get_alias("norvana") is None
+    assert "norvana" not in aliases.alias_cache
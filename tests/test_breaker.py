@@ -0,0 +1,86 @@
+import datetime
+import time
+
+import httpx
+import pytest
+
+from bot.exceptions import CircuitOpenError, RateLimitError
+from bot.fetching import breaker
+
+
+def test_circuit_breaker() -> None:
+    cb = breaker.CircuitBreaker(
+        "test", window=60, error_rate=0.5, min_calls=4, reset_timeout=0.05
+    )
+    for _ in range(2):
+        assert cb.allow()
+        cb.record_success()
+    cb.record_failure()
+    assert cb.state == breaker.CLOSED
+    cb.record_failure()
+    assert cb.state == breaker.OPEN
+    assert not cb.allow()
+    time.sleep(0.06)
+    assert cb.allow()
+    assert cb.state == breaker.HALF_OPEN
+    assert not cb.allow()
+    cb.record_failure()
+    assert cb.state == breaker.OPEN
+    time.sleep(0.06)
+    assert cb.allow()
+    cb.record_success()
+    assert cb.state == breaker.CLOSED
+    assert cb.allow()
+
+
+def test_is_backend_failure() -> None:
+    request = httpx.Request("GET", "https://example.com")
+    for status, expected in ((404, False), (429, True), (500, True)):
+        response = httpx.Response(status, request=request)
+        error = httpx.HTTPStatusError("", request=request, response=response)
+        assert breaker.is_backend_failure(error) is expected
+    assert breaker.is_backend_failure(httpx.ConnectTimeout(""))
+    assert breaker.is_backend_failure(ResourceWarning())
+    assert not breaker.is_backend_failure(KeyError("artist"))
+
+
+def test_next_pacific_midnight() -> None:
+    midnight = breaker.next_pacific_midnight()
+    assert 0 < midnight - time.time() <= datetime.timedelta(days=1).total_seconds()
+
+
+@pytest.mark.asyncio
+async def test_guarded() -> None:
+    cb = breaker.CircuitBreaker("test_guarded")
+    calls = 0
+
+    @breaker.guarded(cb)
+    async def fetch() -> None:
+        nonlocal calls
+        calls += 1
+        raise ResourceWarning("YouTube API quota has reached the limit")
+
+    with pytest.raises(ResourceWarning):
+        await fetch()
+    assert cb.state == breaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        await fetch()
+    assert calls == 1
+    assert breaker.REJECTED.value(backend="test_guarded") == 1
+    assert cb._open_until == breaker.next_pacific_midnight()
+
+
+@pytest.mark.asyncio
+async def test_guarded_rate_limited() -> None:
+    cb = breaker.CircuitBreaker("test_guarded_rate_limited", reset_timeout=0)
+    cb.trip()
+
+    @breaker.guarded(cb)
+    async def fetch() -> None:
+        raise RateLimitError("example.com")
+
+    # a throttled probe neither closes nor reopens the circuit
+    with pytest.raises(RateLimitError):
+        await fetch()
+    assert cb.state == breaker.HALF_OPEN
+    assert cb.allow()
@@ -0,0 +1,38 @@
+import time
+
+from bot.cache import EVICTIONS, EXPIRATIONS, HITS, MISSES, TTLCache
+
+
+def test_ttl_cache() -> None:
+    cache = TTLCache("test_ttl", max_entries=10)
+    expires = time.time() + 60
+    assert cache.get("a") is None
+    cache.set("a", [1, 2, 3], expires)
+    assert "a" in cache
+    assert cache.get("a") == [1, 2, 3]
+    assert HITS.value(cache="test_ttl") == 1
+    assert MISSES.value(cache="test_ttl") == 1
+    cache.set("b", "expired", time.time() - 1)
+    assert "b" not in cache
+    cache.set("c", "expiring", time.time() + 0.01)
+    time.sleep(0.02)
+    assert cache.get("c") is None
+    assert EXPIRATIONS.value(cache="test_ttl") == 1
+    assert cache.pop("a") == [1, 2, 3]
+    assert len(cache) == 0
+
+
+def test_lru_eviction() -> None:
+    cache = TTLCache("test_lru", max_entries=2)
+    expires = time.time() + 60
+    cache.set("a", 1, expires)
+    cache.set("b", 2, expires)
+    cache.get("a")
+    cache.set("c", 3, expires)
+    assert len(cache) == 2
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert EVICTIONS.value(cache="test_lru") == 1
+    cache.clear()
+    assert len(cache) == 0
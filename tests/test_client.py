@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+import pytest
+
+from bot.exceptions import RateLimitError
+from bot.fetching import client
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_get_client() -> None:
+    lastfm_client = client.get_client(client.LASTFM)
+    youtube_client = client.get_client(client.YOUTUBE)
+    assert client.get_client(client.LASTFM) is lastfm_client
+    assert client.get_client(client.YOUTUBE) is youtube_client
+    assert lastfm_client is not youtube_client
+    assert lastfm_client.follow_redirects
+    assert not youtube_client.follow_redirects
+    await client.close_clients()
+
+
+async def test_close_clients() -> None:
+    await client.open_clients()
+    lastfm_client = client.get_client(client.LASTFM)
+    await client.close_clients()
+    assert lastfm_client.is_closed
+    new_client = client.get_client(client.LASTFM)
+    assert new_client is not lastfm_client
+    assert not new_client.is_closed
+    await client.close_clients()
+
+
+async def test_limiter_deadline() -> None:
+    limiter = client.HostLimiter("example.com", 10, max_wait=0.15)
+    for _ in range(10):
+        assert await limiter.acquire(client.INTERACTIVE) == pytest.approx(0, abs=0.01)
+    waited, rejected = await asyncio.gather(
+        limiter.acquire(client.INTERACTIVE),
+        limiter.acquire(client.INTERACTIVE),
+        return_exceptions=True,
+    )
+    assert waited == pytest.approx(0.1, abs=0.05)
+    assert isinstance(rejected, RateLimitError)
+    # the rejected request doesn't keep its token
+    assert limiter.bucket.tokens() >= 0
+    labels = {"host": "example.com", "priority": client.INTERACTIVE}
+    assert client.THROTTLED.value(**labels) == 1
+    assert client.QUEUED.value(**labels) == 0
+
+
+async def test_limiter_priority() -> None:
+    limiter = client.HostLimiter("example.org", 10, max_wait=1)
+    for _ in range(10):
+        limiter.bucket.reserve()
+    order = []
+
+    async def request(priority_class: str) -> None:
+        await limiter.acquire(priority_class)
+        order.append(priority_class)
+
+    # interactive requests arriving later are still served first
+    background = asyncio.create_task(request(client.BACKGROUND))
+    await asyncio.sleep(0)
+    interactive = [asyncio.create_task(request(client.INTERACTIVE)) for _ in range(5)]
+    await asyncio.gather(background, *interactive)
+    assert order == [client.INTERACTIVE] * 5 + [client.BACKGROUND]
+    limiter.background_max_wait = 0.05
+    limiter.bucket.reserve()
+    with pytest.raises(RateLimitError):
+        await limiter.acquire(client.BACKGROUND)
+
+
+async def test_throttled_transport(monkeypatch) -> None:
+    limiter = client.HostLimiter("example.net", 1, max_wait=0)
+    monkeypatch.setitem(client.limiters, "example.net", limiter)
+    transport = client.ThrottledTransport(
+        httpx.MockTransport(lambda request: httpx.Response(200))
+    )
+    async with httpx.AsyncClient(transport=transport) as http:
+        assert (await http.get("https://example.net/")).status_code == 200
+        with pytest.raises(RateLimitError):
+            await http.get("https://example.net/")
+        # other hosts aren't limited
+        for _ in range(3):
+            assert (await http.get("https://example.com/")).status_code == 200
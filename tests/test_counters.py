@@ -0,0 +1,52 @@
+import datetime
+
+import pytest
+from asyncpg.connection import Connection
+
+from bot import counters
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_flush_requests(db_conn: Connection, insert_top) -> None:
+    today = datetime.datetime.now().date()
+    await insert_top("nirvana", [], today)
+    await insert_top("slipknot", [], today)
+    await counters.flush_requests()
+    for artist in ("nirvana", "nirvana", "slipknot"):
+        counters.count_request(artist)
+    assert counters.PENDING.value() == 3
+    flushed = counters.FLUSHED.value()
+    await counters.flush_requests()
+    assert counters.PENDING.value() == 0
+    assert counters.FLUSHED.value() - flushed == 3
+    records = await db_conn.fetch(
+        "SELECT artist, requests FROM counter ORDER BY artist"
+    )
+    assert [tuple(r) for r in records] == [("nirvana", 3), ("slipknot", 2)]
+
+
+async def test_flush_requests_new_counter(db_conn: Connection) -> None:
+    counters.count_request("nirvana")
+    counters.count_request("nirvana")
+    flushed = counters.FLUSHED.value()
+    await counters.flush_requests()
+    assert counters.FLUSHED.value() - flushed == 2
+    requests = await db_conn.fetchval(
+        "SELECT requests FROM counter WHERE artist = $1", "nirvana"
+    )
+    assert requests == 2
+
+
+async def test_flush_requests_failure(db_conn: Connection, monkeypatch) -> None:
+    counters.count_request("nirvana")
+
+    def acquire():
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(counters, "acquire", acquire)
+    with pytest.raises(ConnectionError):
+        await counters.flush_requests()
+    counters.count_request("nirvana")
+    assert counters.PENDING.value() == 2
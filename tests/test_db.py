@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from asyncpg.connection import Connection
+
+from bot import db
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_get_pool() -> None:
+    pool = await db.get_pool()
+    assert await db.get_pool() is pool
+    await db.close_pool()
+    assert await db.get_pool() is not pool
+    await db.close_pool()
+
+
+async def test_acquire(db_conn: Connection) -> None:
+    acquires = db.ACQUIRES.value()
+    async with db.acquire() as conn:
+        assert await conn.fetchval("SELECT 1") == 1
+        assert db.IN_USE.value() == 1
+    assert db.IN_USE.value() == 0
+    assert db.ACQUIRES.value() == acquires + 1
+
+
+async def test_acquire_timeout(db_conn: Connection) -> None:
+    timeouts = db.ACQUIRE_TIMEOUTS.value()
+    holders = [db.acquire() for _ in range(db.DB_POOL_MAX_SIZE)]
+    for holder in holders:
+        await holder.__aenter__()
+    with pytest.raises(asyncio.TimeoutError):
+        async with db.acquire():
+            pass
+    for holder in holders:
+        await holder.__aexit__(None, None, None)
+    assert db.ACQUIRE_TIMEOUTS.value() == timeouts + 1
+    assert db.SATURATED_ACQUIRES.value() > 0
+
+
+async def test_listener(db_conn: Connection) -> None:
+    listener = db.get_listener()
+    assert db.get_listener() is listener
+    received = asyncio.Queue()
+    await listener.subscribe("ttbot_test", received.put_nowait)
+    await db_conn.execute("SELECT pg_notify('ttbot_test', 'first')")
+    assert await asyncio.wait_for(received.get(), 1) == "first"
+    # a lost connection is reopened with its channels
+    assert not await listener.ensure()
+    await listener._conn.close()
+    assert await listener.ensure()
+    await db_conn.execute("SELECT pg_notify('ttbot_test', 'second')")
+    assert await asyncio.wait_for(received.get(), 1) == "second"
+    listener.unsubscribe("ttbot_test", received.put_nowait)
+    await db_conn.execute("SELECT pg_notify('ttbot_test', 'third')")
+    await asyncio.sleep(0.1)
+    assert received.empty()
+    await db.close_listener()
+    assert db.get_listener() is not listener
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from typing import List, Tuple
+
+import pytest
+from telegram.error import RetryAfter
+
+from bot import delivery
+
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeBot:
+    def __init__(self, flood_waits: int = 0):
+        self.sent: List[Tuple[int, str]] = []
+        self.flood_waits = flood_waits
+
+    def send_message(self, chat_id: int, text: str) -> str:
+        if self.flood_waits:
+            self.flood_waits -= 1
+            raise RetryAfter(0.2)
+        time.sleep(0.05)
+        self.sent.append((chat_id, text))
+        return text
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch) -> None:
+    monkeypatch.setattr(delivery, "TELEGRAM_CHAT_RATE", 10)
+    monkeypatch.setattr(delivery, "TELEGRAM_CHAT_BURST", 3)
+    monkeypatch.setattr(delivery, "_global_bucket", delivery.TokenBucket(100, 100))
+    delivery._chat_buckets.clear()
+
+
+@pytest.mark.parametrize(
+    "mode, sent, max_elapsed",
+    [
+        (delivery.SEQUENTIAL, [(1, "a"), (1, "b"), (1, "c")], 0.3),
+        (delivery.CONCURRENT, [(1, "a"), (1, "b"), (1, "c")], 0.12),
+        (delivery.COALESCED, [(1, "a\nb\nc")], 0.12),
+    ],
+)
+async def test_send_messages(
+    mode: str, sent: List[Tuple[int, str]], max_elapsed: float
+) -> None:
+    bot = FakeBot()
+    start = time.monotonic()
+    await delivery.send_messages(bot, 1, ["a", "b", "c"], mode=mode)
+    assert time.monotonic() - start < max_elapsed
+    assert sorted(bot.sent) == sent
+    with pytest.raises(ValueError):
+        await delivery.send_messages(bot, 1, ["a"], mode="unknown")
+
+
+async def test_chat_rate_limit() -> None:
+    bot = FakeBot()
+    start = time.monotonic()
+    await asyncio.gather(
+        *(delivery.send_message(bot, 1, str(i)) for i in range(5)),
+        delivery.send_message(bot, 2, "other"),
+    )
+    # the burst of three goes at once and two more wait for tokens of the chat
+    assert time.monotonic() - start == pytest.approx(0.25, abs=0.05)
+    assert len(bot.sent) == 6
+
+
+async def test_retry_after() -> None:
+    flood_waits = delivery.FLOOD_WAITS.value()
+    bot = FakeBot(flood_waits=1)
+    start = time.monotonic()
+    assert await delivery.send_message(bot, 1, "a") == "a"
+    assert time.monotonic() - start >= 0.2
+    assert delivery.FLOOD_WAITS.value() == flood_waits + 1
+    with pytest.raises(RetryAfter):
+        await delivery.send_message(FakeBot(flood_waits=10), 1, "b")
+    assert delivery.FLOOD_WAITS.value() == flood_waits + 2 + delivery.TELEGRAM_RETRIES
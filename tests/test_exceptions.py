@@ -1,6 +1,13 @@
 import pytest
 
-from bot.exceptions import PlaylistRetrievalError, VideoIDsRetrievalError
+from bot.exceptions import (
+    CircuitOpenError,
+    JobFailedError,
+    JobTimeoutError,
+    PlaylistRetrievalError,
+    QuotaBudgetError,
+    VideoIDsRetrievalError,
+)
 
 
 def test_playlist_retrieval_error() -> None:
@@ -17,3 +24,28 @@ def test_video_ids_retrieval_error() -> None:
     with pytest.raises(VideoIDsRetrievalError) as exc_info:
         raise VideoIDsRetrievalError(playlist)
     assert str(exc_info.value) == f"Unable to get video IDs for {playlist} from YouTube"
+
+
+def test_circuit_open_error() -> None:
+    backend = "youtube_api"
+    with pytest.raises(CircuitOpenError) as exc_info:
+        raise CircuitOpenError(backend)
+    assert str(exc_info.value) == f"Circuit breaker for {backend} is open"
+
+
+def test_job_failed_error() -> None:
+    with pytest.raises(JobFailedError) as exc_info:
+        raise JobFailedError(1, "timed out")
+    assert str(exc_info.value) == "Job 1 failed: timed out"
+
+
+def test_quota_budget_error() -> None:
+    with pytest.raises(QuotaBudgetError) as exc_info:
+        raise QuotaBudgetError(3000)
+    assert str(exc_info.value) == "Budget of 3000 YouTube API quota units is spent"
+
+
+def test_job_timeout_error() -> None:
+    with pytest.raises(JobTimeoutError) as exc_info:
+        raise JobTimeoutError(1)
+    assert str(exc_info.value) == "Job 1 is not finished yet"
@@ -0,0 +1,95 @@
+import pytest
+
+from bot.fetching import extract
+
+
+TRACKS_PAGE = b"""<html><head><title>Nirvana</title></head><body>
+<header><a class="logo" title="Last.fm" href="/">Last.fm</a>
+<h1 class="header-new-title" itemprop="name">
+  Nirvana
+</h1></header>
+<table class="chartlist"><tbody>
+<tr><td class="chartlist-name"><a href="/1" title="Smells Like Teen Spirit">Smells Like Teen Spirit</a></td></tr>
+<tr><td class="chartlist-name"><a class="" href="/2" title="Come as You Are">Come as You Are</a></td></tr>
+<tr><td class="chartlist-name"><a href="/3">Untitled</a></td></tr>
+<tr><td class="chartlist-name"><a href="/4" title="Lithium">Lithium</a></td></tr>
+<tr><td class="chartlist-name"><a href="/5" title="Heart-Shaped Box">Heart-Shaped Box</a></td></tr>
+</tbody></table></body></html>"""
+
+WIKI_PAGE = b"""<html><body>
+<h1 class="header-new-title">Nirvana</h1>
+<div class="wiki-content"><p>Nirvana was an American <b>rock</b> band.</p>
+<!-- comment --><p>Formed in 1987.</p></div>
+<section class="buffer-standard hidden-xs"><ol>
+<li><a class="link-block-target" href="/music/Hole">Hole</a></li>
+<li><a class="link-block-target" href="/music/Mudhoney">Mud<i>honey</i></a></li>
+<li><a href="/music/Melvins">Melvins</a></li>
+</ol></section></body></html>"""
+
+
+@pytest.mark.parametrize("number", [0, 1, 3, 10])
+def test_extract_toptracks(number: int) -> None:
+    tracks = ["Smells Like Teen Spirit", "Come as You Are", "Lithium"]
+    tracks.append("Heart-Shaped Box")
+    artist, titles = extract.extract_toptracks(TRACKS_PAGE, number)
+    assert artist == "Nirvana"
+    assert titles == tracks[:number]
+
+
+def test_extract_toptracks_chunks(monkeypatch) -> None:
+    monkeypatch.setattr(extract, "CHUNK_SIZE", 7)
+    assert extract.extract_toptracks(TRACKS_PAGE, 2) == (
+        "Nirvana",
+        ["Smells Like Teen Spirit", "Come as You Are"],
+    )
+
+
+def test_extract_bio() -> None:
+    name, summary, similar = extract.extract_bio(WIKI_PAGE)
+    assert name == "Nirvana"
+    assert summary == "Nirvana was an American rock band.\nFormed in 1987."
+    assert similar == ["Hole", "Mudhoney"]
+    assert extract.extract_bio(WIKI_PAGE, name_only=True) == ("Nirvana", None, [])
+
+
+def test_extract_errors() -> None:
+    with pytest.raises(ValueError):
+        extract.extract_toptracks(b"<html><body>Page not found</body></html>")
+    with pytest.raises(ValueError):
+        extract.extract_bio(b"<html><body>Page not found</body></html>")
+    with pytest.raises(ValueError):
+        extract.extract_bio(WIKI_PAGE.split(b"<section")[0])
+
+
+def yt_results_page(contents: str) -> bytes:
+    data = (
+        '{"contents":{"twoColumnSearchResultsRenderer":{"primaryContents":'
+        '{"sectionListRenderer":{"contents":[{"itemSectionRenderer":{"contents":['
+        f"{contents}"
+        "]}}]}}}}}"
+    )
+    return (
+        '<html><script>var ytcfg = {"videoRenderer":{"videoId":"notThisOne"}};</script>'
+        f"<script>var ytInitialData = {data};</script>"
+        '<script>var other = {"videoRenderer":{"videoId":"norThisOne"}};</script></html>'
+    ).encode()
+
+
+def test_extract_video_id() -> None:
+    video = (
+        '{"videoRenderer":{"videoId":"hTWKbfoikeg","thumbnail":{}}},'
+        '{"videoRenderer":{"videoId":"vabnZ9-ex7o"}}'
+    )
+    assert extract.extract_video_id(yt_results_page(video)) == "hTWKbfoikeg"
+    channel = '{"channelRenderer":{"channelId":"UC123"}},'
+    reordered = '{"videoRenderer":{"thumbnail":{},"videoId":"pkcJEvMcnEg"}}'
+    assert extract.extract_video_id(yt_results_page(channel + reordered)) == (
+        "pkcJEvMcnEg"
+    )
+
+
+def test_extract_video_id_errors() -> None:
+    with pytest.raises(ValueError):
+        extract.extract_video_id(b"<html>Something went wrong</html>")
+    with pytest.raises(ValueError):
+        extract.extract_video_id(yt_results_page('{"channelRenderer":{}}'))
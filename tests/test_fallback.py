@@ -0,0 +1,94 @@
+import asyncio
+from typing import Callable, List
+
+import pytest
+
+from bot.fetching import fallback
+
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_path(
+    calls: List[str], name: str, delay: float, fail: bool = False
+) -> Callable:
+    async def path() -> str:
+        calls.append(name)
+        await asyncio.sleep(delay)
+        if fail:
+            raise ValueError(name)
+        return name
+
+    return path
+
+
+async def test_sequential() -> None:
+    calls: List[str] = []
+    paths = [
+        ("api", make_path(calls, "api", 0, fail=True)),
+        ("noapi", make_path(calls, "noapi", 0)),
+        ("other", make_path(calls, "other", 0)),
+    ]
+    res = await fallback.first_valid("test_sequential", paths, "x", fallback.SEQUENTIAL)
+    assert res == "noapi"
+    assert calls == ["api", "noapi"]
+    assert fallback.FALLBACKS.value(operation="test_sequential", path="noapi") == 1
+
+
+async def test_all_paths_fail() -> None:
+    calls: List[str] = []
+    paths = [
+        ("api", make_path(calls, "api", 0, fail=True)),
+        ("noapi", make_path(calls, "noapi", 0, fail=True)),
+    ]
+    for mode in fallback.MODES:
+        with pytest.raises(ValueError):
+            await fallback.first_valid("test_fail", paths, "x", mode)
+
+
+async def test_hedged(monkeypatch) -> None:
+    monkeypatch.setattr(fallback, "HEDGE_DELAY", 0.01)
+    calls: List[str] = []
+    paths = [
+        ("api", make_path(calls, "api", 1)),
+        ("noapi", make_path(calls, "noapi", 0.01)),
+    ]
+    res = await fallback.first_valid("test_hedged", paths, "x", fallback.HEDGED)
+    assert res == "noapi"
+    assert calls == ["api", "noapi"]
+    calls.clear()
+    paths = [
+        ("api", make_path(calls, "api", 0)),
+        ("noapi", make_path(calls, "noapi", 0)),
+    ]
+    res = await fallback.first_valid("test_hedged", paths, "x", fallback.HEDGED)
+    assert res == "api"
+    assert calls == ["api"]
+
+
+async def test_race() -> None:
+    calls: List[str] = []
+    paths = [
+        ("api", make_path(calls, "api", 1)),
+        ("noapi", make_path(calls, "noapi", 0.01)),
+    ]
+    res = await fallback.first_valid("test_race", paths, "x", fallback.RACE)
+    assert res == "noapi"
+    assert calls == ["api", "noapi"]
+    assert (
+        fallback.LATENCY.count(operation="test_race", path="noapi", outcome="ok") == 1
+    )
+    assert fallback.LATENCY.count(operation="test_race", path="api", outcome="ok") == 0
+
+
+async def test_unknown_mode() -> None:
+    with pytest.raises(ValueError):
+        await fallback.first_valid("test", [], "x", "unknown")
+
+
+def test_hedge_delay(monkeypatch) -> None:
+    monkeypatch.setattr(fallback, "HEDGE_MIN_SAMPLES", 10)
+    assert fallback.hedge_delay("test_delay", "api") == fallback.HEDGE_DELAY
+    for _ in range(10):
+        fallback.LATENCY.observe(0.2, operation="test_delay", path="api", outcome="ok")
+    assert 0.1 < fallback.hedge_delay("test_delay", "api") <= 0.25
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+from asyncpg.connection import Connection
+
+from bot import db, jobs
+from bot.exceptions import JobFailedError, JobTimeoutError, PlaylistRetrievalError
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_enqueue(db_conn: Connection) -> None:
+    job_id = await jobs.enqueue("nirvana", 3)
+    assert await jobs.enqueue("nirvana", 3, ["Nirvana - Lithium"]) == job_id
+    assert await jobs.enqueue("nirvana", 5) != job_id
+    record = await db_conn.fetchrow("SELECT * FROM job WHERE id = $1", job_id)
+    assert record["status"] == jobs.QUEUED
+    assert record["playlist"] == ["Nirvana - Lithium"]
+    await jobs.finish(job_id, tracks=["a", None, "c"])
+    # finished jobs aren't reused
+    assert await jobs.enqueue("nirvana", 3) != job_id
+
+
+async def test_claim(db_conn: Connection) -> None:
+    first = await jobs.enqueue("nirvana", 3)
+    second = await jobs.enqueue("slipknot", 3)
+    async with db_conn.transaction():
+        job = await jobs.claim(db_conn)
+        assert job["id"] == first
+        assert job["attempts"] == 1
+        # the job locked by the transaction above is skipped by other workers
+        async with db.acquire() as conn:
+            assert (await jobs.claim(conn))["id"] == second
+            assert await jobs.claim(conn) is None
+
+
+async def test_claim_abandoned(db_conn: Connection, monkeypatch) -> None:
+    job_id = await jobs.enqueue("nirvana", 3)
+    assert (await jobs.claim(db_conn))["id"] == job_id
+    assert await jobs.claim(db_conn) is None
+    monkeypatch.setattr(jobs, "JOB_TIMEOUT", 0)
+    job = await jobs.claim(db_conn)
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+
+async def test_wait_job(db_conn: Connection, monkeypatch) -> None:
+    # waiters are woken up by notifications rather than by polling
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL", 60)
+    job_id = await jobs.enqueue("nirvana", 3)
+    waiter = asyncio.create_task(jobs.wait_job(job_id, timeout=5))
+    await asyncio.sleep(0.1)
+    assert not waiter.done()
+    await jobs.finish(job_id, tracks=["a", None, "c"])
+    assert await asyncio.wait_for(waiter, 1) == ["a", None, "c"]
+    assert await jobs.wait_job(job_id) == ["a", None, "c"]
+
+
+async def test_wait_job_failed(db_conn: Connection) -> None:
+    job_id = await jobs.enqueue("nirvana", 3)
+    with pytest.raises(JobTimeoutError):
+        await jobs.wait_job(job_id, timeout=0.1)
+    # the job isn't given up and can still be waited for
+    job = await db_conn.fetchrow("SELECT * FROM job WHERE id = $1", job_id)
+    assert job["status"] == jobs.QUEUED
+    await jobs.finish(job_id, error=PlaylistRetrievalError("nirvana"))
+    with pytest.raises(PlaylistRetrievalError):
+        await jobs.wait_job(job_id)
+    job_id = await jobs.enqueue("nirvana", 3)
+    await jobs.finish(job_id, error=KeyError("artist"))
+    with pytest.raises(JobFailedError):
+        await jobs.wait_job(job_id)
+    with pytest.raises(JobFailedError):
+        await jobs.wait_job(-1)
+
+
+async def test_purge_jobs(db_conn: Connection) -> None:
+    finished = await jobs.enqueue("nirvana", 3)
+    await jobs.finish(finished, tracks=["a"])
+    queued = await jobs.enqueue("slipknot", 3)
+    assert await jobs.purge_jobs(1) == 0
+    await db_conn.execute(
+        "UPDATE job SET finished_at = now() - interval '2 hours' WHERE id = $1",
+        finished,
+    )
+    assert await jobs.purge_jobs(1) == 1
+    ids = [r["id"] for r in await db_conn.fetch("SELECT id FROM job")]
+    assert ids == [queued]
@@ -26,6 +26,22 @@ async def test_get_playlist(
         await func(bad_keyphrase)
 
 
+@pytest.mark.parametrize(
+    "func",
+    [lastfm.get_toptracks_api, lastfm.get_toptracks_noapi, lastfm.get_toptracks],
+)
+async def test_get_toptracks(
+    func: Callable, name_corrections: Dict[str, str], bad_keyphrase: str
+) -> None:
+    for key, name in name_corrections.items():
+        artist, playlist = await func(key)
+        assert artist == name
+        assert len(playlist) == 3
+        assert all(i.startswith(f"{name} - ") for i in playlist)
+    with pytest.raises(Exception):
+        await func(bad_keyphrase)
+
+
 async def test_playlists_equality(track_nums: List[int], keyphrase: str) -> None:
     for n in track_nums:
         res1 = await lastfm.get_playlist_api(keyphrase, n)
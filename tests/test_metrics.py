@@ -0,0 +1,90 @@
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from bot import metrics
+
+
+def test_counter() -> None:
+    counter = metrics.Counter("test_counter_total", "Test counter", ("path",))
+    assert counter in metrics.REGISTRY
+    counter.inc(path="api")
+    counter.inc(2, path="api")
+    counter.inc(path="noapi")
+    assert counter.value(path="api") == 3
+    assert counter.value(path="noapi") == 1
+    assert list(counter.samples()) == [
+        ("test_counter_total", {"path": "api"}, 3),
+        ("test_counter_total", {"path": "noapi"}, 1),
+    ]
+    with pytest.raises(ValueError):
+        counter.inc(backend="api")
+
+
+def test_gauge() -> None:
+    gauge = metrics.Gauge("test_gauge", "Test gauge")
+    gauge.inc(3)
+    gauge.dec()
+    assert gauge.value() == 2
+    gauge.set(10)
+    assert gauge.value() == 10
+    gauge.set_function(lambda: 42)
+    assert gauge.value() == 42
+    assert list(gauge.samples()) == [("test_gauge", {}, 42)]
+
+
+def test_histogram() -> None:
+    histogram = metrics.Histogram(
+        "test_histogram_seconds", "Test histogram", ("path",), buckets=(1, 2, 4)
+    )
+    assert histogram.quantile(0.5, path="api") is None
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        histogram.observe(value, path="api")
+    assert histogram.count(path="api") == 5
+    assert histogram.quantile(0.5, path="api") == pytest.approx(1.75)
+    assert histogram.quantile(0.99, path="api") == 4
+    samples = {
+        (name, labels.get("le")): value for name, labels, value in histogram.samples()
+    }
+    assert samples[("test_histogram_seconds_bucket", "1.0")] == 1
+    assert samples[("test_histogram_seconds_bucket", "2.0")] == 3
+    assert samples[("test_histogram_seconds_bucket", "+Inf")] == 5
+    assert samples[("test_histogram_seconds_sum", None)] == 16.5
+    assert samples[("test_histogram_seconds_count", None)] == 5
+
+
+def test_stage() -> None:
+    count = metrics.STAGE_SECONDS.count(stage="test_stage")
+    with metrics.stage("test_stage"):
+        pass
+    with pytest.raises(KeyError):
+        with metrics.stage("test_stage"):
+            raise KeyError("test")
+    assert metrics.STAGE_SECONDS.count(stage="test_stage") == count + 2
+    assert metrics.EXCEPTIONS.value(stage="test_stage", type="KeyError") == 1
+
+
+def test_render() -> None:
+    counter = metrics.Counter("test_render_total", "Test render", ("path",))
+    counter.inc(path='a "quoted"\\path')
+    text = metrics.render()
+    assert text.endswith("\n")
+    assert "# HELP test_render_total Test render\n" in text
+    assert "# TYPE test_render_total counter\n" in text
+    assert 'test_render_total{path="a \\"quoted\\"\\\\path"} 1\n' in text
+
+
+def test_http_server() -> None:
+    server = metrics.start_http_server(0, "127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urlopen(f"{url}/metrics") as res:
+            assert res.status == 200
+            assert res.headers["Content-Type"].startswith("text/plain")
+            assert "# TYPE ttbot_stage_seconds histogram" in res.read().decode()
+        with pytest.raises(HTTPError) as e:
+            urlopen(f"{url}/other")
+        assert e.value.code == 404
+    finally:
+        server.shutdown()
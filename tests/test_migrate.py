@@ -0,0 +1,52 @@
+import datetime
+import json
+import os
+import shutil
+
+import pytest
+from asyncpg.connection import Connection
+
+from bot import migrate
+
+
+@pytest.mark.asyncio
+async def test_migrate(db_conn: Connection, reset_sql_path: str, tmp_path) -> None:
+    versions = [version for version, _, _ in migrate.load_migrations()]
+    assert await migrate.migrate(db_conn) == []
+    with open(reset_sql_path, "r") as f:
+        await db_conn.execute(f.read())
+    # data stored before the schema overhaul is converted
+    shutil.copy(
+        os.path.join(migrate.MIGRATIONS_DIR, "0001_initial.sql"),
+        tmp_path / "0001_initial.sql",
+    )
+    assert await migrate.migrate(db_conn, str(tmp_path)) == [1]
+    today = datetime.datetime.now().date()
+    await db_conn.execute(
+        "INSERT INTO top (artist, tracks, date, requests) VALUES ($1, $2, $3, 5)",
+        "nirvana",
+        json.dumps(["a", None, "c"]),
+        today,
+    )
+    assert await migrate.migrate(db_conn) == versions[1:]
+    record = await db_conn.fetchrow(
+        "SELECT * FROM top JOIN counter USING (artist) WHERE artist = $1", "nirvana"
+    )
+    assert record["tracks"] == ["a", None, "c"]
+    assert record["date"] == today
+    assert record["requests"] == 5
+    applied = await db_conn.fetch("SELECT version FROM schema_migrations")
+    assert sorted(r["version"] for r in applied) == versions
+
+
+def test_load_migrations(tmp_path) -> None:
+    (tmp_path / "0001_first.sql").write_text("SELECT 1;")
+    (tmp_path / "0002_second.sql").write_text("SELECT 2;")
+    (tmp_path / "README").write_text("not a migration")
+    assert migrate.load_migrations(str(tmp_path)) == [
+        (1, "first", "SELECT 1;"),
+        (2, "second", "SELECT 2;"),
+    ]
+    (tmp_path / "2_other.sql").write_text("SELECT 3;")
+    with pytest.raises(ValueError):
+        migrate.load_migrations(str(tmp_path))
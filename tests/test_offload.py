@@ -0,0 +1,49 @@
+import pytest
+
+from bot.fetching import offload
+from bot.fetching.extract import extract_toptracks
+
+
+pytestmark = pytest.mark.asyncio
+
+PAGE = (
+    b'<html><body><h1 class="header-new-title">Nirvana</h1>'
+    + b'<a href="/nav" class="nav">Nav</a>' * 10000
+    + b'<a href="/1" title="Lithium">Lithium</a></body></html>'
+)
+
+
+async def test_parse_inline() -> None:
+    inline = offload.PARSES.value(where="inline")
+    assert await offload.parse(extract_toptracks, PAGE, 1) == ("Nirvana", ["Lithium"])
+    assert offload.PARSES.value(where="inline") == inline + 1
+    with pytest.raises(ValueError):
+        await offload.parse(extract_toptracks, b"<html></html>", 1)
+    assert offload.PARSES.value(where="inline") == inline + 1
+
+
+async def test_parse_process(monkeypatch) -> None:
+    await offload.start_pool(1)
+    try:
+        process = offload.PARSES.value(where="process")
+        inline = offload.PARSES.value(where="inline")
+        assert await offload.parse(extract_toptracks, PAGE, 1) == (
+            "Nirvana",
+            ["Lithium"],
+        )
+        assert offload.PARSES.value(where="process") == process + 1
+        assert offload.QUEUED.value() == 0
+        # small pages and pages above the queue limit are parsed inline
+        await offload.parse(extract_toptracks, PAGE[:100] + b"</h1>", 0)
+        monkeypatch.setattr(offload, "PARSE_MAX_QUEUE", 0)
+        await offload.parse(extract_toptracks, PAGE, 1)
+        assert offload.PARSES.value(where="process") == process + 1
+        assert offload.PARSES.value(where="inline") == inline + 2
+        monkeypatch.setattr(offload, "PARSE_MAX_QUEUE", 1)
+        with pytest.raises(ValueError):
+            await offload.parse(extract_toptracks, b"<html></html>" * 10000)
+        # pages that failed to parse aren't counted
+        assert offload.PARSES.value(where="process") == process + 1
+        assert offload.QUEUED.value() == 0
+    finally:
+        await offload.stop_pool()
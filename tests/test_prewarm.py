@@ -0,0 +1,123 @@
+import asyncio
+import datetime
+from typing import List
+
+import pytest
+from asyncpg.connection import Connection
+
+from bot import aliases, prewarm, processing
+from bot.fetching.client import priority
+from bot.exceptions import QuotaBudgetError
+from bot.fetching import youtube
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_select_artists(db_conn: Connection, insert_top, monkeypatch) -> None:
+    monkeypatch.setattr(prewarm, "MAX_STALE_DAYS", 10)
+    today = datetime.datetime.now().date()
+    expiring = today - datetime.timedelta(days=processing.VALID_FOR_DAYS - 1)
+    stale = today - datetime.timedelta(days=processing.VALID_FOR_DAYS + 5)
+    for artist, day, requests in [
+        ("fresh", today, 100),
+        ("rare", expiring, 1),
+        ("popular", expiring, 50),
+        ("stale", stale, 10),
+        ("abandoned", today - datetime.timedelta(days=100), 1000),
+    ]:
+        await insert_top(artist, [], day, requests)
+    assert await prewarm.select_artists(10, 3) == [
+        ("popular", expiring),
+        ("stale", stale),
+        ("rare", expiring),
+    ]
+    assert await prewarm.select_artists(1, 3) == [("popular", expiring)]
+
+
+async def test_prewarm(db_conn: Connection, insert_top, monkeypatch) -> None:
+    today = datetime.datetime.now().date()
+    expired = today - datetime.timedelta(days=processing.VALID_FOR_DAYS + 1)
+    for i in range(5):
+        await insert_top(f"artist{i}", [], expired, 10 - i)
+    refreshed: List[str] = []
+
+    async def refresh_top(artist: str) -> None:
+        assert priority.get() == "background"
+        for _ in range(3):
+            with youtube.charge(100, "search"):
+                pass
+        refreshed.append(artist)
+        await db_conn.execute(
+            "UPDATE top SET tracks = $2, date = $3 WHERE artist = $1",
+            artist,
+            ["a", "b", "c"],
+            today,
+        )
+
+    monkeypatch.setattr(prewarm, "refresh_top", refresh_top)
+    monkeypatch.setattr(prewarm, "MAX_STALE_DAYS", 10)
+    monkeypatch.setattr(prewarm, "PREWARM_LASTFM_RATE", 0)
+    monkeypatch.setattr(prewarm, "PREWARM_CONCURRENCY", 1)
+    monkeypatch.setattr(prewarm, "PREWARM_YOUTUBE_UNITS", 900)
+    units = prewarm.UNITS.value()
+    await prewarm.prewarm()
+    assert refreshed == ["artist0", "artist1", "artist2"]
+    assert prewarm.UNITS.value() - units == 900
+    assert priority.get() == "interactive"
+
+    # the first request after the replaced data expired would have waited for a fetch
+    await aliases.save_alias("artist0", "artist0")
+    avoided = processing.MISSES_AVOIDED.value()
+    await processing.get_top("artist0")
+    await processing.get_top("artist0")
+    assert processing.MISSES_AVOIDED.value() == avoided + 1
+
+
+async def test_prewarm_budget(db_conn: Connection, insert_top, monkeypatch) -> None:
+    today = datetime.datetime.now().date()
+    expired = today - datetime.timedelta(days=processing.VALID_FOR_DAYS + 1)
+    for i in range(5):
+        await insert_top(f"artist{i}", [], expired, 10 - i)
+    fallbacks = 0
+
+    async def refresh_top(artist: str) -> None:
+        nonlocal fallbacks
+        for _ in range(3):
+            try:
+                with youtube.charge(100, "search"):
+                    await asyncio.sleep(0.01)
+            except QuotaBudgetError:
+                fallbacks += 1
+
+    monkeypatch.setattr(prewarm, "refresh_top", refresh_top)
+    monkeypatch.setattr(prewarm, "MAX_STALE_DAYS", 10)
+    monkeypatch.setattr(prewarm, "PREWARM_LASTFM_RATE", 0)
+    monkeypatch.setattr(prewarm, "PREWARM_CONCURRENCY", 4)
+    monkeypatch.setattr(prewarm, "PREWARM_YOUTUBE_UNITS", 500)
+    units = prewarm.UNITS.value()
+    spent = youtube.API_UNITS.value(method="search", priority="background")
+    # background requests made at the same time aren't charged to the run
+    token = priority.set("background")
+    try:
+        with youtube.charge(100, "search"):
+            pass
+    finally:
+        priority.reset(token)
+    await prewarm.prewarm()
+    # refreshes in flight don't overshoot the budget, the rest are skipped
+    assert prewarm.UNITS.value() - units == 500
+    assert fallbacks == 12 - 5
+    assert (
+        youtube.API_UNITS.value(method="search", priority="background") == spent + 600
+    )
+
+
+async def test_count_avoided_miss() -> None:
+    today = datetime.datetime.now().date()
+    avoided = processing.MISSES_AVOIDED.value()
+    processing.mark_prewarmed("expiring", today - datetime.timedelta(days=1))
+    processing.count_avoided_miss("expiring")
+    processing.count_avoided_miss("unknown")
+    assert processing.MISSES_AVOIDED.value() == avoided
+    assert "expiring" in processing.prewarmed
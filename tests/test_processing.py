@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import json
 from typing import Dict, List
@@ -5,21 +6,41 @@ from typing import Dict, List
 import pytest
 from asyncpg.connection import Connection
 
-from bot import processing
+from bot import aliases, counters, db, processing
 from bot.exceptions import PlaylistRetrievalError
+from bot.fetching import lastfm
+from bot.fetching.client import BACKGROUND, INTERACTIVE, priority
+from bot.runner import wait_background
 
 
 pytestmark = pytest.mark.asyncio
 
 
-async def test_get_artist(get_artist_cases: Dict[str, str]) -> None:
+async def test_get_artist(
+    db_conn: Connection, get_artist_cases: Dict[str, str]
+) -> None:
     for key in get_artist_cases:
         res = await processing.get_artist(key)
         assert res == get_artist_cases[key]
 
 
+async def test_get_artist_alias(db_conn: Connection) -> None:
+    await aliases.save_alias("norvana", "nirvana")
+    aliases.alias_cache.clear()
+    assert await processing.get_artist(" Norvana ") == "nirvana"
+    assert "norvana" in aliases.alias_cache
+
+
+async def test_get_artist_and_playlist(db_conn: Connection, keyphrase: str) -> None:
+    artist, playlist = await processing.get_artist_and_playlist("Norvana")
+    assert artist == keyphrase.lower()
+    assert playlist == await lastfm.get_playlist(keyphrase)
+    await aliases.save_alias("norvana", artist)
+    assert await processing.get_artist_and_playlist("Norvana") == (artist, None)
+
+
 async def test_create_top(
-    track_nums: List[int], keyphrase: str, bad_keyphrase: str
+    db_conn: Connection, track_nums: List[int], keyphrase: str, bad_keyphrase: str
 ) -> None:
     for n in track_nums:
         res = await processing.create_top(keyphrase, n)
@@ -41,17 +62,17 @@ async def test_get_top(db_conn: Connection, keyphrase: str, yt_ids_num: int) ->
 async def test_create_record(db_conn: Connection, keyphrase: str) -> None:
     keyphrase_low = keyphrase.lower()
     record = await db_conn.fetchrow(
-        "SELECT * FROM top WHERE artist = $1", keyphrase_low
+        "SELECT * FROM top JOIN counter USING (artist) WHERE artist = $1", keyphrase_low
     )
     assert record is None
     await processing.get_top(keyphrase)
     record = await db_conn.fetchrow(
-        "SELECT * FROM top WHERE artist = $1", keyphrase_low
+        "SELECT * FROM top JOIN counter USING (artist) WHERE artist = $1", keyphrase_low
     )
     assert record
     assert all(col in record for col in ("artist", "tracks", "date", "requests"))
     assert record["artist"] == keyphrase_low
-    tracks = json.loads(record["tracks"])
+    tracks = record["tracks"]
     assert isinstance(tracks, list)
     assert len(tracks) == 3
     assert all(isinstance(t, str) for t in tracks)
@@ -59,57 +80,256 @@ async def test_create_record(db_conn: Connection, keyphrase: str) -> None:
     assert record["requests"] == 1
 
 
-async def test_update_record(db_conn: Connection, keyphrase: str) -> None:
+async def test_update_record(db_conn: Connection, keyphrase: str, insert_top) -> None:
     keyphrase_low = keyphrase.lower()
     old_date = (
         datetime.datetime.now() - datetime.timedelta(days=processing.VALID_FOR_DAYS + 1)
     ).date()
     mock_tracks = ["a", "b", "c"]
-    mock_tracks_json = json.dumps(mock_tracks)
-    await db_conn.execute(
-        "INSERT INTO top (artist, tracks, date, requests) VALUES ($1, $2, $3, 1)",
-        keyphrase_low,
-        mock_tracks_json,
-        old_date,
-    )
+    await insert_top(keyphrase_low, mock_tracks, old_date)
     record = await db_conn.fetchrow(
-        "SELECT * FROM top WHERE artist = $1", keyphrase_low
+        "SELECT * FROM top JOIN counter USING (artist) WHERE artist = $1", keyphrase_low
     )
     assert record
     assert record["artist"] == keyphrase_low
-    assert record["tracks"] == mock_tracks_json
+    assert record["tracks"] == mock_tracks
     assert record["date"] == old_date
     assert record["requests"] == 1
     real_tracks = await processing.get_top(keyphrase)
+    await counters.flush_requests()
     record = await db_conn.fetchrow(
-        "SELECT * FROM top WHERE artist = $1", keyphrase_low
+        "SELECT * FROM top JOIN counter USING (artist) WHERE artist = $1", keyphrase_low
     )
     assert record
     assert record["artist"] == keyphrase_low
-    assert record["tracks"] != mock_tracks_json
+    assert record["tracks"] != mock_tracks
     assert record["date"] == datetime.datetime.now().date()
     assert record["requests"] == 2
     assert real_tracks != mock_tracks
 
 
-async def test_find_record(db_conn: Connection, keyphrase: str) -> None:
+async def test_find_record(db_conn: Connection, keyphrase: str, insert_top) -> None:
     keyphrase_low = keyphrase.lower()
     mock_tracks = ["a", "b", "c"]
-    mock_tracks_json = json.dumps(mock_tracks)
     today = datetime.datetime.now().date()
-    await db_conn.execute(
-        "INSERT INTO top (artist, tracks, date, requests) VALUES ($1, $2, $3, 1)",
-        keyphrase_low,
-        mock_tracks_json,
-        today,
-    )
+    await insert_top(keyphrase_low, mock_tracks, today)
     res = await processing.get_top(keyphrase)
     assert res == mock_tracks
+    await counters.flush_requests()
     record = await db_conn.fetchrow(
-        "SELECT * FROM top WHERE artist = $1", keyphrase_low
+        "SELECT * FROM top JOIN counter USING (artist) WHERE artist = $1", keyphrase_low
     )
     assert record
     assert record["artist"] == keyphrase_low
-    assert record["tracks"] == mock_tracks_json
+    assert record["tracks"] == mock_tracks
     assert record["date"] == today
     assert record["requests"] == 2
+
+
+async def test_find_cached(db_conn: Connection, keyphrase: str, insert_top) -> None:
+    keyphrase_low = keyphrase.lower()
+    mock_tracks = ["a", "b", "c"]
+    today = datetime.datetime.now().date()
+    await insert_top(keyphrase_low, mock_tracks, today)
+    assert await processing.get_top(keyphrase) == mock_tracks
+    await db_conn.execute("DELETE FROM top WHERE artist = $1", keyphrase_low)
+    assert await processing.get_top(f" {keyphrase.upper()} ") == mock_tracks
+    assert ("artist", keyphrase_low) in processing.top_cache
+    assert ("keyphrase", keyphrase_low) in processing.top_cache
+
+
+async def test_serve_stale(
+    db_conn: Connection, keyphrase: str, insert_top, monkeypatch
+) -> None:
+    keyphrase_low = keyphrase.lower()
+    mock_tracks = ["a", "b", "c"]
+    new_tracks = ["d", "e", "f"]
+    today = datetime.datetime.now().date()
+    await aliases.save_alias(keyphrase_low, keyphrase_low)
+    updates = []
+    priorities = []
+
+    async def update_top(artist: str, playlist=None, number=3) -> List[str]:
+        updates.append(artist)
+        priorities.append(priority.get())
+        return new_tracks
+
+    monkeypatch.setattr(processing, "update_top", update_top)
+    monkeypatch.setattr(processing, "MAX_STALE_DAYS", 10)
+    await insert_top(
+        keyphrase_low,
+        mock_tracks,
+        today - datetime.timedelta(days=processing.VALID_FOR_DAYS + 5),
+    )
+    assert await asyncio.gather(
+        processing.get_top(keyphrase), processing.get_top(f" {keyphrase} ")
+    ) == [mock_tracks, mock_tracks]
+    await wait_background()
+    assert updates == [keyphrase_low]
+    assert processing.top_cache.get(("artist", keyphrase_low))[1] == new_tracks
+    processing.top_cache.clear()
+    await db_conn.execute(
+        "UPDATE top SET date = $2 WHERE artist = $1",
+        keyphrase_low,
+        today - datetime.timedelta(days=processing.VALID_FOR_DAYS + 10),
+    )
+    assert await processing.get_top(keyphrase) == new_tracks
+    assert updates == [keyphrase_low, keyphrase_low]
+    # only the refresh of stale data is made in the background
+    assert priorities == [BACKGROUND, INTERACTIVE]
+
+
+async def test_fetch_top(monkeypatch) -> None:
+    async def get_video_ids_by_position(playlist: List[str]) -> List[str]:
+        return [track.upper() for track in playlist]
+
+    monkeypatch.setattr(
+        processing, "get_video_ids_by_position", get_video_ids_by_position
+    )
+    playlist = ["a - 1", "a - 2", "a - 3"]
+    assert await processing.fetch_top("a", 2, playlist) == ["A - 1", "A - 2"]
+    assert await processing.fetch_top("a", 5, playlist, start=1) == [
+        "A - 2",
+        "A - 3",
+        None,
+        None,
+    ]
+    assert processing.select(["a", None, "c", "d"], 3) == ["a", "c"]
+
+
+async def test_extend_top(
+    db_conn: Connection, keyphrase: str, insert_top, monkeypatch
+) -> None:
+    keyphrase_low = keyphrase.lower()
+    today = datetime.datetime.now().date()
+    await aliases.save_alias(keyphrase_low, keyphrase_low)
+    searched = []
+
+    async def get_playlist(keyphrase: str, number: int = 3) -> List[str]:
+        return [f"{keyphrase} - {i}" for i in range(number)]
+
+    async def get_video_ids_by_position(playlist: List[str]) -> List[str]:
+        searched.extend(playlist)
+        return [track[-1] for track in playlist]
+
+    monkeypatch.setattr(processing, "get_playlist", get_playlist)
+    monkeypatch.setattr(
+        processing, "get_video_ids_by_position", get_video_ids_by_position
+    )
+    await insert_top(
+        keyphrase_low, ["a", None, "c"], today - datetime.timedelta(days=1)
+    )
+    assert await processing.get_top(keyphrase) == ["a", "c"]
+    assert await processing.get_top(keyphrase, 5) == ["a", "c", "3", "4"]
+    assert searched == [f"{keyphrase_low} - 3", f"{keyphrase_low} - 4"]
+    assert await processing.get_top(keyphrase, 4) == ["a", "c", "3"]
+    assert len(searched) == 2
+    record = await db_conn.fetchrow(
+        "SELECT * FROM top JOIN counter USING (artist) WHERE artist = $1", keyphrase_low
+    )
+    assert record["tracks"] == ["a", None, "c", "3", "4"]
+    assert record["date"] == today - datetime.timedelta(days=1)
+
+
+async def test_publish_top(db_conn: Connection, monkeypatch) -> None:
+    today = datetime.datetime.now().date()
+    published = asyncio.Queue()
+    await db.get_listener().subscribe(processing.TOP_CHANNEL, published.put_nowait)
+
+    async def fetch_top(
+        keyphrase: str, number: int = 3, playlist=None, start: int = 0
+    ) -> List[str]:
+        return ["a", None, "c", "d", "e"][start:number]
+
+    monkeypatch.setattr(processing, "fetch_top", fetch_top)
+    await processing.update_top("nirvana")
+    change = json.loads(await asyncio.wait_for(published.get(), 1))
+    assert change["origin"] == processing.INSTANCE_ID
+    assert change["artist"] == "nirvana"
+    assert change["tracks"] == ["a", None, "c"]
+    assert change["date"] == today.isoformat()
+    # tracks are extended without changing the date, so other instances drop them
+    await processing.extend_top("nirvana", ["a", None, "c"], 5)
+    change = json.loads(await asyncio.wait_for(published.get(), 1))
+    assert change["tracks"] is None
+    assert change["date"] is None
+
+
+async def test_cache_sync(db_conn: Connection) -> None:
+    today = datetime.datetime.now().date()
+    expires = processing.expiration(today)
+    # metrics are global, so only their changes made by this test are checked
+    synced = processing.SYNCED.value(action="updated")
+    lags = processing.SYNC_LAG.count()
+    await processing.start_cache_sync()
+
+    async def publish(artist: str, tracks=None, origin: str = "other") -> None:
+        change = {
+            "origin": origin,
+            "artist": artist,
+            "tracks": tracks,
+            "date": today.isoformat() if tracks else None,
+            "sent": datetime.datetime.now().timestamp(),
+        }
+        await db_conn.execute(
+            "SELECT pg_notify($1, $2)", processing.TOP_CHANNEL, json.dumps(change)
+        )
+        await asyncio.sleep(0.1)
+
+    processing.cache_top("nirvana", ["a", "b", "c"], expires)
+    await publish("nirvana", ["d", "e", "f"])
+    assert processing.top_cache.get(("artist", "nirvana")) == (expires, ["d", "e", "f"])
+    assert processing.SYNCED.value(action="updated") == synced + 1
+    assert processing.SYNC_LAG.count() == lags + 1
+    # changes made by this instance are already in its cache
+    await publish("nirvana", origin=processing.INSTANCE_ID)
+    assert ("artist", "nirvana") in processing.top_cache
+    await publish("nirvana")
+    assert ("artist", "nirvana") not in processing.top_cache
+    # artists missing from the cache aren't added
+    await publish("slipknot", ["a", "b", "c"])
+    assert ("artist", "slipknot") not in processing.top_cache
+    # changes are missed while the connection is lost, so the cache is cleared
+    processing.cache_top("nirvana", ["a", "b", "c"], expires)
+    await db.get_listener()._conn.close()
+    assert await db.get_listener().ensure()
+    assert len(processing.top_cache) == 0
+
+
+async def test_stored_tracks_dont_shrink(
+    db_conn: Connection, keyphrase: str, insert_top, monkeypatch
+) -> None:
+    keyphrase_low = keyphrase.lower()
+    today = datetime.datetime.now().date()
+    await aliases.save_alias(keyphrase_low, keyphrase_low)
+
+    async def fetch_top(
+        keyphrase: str, number: int = 3, playlist=None, start: int = 0
+    ) -> List[str]:
+        # the narrower request finishes last
+        await asyncio.sleep(0.1 if number == 5 else 0)
+        return [str(i) for i in range(start, number)]
+
+    monkeypatch.setattr(processing, "fetch_top", fetch_top)
+    await insert_top(keyphrase_low, ["0", "1", "2"], today)
+    # concurrent extensions of the same row to different widths
+    assert await asyncio.gather(
+        processing.get_top(keyphrase, 5), processing.get_top(keyphrase, 10)
+    ) == [[str(i) for i in range(5)], [str(i) for i in range(10)]]
+
+    async def stored() -> List[str]:
+        return await db_conn.fetchval(
+            "SELECT tracks FROM top WHERE artist = $1", keyphrase_low
+        )
+
+    assert await stored() == [str(i) for i in range(10)]
+    # data of the same day isn't replaced with fewer tracks, older data is
+    await processing.update_top(keyphrase_low, number=5)
+    assert len(await stored()) == 10
+    await db_conn.execute(
+        "UPDATE top SET date = $2 WHERE artist = $1",
+        keyphrase_low,
+        today - datetime.timedelta(days=1),
+    )
+    await processing.update_top(keyphrase_low, number=5)
+    assert len(await stored()) == 5
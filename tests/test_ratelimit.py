@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+import pytest
+
+from bot.ratelimit import TokenBucket
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_token_bucket() -> None:
+    bucket = TokenBucket(rate=20, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.05, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    start = time.monotonic()
+    await asyncio.gather(bucket.acquire(), bucket.acquire())
+    assert time.monotonic() - start == pytest.approx(0.2, abs=0.05)
+
+
+async def test_token_bucket_pause() -> None:
+    bucket = TokenBucket(rate=10, capacity=5)
+    bucket.pause(0.3)
+    assert bucket.reserve() == pytest.approx(0.3, abs=0.02)
+    await asyncio.sleep(0.6)
+    assert bucket.tokens() == pytest.approx(3, abs=0.2)
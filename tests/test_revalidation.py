@@ -0,0 +1,94 @@
+import datetime
+from typing import List, Set
+
+import pytest
+from asyncpg.connection import Connection
+
+from bot import processing, revalidation
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_revalidate_videos(db_conn: Connection, insert_top, monkeypatch) -> None:
+    today = datetime.datetime.now().date()
+    old_date = today - datetime.timedelta(days=10)
+    await insert_top("nirvana", ["ok1", "dead1", None], today)
+    await insert_top("slipknot", ["ok2", "dead2"], today)
+    await db_conn.executemany(
+        "INSERT INTO video (track, video_id, date) VALUES ($1, $2, $3)",
+        [
+            ("nirvana - lithium", "ok1", old_date),
+            ("nirvana - polly", "dead1", old_date),
+            ("slipknot - duality", "dead2", old_date),
+        ],
+    )
+    checked: List[List[str]] = []
+
+    async def get_available_ids_api(video_ids: List[str]) -> Set[str]:
+        checked.append(video_ids)
+        return {i for i in video_ids if i.startswith("ok")}
+
+    async def get_yt_id(track: str) -> str:
+        if track == "slipknot - duality":
+            raise ValueError("not found")
+        return "new1"
+
+    monkeypatch.setattr(revalidation, "get_available_ids_api", get_available_ids_api)
+    monkeypatch.setattr(revalidation, "get_yt_id", get_yt_id)
+    monkeypatch.setattr(revalidation, "MAX_STALE_DAYS", 10)
+    processing.cache_top(
+        "slipknot", ["ok2", "dead2"], processing.expiration(today), keyphrase="slipknot"
+    )
+    await revalidation.revalidate_videos()
+    assert checked == [["dead1", "dead2", "ok1", "ok2"]]
+    videos = {
+        r["track"]: (r["video_id"], r["date"])
+        for r in await db_conn.fetch("SELECT * FROM video")
+    }
+    assert videos == {
+        "nirvana - lithium": ("ok1", today),
+        "nirvana - polly": ("new1", today),
+    }
+    tops = {r["artist"]: r for r in await db_conn.fetch("SELECT * FROM top")}
+    assert tops["nirvana"]["tracks"] == ["ok1", "new1", None]
+    assert tops["nirvana"]["date"] == today
+    assert tops["slipknot"]["date"] == today - datetime.timedelta(
+        days=revalidation.VALID_FOR_DAYS + 10
+    )
+    # the cached copy with the removed video is dropped as well
+    assert ("artist", "slipknot") not in processing.top_cache
+
+
+async def test_revalidate_videos_concurrent_update(
+    db_conn: Connection, insert_top, monkeypatch
+) -> None:
+    today = datetime.datetime.now().date()
+    await insert_top("nirvana", ["ok1", "dead1"], today)
+    await insert_top("slipknot", ["dead2"], today)
+    await db_conn.executemany(
+        "INSERT INTO video (track, video_id, date) VALUES ($1, $2, $3)",
+        [("nirvana - polly", "dead1", today), ("slipknot - duality", "dead2", today)],
+    )
+
+    async def get_available_ids_api(video_ids: List[str]) -> Set[str]:
+        return {i for i in video_ids if i.startswith("ok")}
+
+    async def get_yt_id(track: str) -> str:
+        # both rows are rebuilt while replacements are searched for
+        await db_conn.execute(
+            "UPDATE top SET tracks = $2 WHERE artist = $1",
+            track.split(" - ")[0],
+            ["fresh1", "fresh2", "fresh3"],
+        )
+        if track == "slipknot - duality":
+            raise ValueError("not found")
+        return "new1"
+
+    monkeypatch.setattr(revalidation, "get_available_ids_api", get_available_ids_api)
+    monkeypatch.setattr(revalidation, "get_yt_id", get_yt_id)
+    await revalidation.revalidate_videos()
+    tops = {r["artist"]: r for r in await db_conn.fetch("SELECT * FROM top")}
+    for artist in ("nirvana", "slipknot"):
+        assert tops[artist]["tracks"] == ["fresh1", "fresh2", "fresh3"]
+        assert tops[artist]["date"] == today
@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+from typing import Any, List
+
+import pytest
+
+from bot import run
+from bot.exceptions import JobTimeoutError
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_deliver_top_job_timeout(monkeypatch) -> None:
+    sent: List[str] = []
+
+    def send_chat_action(**kwargs: Any) -> bool:
+        return True
+
+    def send_message(chat_id: int, text: str, **kwargs: Any) -> None:
+        sent.append(text)
+
+    async def get_top(keyphrase: str, number: int = 3) -> List[str]:
+        raise JobTimeoutError(1)
+
+    monkeypatch.setattr(run, "get_top", get_top)
+    bot = SimpleNamespace(send_chat_action=send_chat_action, send_message=send_message)
+    update = SimpleNamespace(message=SimpleNamespace(chat_id=1, text="Nirvana"))
+    await run.deliver_top(update, SimpleNamespace(bot=bot, args=[]), "Nirvana", 3)
+    # the user is asked to come back rather than told about an unexpected error
+    assert sent == [
+        "It takes longer than usual to find top tracks of Nirvana, "
+        "try again in a minute."
+    ]
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+from typing import List
+
+from bot.runner import INFLIGHT, LoopRunner, cancel_scheduled, schedule
+
+
+def test_loop_runner() -> None:
+    loops: List[asyncio.AbstractEventLoop] = []
+
+    async def hook() -> None:
+        loops.append(asyncio.get_running_loop())
+
+    async def work(n: int) -> int:
+        loops.append(asyncio.get_running_loop())
+        await asyncio.sleep(0.01)
+        return n * 2
+
+    runner = LoopRunner(max_inflight=2)
+    runner.start(hook())
+    futures = [runner.submit(work(n)) for n in range(5)]
+    assert [f.result(timeout=5) for f in futures] == [0, 2, 4, 6, 8]
+    runner.stop(hook())
+    assert len(loops) == 7
+    assert all(loop is runner.loop for loop in loops)
+    assert runner.loop.is_closed()
+    assert INFLIGHT.value() == 0
+
+
+def test_loop_runner_max_inflight() -> None:
+    release = threading.Event()
+
+    async def block() -> None:
+        await asyncio.get_running_loop().run_in_executor(None, release.wait)
+
+    runner = LoopRunner(max_inflight=1)
+    runner.start()
+    runner.submit(block())
+    submitted = threading.Event()
+    thread = threading.Thread(target=lambda: (runner.submit(block()), submitted.set()))
+    thread.start()
+    assert not submitted.wait(0.1)
+    release.set()
+    assert submitted.wait(5)
+    thread.join()
+    runner.stop()
+
+
+def test_schedule() -> None:
+    calls = 0
+
+    async def job() -> None:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise ValueError("failures don't stop the schedule")
+
+    async def main() -> None:
+        schedule(0.01, job, "test")
+        await asyncio.sleep(0.1)
+        await cancel_scheduled()
+
+    asyncio.run(main())
+    assert calls > 2
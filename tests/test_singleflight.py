@@ -0,0 +1,102 @@
+import asyncio
+from typing import Tuple
+
+import pytest
+
+from bot.fetching.client import BACKGROUND, INTERACTIVE, priority
+from bot.singleflight import COALESCED, INFLIGHT, WAITERS, SingleFlight
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_single_flight() -> None:
+    flight = SingleFlight("test")
+    calls = 0
+    release = asyncio.Event()
+
+    async def fetch() -> str:
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "result"
+
+    callers = [asyncio.ensure_future(flight.do("key", fetch)) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert flight.waiters("key") == 5
+    assert WAITERS.value(flight="test") == 5
+    assert INFLIGHT.value(flight="test") == 1
+    release.set()
+    results = await asyncio.gather(*callers)
+    assert calls == 1
+    assert [r for r, _ in results] == ["result"] * 5
+    assert [coalesced for _, coalesced in results].count(False) == 1
+    assert COALESCED.value(flight="test") == 4
+    assert flight.waiters("key") == 0
+    assert WAITERS.value(flight="test") == 0
+    assert INFLIGHT.value(flight="test") == 0
+    assert await flight.do("key", fetch) == ("result", False)
+    assert calls == 2
+
+
+async def test_single_flight_exception() -> None:
+    flight = SingleFlight("test_exception")
+
+    async def fail() -> None:
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    callers = [flight.do("key", fail) for _ in range(3)]
+    results = await asyncio.gather(*callers, return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight.waiters("key") == 0
+
+
+async def test_single_flight_leader_cancelled() -> None:
+    flight = SingleFlight("test_cancelled")
+
+    async def fetch() -> str:
+        await asyncio.sleep(0.01)
+        return "result"
+
+    leader = asyncio.ensure_future(flight.do("key", fetch))
+    follower = asyncio.ensure_future(flight.do("key", fetch))
+    await asyncio.sleep(0)
+    leader.cancel()
+    assert await follower == ("result", True)
+
+
+async def test_single_flight_priority() -> None:
+    flight = SingleFlight("test_priority")
+    release = asyncio.Event()
+    priorities = []
+
+    async def fetch() -> str:
+        priorities.append(priority.get())
+        await release.wait()
+        return priority.get()
+
+    async def call() -> Tuple[str, bool]:
+        return await flight.do("key", fetch)
+
+    token = priority.set(BACKGROUND)
+    background = asyncio.ensure_future(call())
+    follower = asyncio.ensure_future(call())
+    priority.reset(token)
+    await asyncio.sleep(0)
+    # an interactive caller doesn't wait behind background requests
+    interactive = asyncio.ensure_future(call())
+    await asyncio.sleep(0)
+    token = priority.set(BACKGROUND)
+    late = asyncio.ensure_future(call())
+    priority.reset(token)
+    await asyncio.sleep(0)
+    release.set()
+    assert await background == (BACKGROUND, False)
+    assert await follower == (BACKGROUND, True)
+    assert await interactive == (INTERACTIVE, False)
+    # later callers join the interactive call
+    assert await late == (INTERACTIVE, True)
+    assert priorities == [BACKGROUND, INTERACTIVE]
+    assert flight.waiters("key") == 0
+    assert await flight.do("key", fetch) == (INTERACTIVE, False)
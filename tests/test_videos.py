@@ -0,0 +1,59 @@
+import datetime
+from typing import List
+
+import pytest
+from asyncpg.connection import Connection
+
+from bot import videos
+from bot.exceptions import VideoIDsRetrievalError
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_save_video_ids(db_conn: Connection) -> None:
+    await videos.save_video_ids({"nirvana - lithium": "pkcJEvMcnEg"})
+    record = await db_conn.fetchrow(
+        "SELECT * FROM video WHERE track = $1", "nirvana - lithium"
+    )
+    assert record["video_id"] == "pkcJEvMcnEg"
+    assert record["date"] == datetime.datetime.now().date()
+    assert "nirvana - lithium" in videos.video_cache
+
+
+async def test_load_video_ids(db_conn: Connection) -> None:
+    today = datetime.datetime.now().date()
+    old_date = today - datetime.timedelta(days=videos.VIDEO_VALID_FOR_DAYS + 1)
+    await db_conn.executemany(
+        "INSERT INTO video (track, video_id, date) VALUES ($1, $2, $3)",
+        [
+            ("nirvana - lithium", "pkcJEvMcnEg", today),
+            ("nirvana - polly", "a", old_date),
+        ],
+    )
+    res = await videos.load_video_ids(
+        ["nirvana - lithium", "nirvana - polly", "nirvana - in bloom"]
+    )
+    assert res == {"nirvana - lithium": "pkcJEvMcnEg"}
+
+
+async def test_get_video_ids_by_position(
+    db_conn: Connection, monkeypatch, playlist: List[str], expected_yt_ids: List[str]
+) -> None:
+    searched = []
+
+    async def get_yt_id(track: str) -> str:
+        searched.append(track)
+        if track == playlist[-1]:
+            raise VideoIDsRetrievalError(track)
+        return expected_yt_ids[playlist.index(track)]
+
+    monkeypatch.setattr(videos, "get_yt_id", get_yt_id)
+    await videos.save_video_ids({videos.track_key(playlist[0]): expected_yt_ids[0]})
+    expected = expected_yt_ids[:-1] + [None]
+    assert await videos.get_video_ids_by_position(playlist) == expected
+    assert searched == playlist[1:]
+    videos.video_cache.clear()
+    assert await videos.get_video_ids_by_position(playlist) == expected
+    # only the track without a found ID is searched again
+    assert searched == playlist[1:] + playlist[-1:]
@@ -0,0 +1,67 @@
+import asyncio
+from typing import List, Optional
+
+import pytest
+from asyncpg.connection import Connection
+
+from bot import db, jobs, processing, worker
+from bot.exceptions import JobFailedError, PlaylistRetrievalError
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_process_job(db_conn: Connection, monkeypatch) -> None:
+    async def update_top(
+        artist: str, playlist: Optional[List[str]] = None, number: int = 3
+    ) -> List[Optional[str]]:
+        if artist == "unknown":
+            raise PlaylistRetrievalError(artist)
+        return ["a", None, "c"][:number]
+
+    monkeypatch.setattr(worker, "update_top", update_top)
+    assert not await worker.process_job()
+    done = await jobs.enqueue("nirvana", 3)
+    failed = await jobs.enqueue("unknown", 3)
+    assert await worker.process_job()
+    assert await worker.process_job()
+    assert not await worker.process_job()
+    assert await jobs.wait_job(done) == ["a", None, "c"]
+    with pytest.raises(PlaylistRetrievalError):
+        await jobs.wait_job(failed)
+    # jobs abandoned too many times aren't run again
+    abandoned = await jobs.enqueue("nirvana", 3)
+    await db_conn.execute("UPDATE job SET attempts = 3 WHERE id = $1", abandoned)
+    assert await worker.process_job()
+    with pytest.raises(JobFailedError):
+        await jobs.wait_job(abandoned)
+
+
+async def test_job_queue(db_conn: Connection, monkeypatch) -> None:
+    fetched = []
+
+    async def update_top(
+        artist: str, playlist: Optional[List[str]] = None, number: int = 3
+    ) -> List[Optional[str]]:
+        fetched.append(artist)
+        return ["a", "b", "c"][:number]
+
+    async def get_artist_and_playlist(keyphrase: str, number: int = 3):
+        return keyphrase.lower(), None
+
+    monkeypatch.setattr(worker, "update_top", update_top)
+    monkeypatch.setattr(processing, "JOB_QUEUE", True)
+    monkeypatch.setattr(processing, "get_artist_and_playlist", get_artist_and_playlist)
+    queued, stopped = asyncio.Event(), asyncio.Event()
+    await db.get_listener().subscribe(jobs.QUEUED_CHANNEL, lambda _: queued.set())
+    task = asyncio.create_task(worker.work(queued, stopped))
+    try:
+        assert await processing.get_top("Nirvana") == ["a", "b", "c"]
+    finally:
+        stopped.set()
+        queued.set()
+        await task
+    assert fetched == ["nirvana"]
+    # the bot caches the result of the job
+    assert await processing.get_top("Nirvana") == ["a", "b", "c"]
+    assert fetched == ["nirvana"]
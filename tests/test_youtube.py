@@ -1,8 +1,10 @@
 import json
-from typing import Callable, List
+from typing import Callable, Dict, List
 
+import httpx
 import pytest
 
+from bot.exceptions import QuotaBudgetError, RateLimitError
 from bot.fetching import youtube
 
 
@@ -39,3 +41,93 @@ async def test_get_yt_ids(playlist: List[str], expected_yt_ids: List[str]) -> No
     assert all(isinstance(i, str) for i in res)
     json.dumps(res)
     assert res == expected_yt_ids
+
+
+async def test_charge() -> None:
+    spent = youtube.API_UNITS.value(method="search", priority="interactive")
+    with youtube.charge(100, "search"):
+        pass
+    run_budget = youtube.QuotaBudget(150)
+    token = youtube.budget.set(run_budget)
+    try:
+        with youtube.charge(100, "search"):
+            # units are taken before the request is made
+            assert run_budget.remaining() == 50
+        with pytest.raises(QuotaBudgetError):
+            with youtube.charge(100, "search"):
+                pass
+        # requests rejected by the rate limit aren't sent, so they cost nothing
+        with pytest.raises(RateLimitError):
+            with youtube.charge(1, "videos"):
+                raise RateLimitError("www.googleapis.com")
+        assert run_budget.spent == 100
+        with pytest.raises(ValueError):
+            with youtube.charge(1, "videos"):
+                raise ValueError("failed request")
+    finally:
+        youtube.budget.reset(token)
+    assert run_budget.spent == 101
+    assert (
+        youtube.API_UNITS.value(method="search", priority="interactive") == spent + 200
+    )
+
+
+async def test_get_available_ids_api(monkeypatch) -> None:
+    requests = []
+    public = {"uploadStatus": "processed", "privacyStatus": "public"}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        items = [
+            {"id": "a", "status": public},
+            {"id": "b", "status": {**public, "privacyStatus": "private"}},
+            {"id": "c", "status": {**public, "uploadStatus": "rejected"}},
+            {
+                "id": "d",
+                "status": public,
+                "contentDetails": {"regionRestriction": {"blocked": ["DE"]}},
+            },
+        ]
+        return httpx.Response(200, json={"items": items})
+
+    http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(youtube, "get_client", lambda name: http)
+    # videos missing from the response were removed
+    assert await youtube.get_available_ids_api(["a", "b", "c", "d", "e"]) == {"a"}
+    # maxResults can't be combined with id, the API rejects such requests
+    assert dict(requests[0].url.params) == {
+        "part": "status,contentDetails",
+        "id": "a,b,c,d,e",
+        "key": youtube.YOUTUBE_API_KEY,
+    }
+    # only the region of the bot's users is taken into account if it is set
+    monkeypatch.setattr(youtube, "YOUTUBE_REGION", "US")
+    assert await youtube.get_available_ids_api(["a", "d"]) == {"a", "d"}
+    await http.aclose()
+
+
+@pytest.mark.parametrize(
+    "restriction, region, available",
+    [
+        ({}, "", True),
+        ({"blocked": []}, "", True),
+        ({"blocked": ["DE"]}, "", False),
+        ({"allowed": ["US"]}, "", False),
+        ({"blocked": ["DE"]}, "US", True),
+        ({"blocked": ["DE", "US"]}, "US", False),
+        ({"allowed": ["US"]}, "US", True),
+        ({"allowed": ["DE"]}, "US", False),
+    ],
+)
+def test_is_available(
+    restriction: Dict[str, List[str]], region: str, available: bool, monkeypatch
+) -> None:
+    monkeypatch.setattr(youtube, "YOUTUBE_REGION", region)
+    video = {
+        "status": {"uploadStatus": "processed", "privacyStatus": "unlisted"},
+        "contentDetails": {"regionRestriction": restriction},
+    }
+    assert youtube._is_available(video) is available
+    for upload_status in ("uploaded", "deleted", "failed", "rejected"):
+        video["status"]["uploadStatus"] = upload_status
+        assert not youtube._is_available(video)